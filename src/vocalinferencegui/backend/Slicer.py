@@ -1,41 +1,108 @@
+import math
+
 import numpy as np
 
 
-# This function is obtained from librosa.
+def block_energy(y, block, downmix=False, chunk_size=65536):
+    """
+    sum of squared samples of every block of the last axis, accumulated in float64 without copying the signal
+    :param y: the waveform, (samples,) or (..., samples)
+    :param block: block size in samples, a trailing partial block is kept
+    :param downmix: take the energy of the mean over the first axis, mixing about chunk_size samples at a time instead
+        of allocating a full length mono copy
+    :param chunk_size: number of samples mixed at a time when downmix is set
+    :return: array of shape (..., ceil(samples / block))
+    """
+    if downmix and y.ndim > 1:
+        step = max(1, chunk_size // block) * block
+        return np.concatenate([block_energy(y[:, i: i + step].mean(axis=0), block)
+                               for i in range(0, y.shape[-1], step)], axis=-1)
+    full = y.shape[-1] // block * block
+    blocks = y[..., :full].reshape(y.shape[:-1] + (-1, block))
+    energy = np.einsum("...ij,...ij->...i", blocks, blocks, dtype=np.float64)
+    if full < y.shape[-1]:
+        tail = y[..., full:]
+        energy = np.concatenate([energy, np.einsum("...i,...i->...", tail, tail, dtype=np.float64)[..., np.newaxis]],
+                                axis=-1)
+    return energy
+
+
+# The framing follows librosa.feature.rms, the power is computed from cumulative sums instead of strided frames.
 def get_rms(
     y,
     *,
     frame_length=2048,
     hop_length=512,
     pad_mode="constant",
+    downmix=False,
 ):
-    padding = (int(frame_length // 2), int(frame_length // 2))
-    y = np.pad(y, padding, mode=pad_mode)
-
-    axis = -1
-    # put our new within-frame axis at the end for now
-    out_strides = y.strides + tuple([y.strides[axis]])
-    # Reduce the shape on the framing axis
-    x_shape_trimmed = list(y.shape)
-    x_shape_trimmed[axis] -= frame_length - 1
-    out_shape = tuple(x_shape_trimmed) + tuple([frame_length])
-    xw = np.lib.stride_tricks.as_strided(
-        y, shape=out_shape, strides=out_strides
-    )
-    if axis < 0:
-        target_axis = axis - 1
+    """
+    centered, framed RMS in O(n) time without materializing the frames
+    :param y: the waveform, (samples,) or (..., samples) for multichannel input
+    :param frame_length: frame length in samples
+    :param hop_length: hop length in samples
+    :param pad_mode: np.pad mode used to center the frames, default is constant (zeros)
+    :param downmix: compute the RMS of the mean over the first axis of a (channels, samples) input
+    :return: array of shape (..., 1, n_frames), (1, n_frames) if downmix is set
+    """
+    y = np.asarray(y)
+    if downmix and pad_mode != "constant":
+        y, downmix = y.mean(axis=0), False
+    padding = int(frame_length // 2)
+    if pad_mode == "constant":
+        # zero padding adds no energy, so frames are clipped to the signal instead of copying it
+        offset = padding
     else:
-        target_axis = axis + 1
-    xw = np.moveaxis(xw, -1, target_axis)
-    # Downsample along the target axis
-    slices = [slice(None)] * xw.ndim
-    slices[axis] = slice(0, None, hop_length)
-    x = xw[tuple(slices)]
+        y = np.pad(y, [(0, 0)] * (y.ndim - 1) + [(padding, padding)], mode=pad_mode)
+        offset = 0
+    n_samples = y.shape[-1]
+    n_frames = (n_samples + 2 * offset - frame_length) // hop_length + 1
+
+    # every frame edge is a multiple of block, so frame energies are differences of a cumulative sum over blocks
+    block = math.gcd(hop_length, frame_length, offset)
+    energy = block_energy(y, block, downmix)
+    cumulative = np.zeros(energy.shape[:-1] + (energy.shape[-1] + 1,), dtype=np.float64)
+    np.cumsum(energy, axis=-1, out=cumulative[..., 1:])
 
-    # Calculate power
-    power = np.mean(np.abs(x) ** 2, axis=-2, keepdims=True)
+    start = (np.arange(n_frames) * hop_length - offset) // block
+    end = np.clip(start + frame_length // block, 0, energy.shape[-1])
+    start = np.clip(start, 0, energy.shape[-1])
+    power = (cumulative[..., end] - cumulative[..., start]) / frame_length
+    rms = np.sqrt(np.maximum(power, 0.))
+    if np.issubdtype(y.dtype, np.floating):
+        rms = rms.astype(y.dtype, copy=False)
+    return rms[..., np.newaxis, :]
 
-    return np.sqrt(power)
+
+def voiced_ranges(waveform, sr, threshold=-40., hop_size=10, min_interval=300, pad=500):
+    """
+    sample ranges that are not silent, for work that only has to run where there is sound
+    :param waveform: the audio, (samples,) or (channels, samples)
+    :param sr: sample rate of the audio
+    :param threshold: the dB threshold for silence detection
+    :param hop_size: frame length in milliseconds
+    :param min_interval: silences shorter than this many milliseconds are kept inside a range
+    :param pad: milliseconds of margin added on both sides of every range
+    :return: sorted, non overlapping list of (begin, end) sample ranges
+    """
+    hop = max(1, round(sr * hop_size / 1000))
+    rms = get_rms(waveform, frame_length=4 * hop, hop_length=hop, downmix=len(waveform.shape) > 1).squeeze(0)
+    voiced = np.flatnonzero(rms >= 10 ** (threshold / 20.))
+    if voiced.shape[0] == 0:
+        return []
+    # split where two voiced frames are further apart than the min interval
+    breaks = np.flatnonzero(np.diff(voiced) * hop > sr * min_interval / 1000)
+    begins = np.concatenate([voiced[:1], voiced[breaks + 1]]) * hop
+    ends = (np.concatenate([voiced[breaks], voiced[-1:]]) + 1) * hop
+    margin = round(sr * pad / 1000)
+    ranges = []
+    for begin, end in zip(begins, ends):
+        begin, end = max(0, int(begin) - margin), min(waveform.shape[-1], int(end) + margin)
+        if ranges and begin <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((begin, end))
+    return ranges
 
 
 class Slicer:
@@ -45,11 +112,18 @@ class Slicer:
                  min_length: int = 5000,
                  min_interval: int = 300,
                  hop_size: int = 20,
-                 max_sil_kept: int = 5000):
+                 max_sil_kept: int = 5000,
+                 channel_mode: str = "mean"):
+        """
+        :param channel_mode: how multichannel input is analysed, "mean" uses the energy of the downmix, "max" the
+            loudest channel of every frame, so a part sung on one channel of a stem is never treated as silence
+        """
         if not min_length >= min_interval >= hop_size:
             raise ValueError('The following condition must be satisfied: min_length >= min_interval >= hop_size')
         if not max_sil_kept >= hop_size:
             raise ValueError('The following condition must be satisfied: max_sil_kept >= hop_size')
+        if channel_mode not in ["mean", "max"]:
+            raise ValueError('channel_mode must be one of mean, max')
         min_interval = sr * min_interval / 1000
         self.threshold = 10 ** (threshold / 20.)
         self.hop_size = round(sr * hop_size / 1000)
@@ -57,21 +131,49 @@ class Slicer:
         self.min_length = round(sr * min_length / 1000 / self.hop_size)
         self.min_interval = round(min_interval / self.hop_size)
         self.max_sil_kept = round(sr * max_sil_kept / 1000 / self.hop_size)
+        self.channel_mode = channel_mode
 
     def _apply_slice(self, waveform, begin, end):
         if len(waveform.shape) > 1:
-            return waveform[:, begin * self.hop_size: min(waveform.shape[1], end * self.hop_size)]
+            return waveform[:, begin: end]
         else:
-            return waveform[begin * self.hop_size: min(waveform.shape[0], end * self.hop_size)]
+            return waveform[begin: end]
+
+    def _get_rms(self, waveform):
+        if len(waveform.shape) == 1:
+            return get_rms(y=waveform, frame_length=self.win_size, hop_length=self.hop_size).squeeze(0)
+        if self.channel_mode == "max":
+            return get_rms(y=waveform, frame_length=self.win_size, hop_length=self.hop_size).max(axis=0).squeeze(0)
+        return get_rms(y=waveform, frame_length=self.win_size, hop_length=self.hop_size, downmix=True).squeeze(0)
+
     # @timeit
-    def slice(self, waveform):
-        if len(waveform.shape) > 1:
-            samples = waveform.mean(axis=0)
+    def slice(self, waveform, envelope=None):
+        """
+        :param waveform: the audio, (samples,) or (channels, samples)
+        :param envelope: a precomputed envelope.Envelope of the waveform, re-slicing with it skips the RMS framing
+        :return: views of the waveform
+        """
+        return [self._apply_slice(waveform, begin, end) for begin, end in self.slice_ranges(waveform, envelope)]
+
+    def slice_ranges(self, waveform, envelope=None):
+        """
+        :param waveform: the audio, (samples,) or (channels, samples), a transposed view of interleaved
+            (samples, channels) audio works without copying
+        :param envelope: a precomputed envelope.Envelope of the waveform, only used in "mean" channel mode and when
+            its blocks are aligned with the frames, see envelope.aligned_hop
+        :return: list of (begin, end) sample ranges of the clips
+        """
+        n_samples = waveform.shape[-1]
+        if (n_samples + self.hop_size - 1) // self.hop_size <= self.min_length:
+            return [(0, n_samples)]
+        # an envelope whose blocks do not fall on the frame edges only approximates the RMS, it is computed again
+        if envelope is not None and (len(waveform.shape) == 1 or self.channel_mode == "mean") \
+                and envelope.aligned(frame_length=self.win_size, hop_length=self.hop_size):
+            rms_list = envelope.rms(frame_length=self.win_size, hop_length=self.hop_size).squeeze(0)
+            if np.issubdtype(waveform.dtype, np.floating):
+                rms_list = rms_list.astype(waveform.dtype, copy=False)
         else:
-            samples = waveform
-        if (samples.shape[0] + self.hop_size - 1) // self.hop_size <= self.min_length:
-            return [waveform]
-        rms_list = get_rms(y=samples, frame_length=self.win_size, hop_length=self.hop_size).squeeze(0)
+            rms_list = self._get_rms(waveform)
         sil_tags = []
         silence_start = None
         clip_start = 0
@@ -127,16 +229,16 @@ class Slicer:
             sil_tags.append((pos, total_frames + 1))
         # Apply and return slices.
         if len(sil_tags) == 0:
-            return [waveform]
+            return [(0, n_samples)]
         else:
-            chunks = []
+            frames = []
             if sil_tags[0][0] > 0:
-                chunks.append(self._apply_slice(waveform, 0, sil_tags[0][0]))
+                frames.append((0, sil_tags[0][0]))
             for i in range(len(sil_tags) - 1):
-                chunks.append(self._apply_slice(waveform, sil_tags[i][1], sil_tags[i + 1][0]))
+                frames.append((sil_tags[i][1], sil_tags[i + 1][0]))
             if sil_tags[-1][1] < total_frames:
-                chunks.append(self._apply_slice(waveform, sil_tags[-1][1], total_frames))
-            return chunks
+                frames.append((sil_tags[-1][1], total_frames))
+            return [(begin * self.hop_size, min(n_samples, end * self.hop_size)) for begin, end in frames]
 
 
 def get_parser():
@@ -0,0 +1,364 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+STAGES = ("separate", "convert")
+GiB = 1024 ** 3
+
+# (base bytes, bytes per sample of the whole track, bytes per sample of the window processed at once), used until a
+# stage and model has records. rough peaks of hdemucs_mmi and a 44k so-vits model on cpu
+PRIORS = {
+    "separate": (1.5 * GiB, 48., 1200.),
+    "convert": (1.2 * GiB, 24., 1500.),
+}
+# the smallest windows the guardrails go down to, seconds
+MIN_WINDOW = {"separate": 1., "convert": 5.}
+
+
+def available_memory() -> int:
+    """
+    :return: the memory the system can give without swapping, in bytes
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        with open("/proc/meminfo") as f:
+            info = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f}
+        return info.get("MemAvailable", info["MemFree"])
+
+
+def current_rss() -> int:
+    """
+    :return: the resident memory of this process in bytes
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakMonitor:
+    """
+    samples the resident memory of this process while a stage runs, peak is the highest resident memory of the whole
+    process, not its growth: the growth misses the memory the process kept from earlier jobs and reuses, and counts
+    the allocations of jobs running next to it
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def window_seconds(stage: str, duration: float, params: dict) -> float:
+    """
+    :return: the seconds of audio a stage processes at once with params, the model activations grow with it
+    """
+    if stage == "separate":
+        if params.get("split_mode", "segment") == "segment":
+            return min(duration, float(params.get("split_num", 5)))
+        return duration
+    if stage == "convert":
+        return min(duration, float(params.get("max_chunk_seconds", 40)))
+    raise ValueError(f"stage must be one of {', '.join(STAGES)}")
+
+
+@dataclass(slots=True)
+class MemoryRecord:
+    stage: str
+    model: str
+    duration: float
+    channels: int
+    sr: int
+    window: float
+    peak: int
+    created: float = field(default_factory=time.time)
+
+
+class MemoryModel:
+    """
+    predicts the peak memory of a stage from the audio and the parameters: a base for the loaded model, plus a part
+    that grows with the whole track (decoded input and outputs) and a part that grows with the window processed at
+    once (activations). the three coefficients of every stage and model are fitted by least squares to the recorded
+    runs, and a margin covering the worst recorded underestimate is added.
+    """
+
+    def __init__(self, path: Path = None, margin: float = 1.15):
+        """
+        :param path: the jsonl file of the records, default is memory_records.jsonl in the cache directory
+        :param margin: the minimum factor applied to every prediction, default is 1.15
+        """
+        if path is None:
+            from environment import cache_path
+            path = cache_path.joinpath("memory_records.jsonl")
+        self.path = Path(path)
+        self.margin = margin
+        self.records = []
+        self._fits = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                self.records = [MemoryRecord(**json.loads(line)) for line in f if line.strip()]
+
+    @staticmethod
+    def _features(duration: float, channels: int, sr: int, window: float) -> np.ndarray:
+        return np.array([1., duration * sr * channels, window * sr * channels])
+
+    def record(self, stage: str, model: str, duration: float, channels: int, sr: int, peak: int,
+               params: dict = None) -> MemoryRecord:
+        """
+        add a measured run, appended to the records file
+        """
+        record = MemoryRecord(stage, str(model), float(duration), int(channels), int(sr),
+                              window_seconds(stage, duration, params or {}), int(peak))
+        with self._lock:
+            self.records.append(record)
+            self._fits.pop((stage, record.model), None)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(asdict(record)) + "\n")
+        return record
+
+    def _fit(self, stage: str, model: str) -> tuple:
+        with self._lock:
+            if (stage, model) in self._fits:
+                return self._fits[(stage, model)]
+            records = [i for i in self.records if i.stage == stage and i.model == model]
+            prior = np.array(PRIORS[stage])
+            if len(records) < 3:
+                fit = (prior, self.margin)
+            else:
+                x = np.stack([self._features(i.duration, i.channels, i.sr, i.window) for i in records])
+                y = np.array([i.peak for i in records], dtype=np.float64)
+                # scale the columns so the base and the per sample terms are fitted with the same weight
+                scale = np.maximum(x.max(axis=0), 1.)
+                coefficients = np.clip(np.linalg.lstsq(x / scale, y, rcond=None)[0] / scale, 0, None)
+                underestimate = np.max(y / np.maximum(x @ coefficients, 1.))
+                fit = (coefficients, max(self.margin, float(underestimate) * 1.05))
+            self._fits[(stage, model)] = fit
+            return fit
+
+    def predict(self, stage: str, model: str, duration: float, channels: int, sr: int, params: dict = None) -> int:
+        """
+        :param stage: separate or convert
+        :param model: the name of the model, records of other models are not used
+        :param duration: the length of the audio in seconds
+        :param channels: the channels of the audio
+        :param sr: the sample rate the stage runs at
+        :param params: the arguments of the stage, split_mode and split_num or max_chunk_seconds
+        :return: the predicted peak memory in bytes
+        """
+        if stage not in STAGES:
+            raise ValueError(f"stage must be one of {', '.join(STAGES)}")
+        coefficients, margin = self._fit(stage, str(model))
+        features = self._features(duration, channels, sr, window_seconds(stage, duration, params or {}))
+        return int(features @ coefficients * margin)
+
+
+def downgrade(stage: str, params: dict, fits) -> dict | None:
+    """
+    the parameters of a lighter run of the stage: the separation switches to segment mode and halves the segment, in
+    whole seconds as demucs --segment takes an integer, the conversion halves the chunks it converts at once
+    :param fits: fits(params) -> whether the run with params fits in memory
+    :return: the first parameters that fit, None if even the smallest window does not
+    """
+    params = dict(params)
+    if stage == "separate":
+        if params.get("split_mode", "segment") != "segment":
+            params["split_mode"], params["split_num"] = "segment", params.get("split_num", 5) or 5
+        name = "split_num"
+    else:
+        name = "max_chunk_seconds"
+    params.setdefault(name, 5 if stage == "separate" else 40)
+    while not fits(params):
+        if params[name] <= MIN_WINDOW[stage]:
+            return None
+        params[name] = max(MIN_WINDOW[stage], params[name] / 2)
+        if stage == "separate":
+            params[name] = max(1, int(params[name]))
+    return params
+
+
+class Ticket:
+    """
+    the memory reserved for one admitted job, release it when the job ends
+    """
+
+    def __init__(self, controller: "AdmissionController", stage: str, model: str, duration: float, channels: int,
+                 sr: int, params: dict, predicted: int, downgraded: bool):
+        self.controller = controller
+        self.memory_model = controller.model
+        self.measure = controller.measure
+        self.stage = stage
+        self.model = model
+        self.duration = duration
+        self.channels = channels
+        self.sr = sr
+        self.params = params
+        self.predicted = predicted
+        self.downgraded = downgraded
+        self.monitor = None
+
+    def release(self):
+        if self.controller is not None:
+            self.controller._release(self)
+            self.controller = None
+
+    def __enter__(self):
+        if self.measure:
+            self.monitor = PeakMonitor().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.monitor is not None:
+            self.monitor.__exit__(exc_type, exc_val, exc_tb)
+            if exc_type is None:
+                self.memory_model.record(self.stage, self.model, self.duration, self.channels, self.sr, self.monitor.peak,
+                             self.params)
+        self.release()
+
+
+class AdmissionController:
+    """
+    starts jobs only while their predicted peaks fit in the memory budget together, the others wait in admit. a job
+    that would not fit even alone is downgraded to a smaller window before it waits, see downgrade.
+    """
+
+    def __init__(self, budget: int = None, model: MemoryModel = None, measure: bool = True):
+        """
+        :param budget: the memory the jobs may use together in bytes, default is 80% of the available memory
+        :param model: the memory model, default is the one recorded in the cache directory
+        :param measure: whether to measure the peak of the jobs run with the tickets and record it in the model, the
+            peak of the whole process is measured, so a record is the need of the job when it runs alone in a fresh
+            process, and more than it when the process holds models, memory of earlier jobs or other jobs
+        """
+        self.budget = int(available_memory() * 0.8) if budget is None else int(budget)
+        self.model = MemoryModel() if model is None else model
+        self.measure = measure
+        self.reserved = 0
+        self.running = 0
+        self._condition = threading.Condition()
+
+    def admit(self, stage: str, model: str, duration: float, channels: int, sr: int, params: dict = None,
+              timeout: float = None) -> Ticket:
+        """
+        wait until the job fits in the budget next to the running ones
+        :return: the ticket of the job, params of the ticket are the ones to run it with
+        :raise MemoryError: if the job does not fit in the budget even alone with the smallest window
+        :raise TimeoutError: if it did not fit after timeout seconds
+        """
+        params = dict(params or {})
+        predict = lambda p: self.model.predict(stage, model, duration, channels, sr, p)
+        downgraded = False
+        if predict(params) > self.budget:
+            lighter = downgrade(stage, params, lambda p: predict(p) <= self.budget)
+            if lighter is None:
+                raise MemoryError(f"{stage} of {duration:.0f}s with {model} needs {predict(params) / GiB:.1f} GiB at "
+                                  f"least, the budget is {self.budget / GiB:.1f} GiB")
+            print(f"{stage} downgraded from {params} to {lighter} to fit in {self.budget / GiB:.1f} GiB")
+            params, downgraded = lighter, True
+        predicted = predict(params)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.reserved + predicted <= self.budget, timeout):
+                raise TimeoutError(f"{stage} waited {timeout}s for {predicted / GiB:.1f} GiB")
+            self.reserved += predicted
+            self.running += 1
+        return Ticket(self, stage, str(model), duration, channels, sr, params, predicted, downgraded)
+
+    def _release(self, ticket: Ticket):
+        with self._condition:
+            self.reserved -= ticket.predicted
+            self.running -= 1
+            self._condition.notify_all()
+
+
+def _audio_info(path: Path) -> tuple:
+    """
+    :return: (duration in seconds, channels, sample rate) of an audio file
+    """
+    try:
+        import soundfile
+        info = soundfile.info(str(path))
+        return info.duration, info.channels, info.samplerate
+    except RuntimeError:
+        from ingest import FFPROBE
+        import subprocess
+        result = subprocess.run([FFPROBE, "-v", "error", "-select_streams", "a:0", "-show_entries",
+                                 "stream=channels,sample_rate:format=duration", "-of", "json", str(path)],
+                                capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe failed on {path}: {result.stderr.decode(errors='replace').strip()}")
+        info = json.loads(result.stdout)
+        return float(info["format"]["duration"]), int(info["streams"][0]["channels"]), \
+            int(info["streams"][0]["sample_rate"])
+
+
+_controller = None
+
+
+def default_controller() -> AdmissionController:
+    """
+    :return: the controller shared by the jobs of this process, with the budget in bytes from the memory_budget key
+        of environment.json when it is set
+    """
+    global _controller
+    if _controller is None:
+        from environment import config
+        _controller = AdmissionController(budget=config.get("memory_budget"))
+    return _controller
+
+
+def separate_vocal_admitted(track_path: Path, output_path: Path, controller: AdmissionController = None,
+                            **kwargs) -> dict[str, Path]:
+    """
+    functions.separate_vocal once the controller admits it, in segment mode with a smaller segment if the
+    track would not fit otherwise
+    """
+    from functions import separate_vocal
+    controller = default_controller() if controller is None else controller
+    duration, channels, _ = _audio_info(track_path)
+    from quantized import model_name
+    repo = kwargs.get("repo", r"../resources/files/models/demucs/hdemucs_mmi")
+    model = kwargs.get("backend", "torch") + ":" + model_name(repo)
+    with controller.admit("separate", model, duration, channels, 44100, kwargs) as ticket:
+        return separate_vocal(track_path, output_path, **ticket.params)
+
+
+def apply_so_vits_admitted(input_vocal: Path, output_path: Path, model_path: Path, config_file_path: Path,
+                           speaker: str, controller: AdmissionController = None, **kwargs) -> Path:
+    """
+    functions.apply_so_vits once the controller admits it, with shorter chunks if the vocal would not fit otherwise
+    """
+    from functions import apply_so_vits
+    controller = default_controller() if controller is None else controller
+    duration, _, _ = _audio_info(input_vocal)
+    with open(config_file_path) as f:
+        sr = json.load(f)["data"]["sampling_rate"]
+    model = kwargs.get("backend", "torch") + ":" + Path(model_path).name
+    with controller.admit("convert", model, duration, 1, sr, kwargs) as ticket:
+        return apply_so_vits(input_vocal, output_path, model_path, config_file_path, speaker, **ticket.params)
@@ -0,0 +1,286 @@
+import os
+import shutil
+import stat
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+POLICIES = ("lru", "lfu")
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    path: Path
+    kind: str
+    size: int
+    last_used: float
+    use_count: int = 0
+    pinned: bool = False
+    # files outside the roots its symlinks point to, e.g. huggingface cache blobs, -> the symlinks in between
+    links: dict = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class EvictionReport:
+    budget: int
+    total_bytes: int
+    removed: list = field(default_factory=list)
+    pinned_bytes: int = 0
+    dry_run: bool = False
+
+    @property
+    def freed_bytes(self) -> int:
+        return sum(i.size for i in self.removed)
+
+    @property
+    def remaining_bytes(self) -> int:
+        return self.total_bytes - self.freed_bytes
+
+    def __str__(self):
+        lines = [f"{'would remove' if self.dry_run else 'removed'} {len(self.removed)} entries, "
+                 f"{_format_size(self.freed_bytes)} of {_format_size(self.total_bytes)}, "
+                 f"budget {_format_size(self.budget)}, pinned {_format_size(self.pinned_bytes)}"]
+        for i in self.removed:
+            lines.append(f"  {i.kind:<8} {_format_size(i.size):>10}  used {i.use_count:>4}x  {i.path}")
+        if self.remaining_bytes > self.budget:
+            lines.append(f"still {_format_size(self.remaining_bytes - self.budget)} over budget, the rest is pinned")
+        return "\n".join(lines)
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def _link_chain(path: str) -> tuple:
+    """
+    :return: (the file a symlink finally points to, the symlinks after path on the way), the file is None when the
+        link is dangling
+    """
+    hops, seen = [], {path}
+    while os.path.islink(path):
+        path = os.path.join(os.path.dirname(path), os.readlink(path))
+        path = os.path.normpath(path)
+        if path in seen:
+            return None, hops
+        seen.add(path)
+        hops.append(path)
+    return (path if os.path.exists(path) else None), hops[:-1]
+
+
+def _walk(path: Path) -> tuple:
+    """
+    symlinks count with their own size, what they point to is returned apart, since removing the link frees nothing,
+    and so do hard links to a file that has other links
+    :return: (total size, latest access or modification time, {file a symlink points to: the symlinks in between}) of
+        a file or of every file under a directory
+    """
+    if path.is_symlink() or not path.is_dir():
+        files = [str(path)]
+    else:
+        files = [os.path.join(root, i) for root, _, names in os.walk(path) for i in names]
+    size, last_used, links = 0, None, {}
+    for i in files:
+        try:
+            info = os.lstat(i)
+        except OSError:
+            continue
+        size += info.st_size if info.st_nlink == 1 or stat.S_ISLNK(info.st_mode) else 0
+        if stat.S_ISLNK(info.st_mode):
+            # reading a symlink updates its access time, the scan itself would make every link look used
+            last_used = max(last_used or 0, info.st_mtime)
+            target, hops = _link_chain(i)
+            if target is not None and not target.startswith(str(path).rstrip("/") + "/"):
+                links[target] = hops
+        else:
+            last_used = max(last_used or 0, info.st_atime, info.st_mtime)
+    return size, path.lstat().st_mtime if last_used is None else last_used, links
+
+
+class CacheManager:
+    """
+    keeps the model, dataset and output directories under a disk budget.
+
+    every root is split into entries: models and datasets are evicted a directory at a time, outputs a file at a time.
+    the last use of an entry is taken from the catalog when it has a record, from the file times otherwise. pinned
+    entries (pinned in the catalog, or listed in pinned) are never evicted. a file that symlinks of a single entry point
+    to, like the huggingface cache blob of a model fetched by hub_fetch, counts for that entry and is removed with it,
+    one that several entries link stays until the last of them is evicted.
+    """
+
+    def __init__(self, roots: dict, budget: int, catalog=None, policy: str = "lru", pinned=(), sources_store=None):
+        """
+        :param roots: kind -> directory, kinds named "output" are evicted per file, the others per sub directory
+        :param budget: the disk budget in bytes
+        :param catalog: a catalog.Catalog holding the usage records
+        :param policy: lru evicts the least recently used first, lfu the least frequently used
+        :param pinned: paths that are never evicted, files or directories
+        :param sources_store: a sources_store.SourcesStore, local entries under evicted paths are removed from it
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+        self.roots = {kind: Path(path) for kind, path in roots.items()}
+        self.budget = budget
+        self.catalog = catalog
+        self.policy = policy
+        self.pinned = [Path(i).resolve() for i in pinned]
+        self.sources_store = sources_store
+
+    def _in_roots(self, path: str) -> bool:
+        path = Path(path).resolve()
+        return any(path == i.resolve() or i.resolve() in path.parents for i in self.roots.values())
+
+    def _is_pinned(self, path: Path) -> bool:
+        return any(path == i or i in path.parents or path in i.parents for i in self.pinned)
+
+    def scan(self) -> list:
+        """
+        :return: every entry under the roots
+        """
+        entries = []
+        for kind, root in self.roots.items():
+            if not root.exists():
+                continue
+            if kind == "output":
+                paths = [Path(i) for i in Path(root).rglob("*") if i.is_file()]
+            else:
+                paths = [i for i in root.iterdir() if not i.name.startswith(".")]
+            for path in paths:
+                path = path.parent.resolve().joinpath(path.name)
+                try:
+                    size, last_used, links = _walk(path)
+                except OSError:
+                    continue
+                entry = CacheEntry(path, kind, size, last_used, pinned=self._is_pinned(path), links=links)
+                if self.catalog is not None:
+                    usage = self.catalog.usage(path)
+                    if usage["last_used"] is not None:
+                        entry.last_used = usage["last_used"]
+                    entry.use_count = usage["use_count"]
+                    entry.pinned = entry.pinned or usage["pinned"]
+                entries.append(entry)
+        shared = Counter(target for entry in entries for target in entry.links)
+        for entry in entries:
+            # files under the roots are entries of their own, only the ones outside belong to the links
+            entry.links = {target: [i for i in hops if not self._in_roots(i)] for target, hops in entry.links.items()
+                           if not self._in_roots(target)}
+            for target in entry.links:
+                if shared[target] == 1:
+                    try:
+                        entry.size += os.stat(target).st_size
+                    except OSError:
+                        pass
+        return entries
+
+    def plan(self, budget: int = None, entries: list = None) -> EvictionReport:
+        """
+        choose the entries to evict without touching anything
+        :param budget: the budget in bytes, default is the budget of the manager
+        :param entries: the result of scan, scanned if None
+        """
+        budget = self.budget if budget is None else budget
+        entries = self.scan() if entries is None else entries
+        report = EvictionReport(budget=budget, total_bytes=sum(i.size for i in entries), dry_run=True,
+                                pinned_bytes=sum(i.size for i in entries if i.pinned))
+        if self.policy == "lru":
+            order = sorted((i for i in entries if not i.pinned), key=lambda i: i.last_used)
+        else:
+            order = sorted((i for i in entries if not i.pinned), key=lambda i: (i.use_count, i.last_used))
+        remaining = report.total_bytes
+        for entry in order:
+            if remaining <= budget:
+                break
+            report.removed.append(entry)
+            remaining -= entry.size
+        return report
+
+    def evict(self, budget: int = None, dry_run: bool = False) -> EvictionReport:
+        """
+        remove entries until the roots fit in the budget
+        :param budget: the budget in bytes, default is the budget of the manager
+        :param dry_run: only report what would be removed
+        """
+        entries = self.scan()
+        report = self.plan(budget, entries)
+        report.dry_run = dry_run
+        if dry_run:
+            return report
+        kept = {target for entry in entries if entry not in report.removed for target in entry.links}
+        for entry in report.removed:
+            try:
+                if entry.path.is_dir() and not entry.path.is_symlink():
+                    shutil.rmtree(entry.path)
+                else:
+                    entry.path.unlink()
+            except FileNotFoundError:
+                pass
+            for target, hops in entry.links.items():
+                if target in kept:
+                    continue
+                # the symlinks in between go too, a huggingface cache pointer without its blob is fetched again
+                for i in [*hops, target]:
+                    try:
+                        os.unlink(i)
+                    except FileNotFoundError:
+                        pass
+            if entry.kind == "output":
+                # drop the directories the output leaves empty, e.g. the track directories of demucs
+                parent = entry.path.parent
+                root = self.roots[entry.kind].resolve()
+                while parent != root and root in parent.parents and not any(parent.iterdir()):
+                    parent.rmdir()
+                    parent = parent.parent
+        if self.catalog is not None and report.removed:
+            self.catalog.remove(*(i.path for i in report.removed))
+        if self.sources_store is not None and report.removed:
+            self._forget_local([i.path for i in report.removed])
+        return report
+
+    def _forget_local(self, removed: list):
+        def walk(layer: dict):
+            for value in layer.values():
+                if not isinstance(value, dict):
+                    continue
+                local = value.get("local")
+                if isinstance(local, dict):
+                    for name, path in list(local.items()):
+                        path = Path(path).resolve()
+                        if any(path == i or i in path.parents for i in removed):
+                            del local[name]
+                elif isinstance(local, list):
+                    local[:] = [i for i in local if not any(Path(i).resolve() == j or j in Path(i).resolve().parents
+                                                            for j in removed)]
+                else:
+                    walk(value)
+
+        with self.sources_store.transaction():
+            walk(self.sources_store.sources)
+            self.sources_store.changed()
+
+
+def default_manager(policy: str = "lru") -> CacheManager:
+    """
+    :param policy: lru or lfu
+    :return: a manager over the configured model, dataset and output directories, with the budget in bytes and the
+        pinned paths from the cache_budget and pinned keys of environment.json
+    """
+    import environment
+    from catalog import open_catalog
+    from utilities import sources_store
+    return CacheManager(
+        {
+            "demucs": environment.demucs_model_path,
+            "so-vits": environment.so_vits_model_path,
+            "dataset": environment.so_vits_dataset_path,
+            "demucs-dataset": environment.demucs_dataset_path,
+            "output": environment.output_path,
+        },
+        budget=int(environment.config.get("cache_budget", 50 * 1024 ** 3)),
+        catalog=open_catalog(),
+        policy=policy,
+        pinned=environment.config.get("pinned", []),
+        sources_store=sources_store,
+    )
@@ -0,0 +1,408 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    engine TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    private INTEGER NOT NULL DEFAULT 0,
+    auth TEXT NOT NULL DEFAULT '{}',
+    link TEXT NOT NULL DEFAULT '[]',
+    extra TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (engine, file_type, name)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER REFERENCES sources(id) ON DELETE SET NULL,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    use_count INTEGER NOT NULL DEFAULT 0,
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    engine TEXT NOT NULL,
+    name TEXT NOT NULL,
+    speaker TEXT,
+    path TEXT NOT NULL UNIQUE,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slices (
+    id INTEGER PRIMARY KEY,
+    dataset_id INTEGER NOT NULL REFERENCES datasets(id) ON DELETE CASCADE,
+    path TEXT NOT NULL UNIQUE,
+    speaker TEXT,
+    begin INTEGER,
+    end INTEGER,
+    duration REAL,
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    engine TEXT NOT NULL,
+    speaker TEXT,
+    source_path TEXT,
+    params TEXT NOT NULL DEFAULT '{}',
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    use_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sources_engine ON sources (engine, file_type);
+CREATE INDEX IF NOT EXISTS blobs_source ON blobs (source_id);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+CREATE INDEX IF NOT EXISTS blobs_size ON blobs (size);
+CREATE INDEX IF NOT EXISTS datasets_engine ON datasets (engine, speaker);
+CREATE INDEX IF NOT EXISTS slices_dataset ON slices (dataset_id);
+CREATE INDEX IF NOT EXISTS slices_speaker ON slices (speaker);
+CREATE INDEX IF NOT EXISTS outputs_engine ON outputs (engine, speaker);
+CREATE INDEX IF NOT EXISTS outputs_speaker ON outputs (speaker);
+CREATE INDEX IF NOT EXISTS outputs_last_used ON outputs (last_used);
+CREATE INDEX IF NOT EXISTS outputs_size ON outputs (size);
+"""
+
+ORDERS = {"last_used": "last_used DESC", "oldest": "last_used ASC", "size": "size DESC", "created": "created DESC",
+          "path": "path ASC"}
+
+
+def _size(path: Path) -> int:
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return 0
+
+
+class Catalog:
+    """
+    sqlite index of the sources, downloaded files (blobs), datasets with their slices and generated outputs.
+    paths are stored resolved, last_used and use_count are updated with touch and are what cache eviction goes by.
+    """
+
+    def __init__(self, path: Path = ":memory:"):
+        """
+        :param path: the path of the database file, created if missing
+        """
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _execute(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            return [dict(i) for i in self._connection.execute(sql, parameters).fetchall()]
+
+    def _write(self, sql: str, rows: list) -> int:
+        """
+        run sql for every row in a single transaction
+        :return: the id of the last inserted row
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                cursor = self._connection.executemany(sql, rows) if len(rows) != 1 else \
+                    self._connection.execute(sql, rows[0])
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            return cursor.lastrowid
+
+    @staticmethod
+    def _where(filters: dict) -> tuple:
+        clauses, parameters = [], []
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column.startswith("min_"):
+                clauses.append(f"{column[4:]} >= ?")
+            elif column.startswith("max_"):
+                clauses.append(f"{column[4:]} <= ?")
+            else:
+                clauses.append(f"{column} = ?")
+            parameters.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", parameters
+
+    def _select(self, table: str, filters: dict, order_by: str = None, limit: int = None) -> list:
+        where, parameters = self._where(filters)
+        sql = f"SELECT * FROM {table}{where}"
+        if order_by is not None:
+            if order_by not in ORDERS:
+                raise ValueError(f"order_by must be one of {', '.join(ORDERS)}")
+            sql += " ORDER BY " + ORDERS[order_by]
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self._execute(sql, parameters)
+
+    # sources
+
+    def import_sources(self, sources: dict):
+        """
+        add or update the sources of a sources.json tree, local files are recorded as blobs
+        :param sources: engine -> file type -> name -> {"private", "auth", "link", "local", ...}
+        """
+        now = time.time()
+        source_rows, blob_rows = [], []
+        for engine, types in sources.items():
+            for file_type, entries in types.items():
+                for name, entry in entries.items():
+                    extra = {key: value for key, value in entry.items()
+                             if key not in ("private", "auth", "link", "local")}
+                    source_rows.append((engine, file_type, name, int(bool(entry.get("private", False))),
+                                        json.dumps(entry.get("auth", {})), json.dumps(entry.get("link", [])),
+                                        json.dumps(extra)))
+                    local = entry.get("local") or {}
+                    if isinstance(local, list):
+                        local = {Path(i).name: i for i in local}
+                    for file_name, path in local.items():
+                        path = str(Path(path).resolve())
+                        blob_rows.append((engine, file_type, name, file_name, path, _size(path), now, now))
+        if source_rows:
+            self._write("INSERT INTO sources (engine, file_type, name, private, auth, link, extra) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (engine, file_type, name) DO UPDATE SET "
+                        "private = excluded.private, auth = excluded.auth, link = excluded.link, "
+                        "extra = excluded.extra", source_rows)
+        if blob_rows:
+            self._write("INSERT INTO blobs (source_id, file_name, path, size, created, last_used) "
+                        "SELECT id, ?, ?, ?, ?, ? FROM sources WHERE engine = ? AND file_type = ? AND name = ? "
+                        "ON CONFLICT (path) DO UPDATE SET source_id = excluded.source_id, "
+                        "file_name = excluded.file_name, size = excluded.size",
+                        [row[3:] + row[:3] for row in blob_rows])
+
+    def export_sources(self, ignore_private: bool = False, include_local: bool = False) -> dict:
+        """
+        the sources as a sources.json tree, the same shape resource_manager.export_sources writes
+        :param ignore_private: whether to keep private sources
+        :param include_local: whether to fill local with the recorded files, export_sources leaves it empty
+        """
+        tree = {}
+        local = {}
+        if include_local:
+            for row in self._execute("SELECT source_id, file_name, path FROM blobs WHERE source_id IS NOT NULL"):
+                local.setdefault(row["source_id"], {})[row["file_name"]] = row["path"]
+        for row in self._execute("SELECT * FROM sources ORDER BY id"):
+            if row["private"] and not ignore_private:
+                continue
+            tree.setdefault(row["engine"], {}).setdefault(row["file_type"], {})[row["name"]] = {
+                "private": bool(row["private"]),
+                "auth": json.loads(row["auth"]),
+                "link": json.loads(row["link"]),
+                "local": local.get(row["id"], {}),
+                **json.loads(row["extra"]),
+            }
+        return tree
+
+    def sources(self, engine: str = None, file_type: str = None) -> list:
+        return self._select("sources", {"engine": engine, "file_type": file_type})
+
+    # blobs
+
+    def add_blob(self, path: Path, engine: str = None, file_type: str = None, name: str = None,
+                 file_name: str = None, pinned: bool = False):
+        """
+        record a downloaded file, optionally belonging to a source
+        """
+        now = time.time()
+        path = str(Path(path).resolve())
+        self._write("INSERT INTO blobs (source_id, file_name, path, size, created, last_used, pinned) "
+                    "VALUES ((SELECT id FROM sources WHERE engine = ? AND file_type = ? AND name = ?), ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET size = excluded.size, pinned = excluded.pinned",
+                    [(engine, file_type, name, file_name or Path(path).name, path, _size(path), now, now, int(pinned))])
+
+    def blobs(self, engine: str = None, name: str = None, pinned: bool = None, min_size: int = None,
+              max_size: int = None, order_by: str = None, limit: int = None) -> list:
+        where, parameters = self._where({"sources.engine": engine, "sources.name": name,
+                                         "pinned": None if pinned is None else int(pinned),
+                                         "min_size": min_size, "max_size": max_size})
+        sql = "SELECT blobs.*, sources.engine, sources.file_type, sources.name FROM blobs " \
+              "LEFT JOIN sources ON blobs.source_id = sources.id" + where
+        if order_by is not None:
+            if order_by not in ORDERS:
+                raise ValueError(f"order_by must be one of {', '.join(ORDERS)}")
+            sql += " ORDER BY blobs." + ORDERS[order_by]
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self._execute(sql, parameters)
+
+    def pin(self, path: Path, pinned: bool = True):
+        self._write("UPDATE blobs SET pinned = ? WHERE path = ?", [(int(pinned), str(Path(path).resolve()))])
+
+    # datasets and slices
+
+    def add_dataset(self, engine: str, name: str, path: Path, speaker: str = None) -> int:
+        """
+        :return: the id of the dataset
+        """
+        path = str(Path(path).resolve())
+        self._write("INSERT INTO datasets (engine, name, speaker, path, created) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET engine = excluded.engine, name = excluded.name, "
+                    "speaker = excluded.speaker", [(engine, name, speaker, path, time.time())])
+        return self._execute("SELECT id FROM datasets WHERE path = ?", (path,))[0]["id"]
+
+    def datasets(self, engine: str = None, speaker: str = None) -> list:
+        return self._select("datasets", {"engine": engine, "speaker": speaker})
+
+    def add_slices(self, dataset_id: int, slices: list):
+        """
+        record the slices of a dataset in one transaction
+        :param slices: dicts with path and optionally speaker, begin, end (samples) and duration (seconds), path may be
+            a future of it, e.g. from writer.AsyncWriter, the slice is then recorded once it is written
+        """
+        now = time.time()
+        rows = []
+        for i in slices:
+            if isinstance(i["path"], Future):
+                i["path"].add_done_callback(
+                    lambda future, i=i: future.exception() is None and self.add_slices(
+                        dataset_id, [{**i, "path": future.result()}]))
+                continue
+            path = str(Path(i["path"]).resolve())
+            rows.append((dataset_id, path, i.get("speaker"), i.get("begin"), i.get("end"), i.get("duration"),
+                         i.get("size", _size(path)), now, now))
+        if rows:
+            self._write("INSERT INTO slices (dataset_id, path, speaker, begin, end, duration, size, created, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET "
+                        "dataset_id = excluded.dataset_id, speaker = excluded.speaker, begin = excluded.begin, "
+                        "end = excluded.end, duration = excluded.duration, size = excluded.size", rows)
+
+    def slices(self, dataset_id: int = None, speaker: str = None, min_duration: float = None,
+               max_duration: float = None, order_by: str = None, limit: int = None) -> list:
+        return self._select("slices", {"dataset_id": dataset_id, "speaker": speaker, "min_duration": min_duration,
+                                       "max_duration": max_duration}, order_by, limit)
+
+    # outputs
+
+    def add_output(self, path: Path, engine: str, speaker: str = None, source_path: Path = None, params: dict = None):
+        """
+        record a generated file
+        :param path: the file, or a future of it, e.g. from writer.AsyncWriter, it is then recorded once it is written
+        :param engine: the engine that generated it, e.g. demucs or so-vits
+        :param params: the generation parameters, stored as json
+        """
+        if isinstance(path, Future):
+            path.add_done_callback(lambda future: future.exception() is None and self.add_output(
+                future.result(), engine, speaker, source_path, params))
+            return
+        now = time.time()
+        path = str(Path(path).resolve())
+        self._write("INSERT INTO outputs (path, engine, speaker, source_path, params, size, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET engine = excluded.engine, "
+                    "speaker = excluded.speaker, source_path = excluded.source_path, params = excluded.params, "
+                    "size = excluded.size",
+                    [(path, engine, speaker, None if source_path is None else str(source_path),
+                      json.dumps(params or {}, default=str), _size(path), now, now)])
+
+    def outputs(self, engine: str = None, speaker: str = None, min_size: int = None, max_size: int = None,
+                order_by: str = None, limit: int = None) -> list:
+        return self._select("outputs", {"engine": engine, "speaker": speaker, "min_size": min_size,
+                                        "max_size": max_size}, order_by, limit)
+
+    # usage
+
+    def touch(self, *paths: Path, add: bool = False):
+        """
+        record a use of the files, whichever table they are in
+        :param add: whether to record the files that are in no table as blobs, e.g. models placed by hand
+        """
+        now = time.time()
+        rows = [(now, str(Path(i).resolve())) for i in paths]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                if add:
+                    self._connection.executemany(
+                        "INSERT INTO blobs (file_name, path, size, created, last_used) SELECT ?, ?, ?, ?, ? "
+                        "WHERE NOT EXISTS (SELECT 1 FROM outputs WHERE path = ?) "
+                        "AND NOT EXISTS (SELECT 1 FROM slices WHERE path = ?) ON CONFLICT (path) DO NOTHING",
+                        [(Path(path).name, path, _size(path), now, now, path, path) for _, path in rows])
+                for table in ("blobs", "outputs"):
+                    self._connection.executemany(
+                        f"UPDATE {table} SET last_used = ?, use_count = use_count + 1 WHERE path = ?", rows)
+                self._connection.executemany("UPDATE slices SET last_used = ? WHERE path = ?", rows)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def usage(self, path: Path) -> dict:
+        """
+        the recorded use of a file, or of every file under a directory
+        :return: {"last_used", "use_count", "pinned"}, last_used is None if nothing under path is recorded
+        """
+        path = str(Path(path).resolve())
+        prefix = path.rstrip("/") + "/"
+        # the range on path instead of LIKE keeps the lookup on the unique path index
+        rows = self._execute(
+            "SELECT max(last_used) AS last_used, sum(use_count) AS use_count, max(pinned) AS pinned FROM ("
+            "SELECT last_used, use_count, pinned FROM blobs WHERE path = ? OR (path >= ? AND path < ?) UNION ALL "
+            "SELECT last_used, use_count, 0 FROM outputs WHERE path = ? OR (path >= ? AND path < ?) UNION ALL "
+            "SELECT last_used, 0, 0 FROM slices WHERE path = ? OR (path >= ? AND path < ?))",
+            (path, prefix, prefix[:-1] + "0") * 3)
+        return {"last_used": rows[0]["last_used"], "use_count": rows[0]["use_count"] or 0,
+                "pinned": bool(rows[0]["pinned"])}
+
+    def remove(self, *paths: Path):
+        """
+        forget the files, or every file under the directories, whichever table they are in
+        """
+        rows = []
+        for i in paths:
+            path = str(Path(i).resolve())
+            prefix = path.rstrip("/") + "/"
+            rows.append((path, prefix, prefix[:-1] + "0"))
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                for table in ("blobs", "slices", "outputs", "datasets"):
+                    self._connection.executemany(
+                        f"DELETE FROM {table} WHERE path = ? OR (path >= ? AND path < ?)", rows)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+
+_catalog = None
+
+
+def open_catalog() -> Catalog:
+    """
+    :return: the shared catalog at the configured catalog path, filled from sources.json when it is created
+    """
+    global _catalog
+    if _catalog is None:
+        import environment
+        exists = Path(environment.catalog_path).exists()
+        _catalog = Catalog(environment.catalog_path)
+        if not exists:
+            _catalog.import_sources(environment.sources)
+    return _catalog
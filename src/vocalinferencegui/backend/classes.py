@@ -1,14 +1,45 @@
-from abc import ABC, abstractmethod
+from dataclasses import dataclass, fields, replace
 from pathlib import Path
+from typing import ClassVar, Optional, get_args
 
 
 class AttributeDict(dict):
+    """
+    dict with attribute access and dotted keys ("attr.subattr").
+
+    nested dicts are left as they are until they are read, the first read wraps them in an AttributeDict that holds a
+    shallow copy and replaces the original in its parent, so writes through the wrapper never reach the dict the
+    AttributeDict was built from. levels that are already wrapped are written in place, so building an AttributeDict
+    from another one, copy included, turns them back into plain copies. keys prefixed with "__" are dropped at every
+    level when it is wrapped and rejected when set.
+    """
+    __slots__ = ()
+
     def __init__(self, data={}):
         if not isinstance(data, dict):
             raise TypeError("data must be a dictionary")
-        data = self._reject_reserved_keys(data)
-        super(AttributeDict, self).__init__(data)
-        self.update(data)
+        super(AttributeDict, self).__init__({key: AttributeDict._unwrap(value) for key, value in dict.items(data)
+                                             if not (isinstance(key, str) and key.startswith("__"))})
+
+    @staticmethod
+    def _unwrap(value):
+        """
+        plain copy of the levels of value that are already wrapped, the plain levels are never written in place and
+        stay shared
+        """
+        if isinstance(value, AttributeDict):
+            return {key: AttributeDict._unwrap(i) for key, i in dict.items(value)}
+        if type(value) is list and any(isinstance(i, (AttributeDict, list)) for i in value):
+            return [AttributeDict._unwrap(i) for i in value]
+        return value
+
+    @staticmethod
+    def _wrap(value):
+        if type(value) is dict:
+            return AttributeDict(value)
+        if type(value) is list and any(type(i) in (dict, list) for i in value):
+            return [AttributeDict._wrap(i) for i in value]
+        return value
 
     def _check_save_availability(self, cwd: dict):
         for i in cwd:
@@ -25,16 +56,13 @@ class AttributeDict(dict):
                 object (dict, optional): The dictionary you want to process. Defaults to {}.
 
         Returns:
-                dict: the processed dictionary
+                dict: a processed copy of the dictionary, the argument is left untouched
         """
         reserved_key_prefix = "__"
 
         if isinstance(object, dict):
-            for key, value in list(object.items()):
-                if key.startswith(reserved_key_prefix):
-                    del object[key]
-                else:
-                    object[key] = self._reject_reserved_keys(object[key])
+            return {key: self._reject_reserved_keys(value) for key, value in object.items()
+                    if not (isinstance(key, str) and key.startswith(reserved_key_prefix))}
         return object
 
     def make_json_able(self):
@@ -46,7 +74,6 @@ class AttributeDict(dict):
                 AttributeDict.make_json_able(self[i])
             elif isinstance(self[i], Path):
                 self[i] = str(self[i])
-        self.update(self)
 
     @classmethod
     def from_attrib_dict(cls, data):
@@ -60,7 +87,11 @@ class AttributeDict(dict):
 
     @property
     def dict(self):
-        return self.__dict__
+        return self
+
+    @property
+    def __dict__(self):
+        return self
 
     @staticmethod
     def tree(cwd: dict, layer=[]):
@@ -98,6 +129,22 @@ class AttributeDict(dict):
             )
         return point_dict
 
+    @staticmethod
+    def _parent(cwd: dict, point_expression: list, create: bool) -> dict:
+        """
+        :param cwd: the dict to start with
+        :param point_expression: parsed point expression
+        :param create: whether to create missing levels, raise KeyError for them otherwise
+        :return: the dict holding the last element of point_expression
+        """
+        for depth, key in enumerate(point_expression[:-1]):
+            if key not in cwd or not isinstance(cwd[key], dict):
+                if not create:
+                    raise KeyError(f"Attribute {'.'.join(point_expression[:depth + 1])} not found")
+                cwd[key] = AttributeDict() if isinstance(cwd, AttributeDict) else {}
+            cwd = cwd[key]
+        return cwd
+
     @staticmethod
     # add a value to a nested dict, according to the point expression, don't ignore different and nonexistent elements
     def add_to_dict(dict_1, point_expression: list, value: object, strict=True) -> dict:
@@ -108,35 +155,27 @@ class AttributeDict(dict):
         :param value: value of the final value
         :param strict: whether check the attribute exist or not
         """
-        AttributeDict.update_nested_dict(
-            dict_1,
-            AttributeDict.construct_nested_dict(point_expression, value, {}),
-            strict,
-        )
-    def get_attribute(self, attr, cwd, strict=True) -> object:
+        AttributeDict._parent(dict_1, point_expression, not strict)[point_expression[-1]] = value
+        return dict_1
+
+    def get_attribute(self, attr, cwd=None, strict=True) -> object:
         """
         get the reference of the value indicated in the position attr if the attribute exists and is a reference type
         :param attr: attribute pending fetch
         :param strict: whether check the attribute exist or not
-        :param cwd: current working dict, or where to start with
+        :param cwd: current working dict, or where to start with, default is this dict
         :return: a copy of the value indicated in the position attr
         """
-        depth = 0
         if isinstance(attr, str):
             attr = AttributeDict.parse_point_expression(attr)
-        if attr[0] not in cwd.keys():
-            if strict:
-                path = ""
-                for i in range(depth + 1):
-                    path += attr[i] + "."
-                raise KeyError(f"Attribute {path.strip('.')} not found")
-            else:
+        cwd = self if cwd is None else cwd
+        for depth, key in enumerate(attr):
+            if not isinstance(cwd, dict) or key not in cwd:
+                if strict:
+                    raise KeyError(f"Attribute {'.'.join(attr[:depth + 1])} not found")
                 return None
-        else:
-            if len(attr) == 1:
-                return cwd.get(attr[0])
-            else:
-                return self.get_attribute(attr[1:], cwd=cwd.get(attr[0]), strict=strict)
+            cwd = cwd[key]
+        return cwd
 
     def set_attribute(self, attr: str, value: object, strict=True):
         """
@@ -147,251 +186,411 @@ class AttributeDict(dict):
         :return:
         """
         attrs = AttributeDict.parse_point_expression(attr)
-        self.update(
-            AttributeDict.construct_nested_dict(attrs, value, {}), strict
-        )
+        AttributeDict._check_key(attr, attrs)
+        parent = AttributeDict._parent(self, attrs, not strict)
+        if strict and attrs[-1] not in parent:
+            raise KeyError(f"Attribute {attr} not found")
+        dict.__setitem__(parent, attrs[-1], value)
         return self
 
     def add_attribute(self, attr: str, value: object):
-        return self.set_attribute(attr, value)
+        return self.set_attribute(attr, value, strict=False)
 
-    def remove_attribute(self, attr: str, cwd, strict=True):
+    def remove_attribute(self, attr: str, cwd=None, strict=True):
         """
         remove the element at attr
         :param attr: point expression of the element pending remove
-        :param cwd: current working dictionary, the beginning of the search, usually self.__dict__
+        :param cwd: current working dictionary, the beginning of the search, default is this dict
         :param strict: use strict mode or not, if not, raise exception when the attr doesn't exist
         """
         attrs = AttributeDict.parse_point_expression(attr)
-        if AttributeDict(cwd)[attr] is None:
+        try:
+            parent = AttributeDict._parent(self if cwd is None else cwd, attrs, False)
+            del parent[attrs[-1]]
+        except KeyError:
             if strict:
                 raise KeyError(f"Attribute {attr} not found")
             return None
-        elif len(attrs) == 1:
-            del cwd[attrs[0]]
-        else:
-            attr = ""
-            for i in attrs[1:]:
-                attr += i + "."
-            attr = attr.strip(".")
-            self.remove_attribute(attr, cwd[attrs[0]], strict)
 
     def has_attribute(self, attr: str):
-        return self.get_attribute(attr, self) is not None
+        return self.get_attribute(attr, self, strict=False) is not None
 
     def to_file(self, name=None):
-        if not self._check_save_availability(self.__dict__):
+        if not self._check_save_availability(self):
             raise ValueError("Cannot save this object")
         import pickle
         from json import dump
 
-        if name is None or self.__dict__.get("name") is None:
+        if name is None or self.get("name") is None:
             name = str(hash(pickle.dumps(self)) ** 2)[10:]
         else:
-            name = self.__dict__.get("name")
-        dump(self.__dict__, open(f"{name}.json", "w"))
+            name = self.get("name")
+        dump(self, open(f"{name}.json", "w"))
+
+    def update(self, entries=(), **kwargs):
+        super(AttributeDict, self).update(entries, **kwargs)
+        for key in [i for i in self if isinstance(i, str) and i.startswith("__")]:
+            del self[key]
 
-    def update(self, entries, *args, **kwargs):
-        for key, value in entries.items():
-            if (isinstance(value, dict)):
-                self.__dict__[key] = AttributeDict(value)
-            else:
-                self.__dict__[key] = value
-                if (isinstance(value, list)):
-                    self.__dict__[key] = self._update_list(value)
-        self.__dict__.update(entries, *args, **kwargs)
-    def _update_list(self, entries, *args, **kwargs):
-        for i in range(len(entries)):
-            if isinstance(entries[i], list):
-                entries[i] = self._update_list(entries[i], *args, **kwargs)
-            elif isinstance(entries[i], dict):
-                entries[i] = AttributeDict(entries[i])
-        return entries
-    
     def __getitem__(self, item):
-        return self.__dict__[item]
+        value = super(AttributeDict, self).__getitem__(item)
+        wrapped = AttributeDict._wrap(value)
+        if wrapped is not value:
+            super(AttributeDict, self).__setitem__(item, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __getattr__(self, item):
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError(item) from None
+
+    @staticmethod
+    def _check_key(key: str, parts: list):
+        if any(i.startswith("__") for i in parts):
+            raise ValueError(f"Key {key} is reserved, keys starting with __ cannot be set")
 
     def __setitem__(self, key, value):
         if not isinstance(key, str):
             raise TypeError("key must be a string")
-        self.set_attribute(key, value, strict=False)
-
-    def keys(self):
-        return self.__dict__.keys()
+        if "." in key:
+            self.set_attribute(key, value, strict=False)
+        else:
+            AttributeDict._check_key(key, [key])
+            super(AttributeDict, self).__setitem__(key, value)
 
     def values(self):
-        return self.__dict__.values()
-
-    def __str__(self):
-        """
-        String value of the dictionary instance.
-        """
-        return str(self.__dict__)
+        return [self[i] for i in self]
 
-    def __repr__(self):
-        """
-        String representation of the dictionary instance.
-        """
-        return repr(self.__dict__)
+    def items(self):
+        return [(i, self[i]) for i in self]
 
     def __dir__(self):
-        return dir(type(self)) + list(self.__dict__.keys())
+        return dir(type(self)) + list(self.keys())
 
-    def __iter__(self):
+    def __reduce__(self):
         """
-        Iterate over dictionary key/values.
+        Return state information for pickling.
         """
-        return iter(self.__dict__.keys())
+        return AttributeDict, (dict(super(AttributeDict, self).items()),)
 
-    def __len__(self):
+    def __copy__(self):
+        return AttributeDict(self)
+
+    def copy(self):
+        return AttributeDict(self)
+
+
+PRESET_FORMATS = {".msgpack": "msgpack", ".json": "json"}
+_field_types = {}
+
+
+def dumps(data: dict, fmt: str = "msgpack") -> bytes:
+    """
+    :param data: a dict of plain values
+    :param fmt: msgpack or json, json uses orjson when it is installed
+    :return: the serialized data
+    """
+    if fmt == "msgpack":
+        import msgpack
+        return msgpack.packb(data, use_bin_type=True)
+    if fmt == "json":
+        try:
+            import orjson
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        except ImportError:
+            import json
+            return json.dumps(data, indent=2).encode("utf-8")
+    raise ValueError(f"Unknown preset format {fmt}")
+
+
+def loads(data: bytes, fmt: str = "msgpack") -> dict:
+    """
+    :param data: data serialized with dumps
+    :param fmt: msgpack or json
+    :return: the dict
+    """
+    if fmt == "msgpack":
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+    if fmt == "json":
+        try:
+            import orjson
+            return orjson.loads(data)
+        except ImportError:
+            import json
+            return json.loads(data)
+    raise ValueError(f"Unknown preset format {fmt}")
+
+
+def _coerce(value, kind):
+    """
+    convert a loaded value back to the type of its field, presets written from argv hold numbers as strings
+    """
+    if value is None or kind is None or isinstance(value, kind):
+        return value
+    if kind is bool and isinstance(value, str):
+        return value.lower() in ("true", "1", "yes")
+    return kind(value)
+
+
+@dataclass(frozen=True, slots=True)
+class ParamAbstract:
+    """
+    a generation preset, immutable and hashable, so presets can be used as keys of job tables and caches.
+    fields left as None fall back to the defaults of the function the preset is applied to.
+    """
+    param_type: ClassVar[str] = ""
+    preset_path_name: ClassVar[str] = ""
+
+    name: str = ""
+
+    @classmethod
+    def _types(cls) -> dict:
         """
-        Get number of items.
+        :return: field name -> the type values of the field are converted to, computed once per class
         """
-        return len(self.__dict__.keys())
+        if cls not in _field_types:
+            types = {}
+            for i in fields(cls):
+                kind = i.type if isinstance(i.type, type) else None
+                for candidate in (Path, bool, int, float, str):
+                    if candidate in get_args(i.type):
+                        kind = candidate
+                        break
+                types[i.name] = kind
+            _field_types[cls] = types
+        return _field_types[cls]
 
-    def __contains__(self, key):
+    @property
+    def get(self):
+        return self
+
+    def replace(self, **changes):
         """
-        Check if key exists.
+        :return: a copy of the preset with changes applied
         """
-        return self.__dict__.__contains__(key)
+        return replace(self, **changes)
 
-    def __reduce__(self):
+    def to_dict(self) -> dict:
         """
-        Return state information for pickling.
+        :return: the fields as plain values, paths as strings, with the param_type tag
         """
-        return self.__dict__.__reduce__()
+        data = {"param_type": self.param_type}
+        for i in self._types():
+            value = getattr(self, i)
+            data[i] = str(value) if isinstance(value, Path) else value
+        return data
 
-    def __eq__(self, other):
+    def kwargs(self) -> dict:
         """
-        Check dictionary is equal to another provided dictionary.
+        :return: the fields that are set, as keyword arguments of the generation function
         """
-        return self.__dict__.__eq__(other)
+        return {i: getattr(self, i) for i in self._types() if getattr(self, i) is not None}
 
-    def __ne__(self, other):
+    @classmethod
+    def from_dict(cls, data: dict):
         """
-        Check dictionary is inequal to another provided dictionary.
+        :param data: a dict written by to_dict or an older preset file, unknown keys are ignored
         """
-        return self.__dict__.__ne__(other)
-
-    def __copy__(self):
-        return AttributeDict(self.__dict__)
-
+        if data.get("param_type", cls.param_type) != cls.param_type:
+            raise ValueError(f"Expected a {cls.param_type} preset, got {data.get('param_type')}")
+        types = cls._types()
+        return cls(**{key: _coerce(value, types[key]) for key, value in data.items() if key in types})
 
-class ParamAbstract(ABC):
-    from pathlib import Path
-
-    def __init__(self, name: str, param_type: str, **kwargs):
-        assert param_type in [
-            "DemucsGenerate",
-            "DemucsTrain",
-            "SoVitsGenerate",
-            "SoVitsTrain",
-        ]
-        self.data = AttributeDict()
-        self.data.add_attribute("param_type", param_type)
-        self.data.add_attribute("name", name)
-        for key, value in kwargs.items():
-            self.data.add_attribute(key, value)
-
-    __dict__ = property(lambda self: self.data)
+    def dumps(self, fmt: str = "msgpack") -> bytes:
+        return dumps(self.to_dict(), fmt)
 
     @classmethod
-    @abstractmethod
-    def from_dict(cls, data: dict):
-        pass
+    def loads(cls, data: bytes, fmt: str = "msgpack"):
+        return cls.from_dict(loads(data, fmt))
 
-    @classmethod
-    @abstractmethod
-    def from_file(cls, path: Path):
-        pass
+    def digest(self) -> str:
+        """
+        :return: a content hash of the preset that is stable across processes, unlike hash()
+        """
+        from hashlib import sha1
+        return sha1(dumps(self.to_dict(), "msgpack")).hexdigest()
 
     @classmethod
-    @abstractmethod
-    def from_attribute_dict(cls, attr_dict: AttributeDict):
-        return cls(attr_dict.name, attr_dict.type, **attr_dict.dict)
-
-    @property
-    @abstractmethod
-    def name(self):
-        pass
+    def preset_path(cls) -> Path:
+        import environment
+        return getattr(environment, cls.preset_path_name)
 
-    @abstractmethod
-    def save_as(self, name: str):
-        pass
+    def save_as(self, name: str = None, fmt: str = "json", directory: Path = None) -> Path:
+        """
+        save the preset to the preset directory
+        :param name: the file name without extension, default is the name of the preset or its digest
+        :param fmt: msgpack or json, default is json
+        :param directory: the directory to save to, default is the preset directory of this kind of preset
+        :return: the path of the preset file
+        """
+        name = name or self.name or self.digest()[:16]
+        directory = Path(directory) if directory is not None else self.preset_path()
+        extension = {j: i for i, j in PRESET_FORMATS.items()}[fmt]
+        path = directory.joinpath(name + extension)
+        path.write_bytes(self.replace(name=name).dumps(fmt))
+        return path
 
-    @property
-    def get(self):
-        return self
+    @classmethod
+    def from_file(cls, path: Path):
+        """
+        :param path: a preset file, or the name of a file in the preset directory
+        """
+        path = Path(path)
+        if not path.is_absolute() and not path.exists():
+            path = cls.preset_path().joinpath(path)
+        if path.suffix not in PRESET_FORMATS:
+            raise ValueError(f"Unknown preset format {path.suffix}")
+        return cls.loads(path.read_bytes(), PRESET_FORMATS[path.suffix])
 
 
+@dataclass(frozen=True, slots=True)
 class DemucsGenerateParam(ParamAbstract):
-    def __init__(self, name: str, param_type: str, **kwargs):
-        super().__init__(name, param_type, **kwargs)
+    """
+    arguments of functions.separate_vocal
+    """
+    param_type: ClassVar[str] = "DemucsGenerate"
+    preset_path_name: ClassVar[str] = "demucs_preset_path"
+
+    track_path: Optional[Path] = None
+    output_path: Optional[Path] = None
+    device: Optional[str] = None
+    wav_store_method: str = "float32"
+    split_mode: str = "segment"
+    split_num: int = 5
+    clip_mode: str = "clamp"
+    shifts: int = 1
+    jobs: Optional[int] = None
+    repo: Optional[str] = None
+    extension: str = "wav"
+    backend: str = "torch"
+    save_to_config: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class SoVitsGenerationParam(ParamAbstract):
+    """
+    arguments of functions.apply_so_vits
+    """
+    param_type: ClassVar[str] = "SoVitsGenerate"
+    preset_path_name: ClassVar[str] = "so_vits_preset_path"
+
+    input_vocal: Optional[Path] = None
+    output_path: Optional[Path] = None
+    model_path: Optional[Path] = None
+    config_file_path: Optional[Path] = None
+    speaker: Optional[str] = None
+    cluster: Optional[Path] = None
+    db_threshold: float = -35
+    auto_predict_f0: bool = True
+    noice_scale: float = 0.4
+    pad_seconds: float = 0.5
+    f0_method: str = "dio"
+    chunk_seconds: float = 0.5
+    max_chunk_seconds: float = 40
+    cluster_infer_ratio: float = 0
+    absolute_tresh: bool = True
+    feature_cache: bool = True
+    f0_workers: int = 1
+    skip_silence: bool = False
+    silence_db: float = -40
+    backend: str = "torch"
+    save_to_config: bool = False
+
+
+class PresetRegistry:
+    """
+    presets of one kind indexed by name, the directory is listed on first use and a preset file is only parsed when it
+    is asked for
+    """
+
+    def __init__(self, param_class, directory: Path = None):
+        """
+        :param param_class: DemucsGenerateParam or SoVitsGenerationParam
+        :param directory: the preset directory, default is the preset directory of param_class
+        """
+        self.param_class = param_class
+        self._directory = directory
+        self._paths = None
+        self._presets = {}
 
     @property
-    def name(self):
-        return self.data["name"]
-
-    def save_as(self, name: str = None):
-        from environment import demucs_preset_path
-        from json import dump
-
-        dump(
-            self.data.dict,
-            open(
-                f"{demucs_preset_path}/{self.data['name'] if name is None else name}.json",
-                "w+",
-            ),
-        )
-
-    @classmethod
-    def from_dict(cls, data: dict):
-        assert (
-            data.get("param_type") == "DemucsGenerate" and data.get("name") is not None
-        )
-        return cls.from_attribute_dict(AttributeDict(data))
-
-    @classmethod
-    def from_list(cls, data: list, extension: str = "wav"):
-        if data[-1] is None or data[-1] == "":
-            data[-1] = str(hash(str(data)) ** 2)[10:]
-        return cls.from_dict(
-            {
-                "param_type": "DemucsGenerate",
-                "track_path": data[0],
-                "output_path": data[2],
-                "repo": data[4],
-                "device": data[6],
-                "wav_store_method": data[7].strip("--"),
-                "split_mode": data[8].strip("--"),
-                "clip_mode": data[10],
-                "split_num": data[-3],
-                "save_to_config": data[-2],
-                "name": data[-1],
-                "extension": extension,
-            }
-        )
+    def directory(self) -> Path:
+        if self._directory is None:
+            self._directory = self.param_class.preset_path()
+        return Path(self._directory)
 
-    @classmethod
-    def from_file(cls, name: str):
-        from json import load
-        from environment import demucs_preset_path
+    def _index(self) -> dict:
+        if self._paths is None:
+            self._paths = {}
+            if self.directory.exists():
+                for path in sorted(self.directory.iterdir()):
+                    if path.suffix in PRESET_FORMATS:
+                        self._paths.setdefault(path.stem, path)
+        return self._paths
 
-        return cls.from_dict(load(open(f"{demucs_preset_path}/{name}", "r")))
+    def refresh(self):
+        self._paths = None
+        self._presets.clear()
 
-    @classmethod
-    def from_attribute_dict(cls, attr_dict: AttributeDict):
-        return DemucsGenerateParam(**attr_dict.dict)
+    def names(self) -> list:
+        return list(self._index().keys())
 
+    def __contains__(self, name: str) -> bool:
+        return name in self._index()
 
-class SoVitsGenerationParam(ParamAbstract):
-    def __init__(self, name: str, **kwargs):
-        super().__init__(name, "SoVitsGenerationParam", **kwargs)
+    def __len__(self) -> int:
+        return len(self._index())
 
-    @property
-    def name(self):
-        pass
-
-    @property
-    def __str__(self):
-        return
+    def __iter__(self):
+        return iter(self._index())
+
+    def __getitem__(self, name: str):
+        if name not in self._presets:
+            if name not in self._index():
+                raise KeyError(f"Preset {name} not found")
+            self._presets[name] = self.param_class.from_file(self._index()[name])
+        return self._presets[name]
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def add(self, preset: ParamAbstract, fmt: str = "json") -> Path:
+        """
+        save a preset to the directory and register it under its name
+        :return: the path of the preset file
+        """
+        if not isinstance(preset, self.param_class):
+            raise TypeError(f"preset must be a {self.param_class.__name__}")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = preset.save_as(directory=self.directory, fmt=fmt)
+        self._index()[path.stem] = path
+        self._presets.pop(path.stem, None)
+        return path
+
+    def remove(self, name: str):
+        path = self._index().pop(name, None)
+        if path is None:
+            raise KeyError(f"Preset {name} not found")
+        self._presets.pop(name, None)
+        path.unlink(missing_ok=True)
+
+
+_registries = {}
+
+
+def presets(param_class) -> PresetRegistry:
+    """
+    :param param_class: DemucsGenerateParam or SoVitsGenerationParam
+    :return: the shared registry of the presets in the configured preset directory
+    """
+    if param_class not in _registries:
+        _registries[param_class] = PresetRegistry(param_class)
+    return _registries[param_class]
@@ -0,0 +1,541 @@
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import traceback
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import msgpack
+
+HEADER = struct.Struct(">I")
+
+
+def default_socket_path() -> Path:
+    from environment import cache_path
+    return cache_path.joinpath("inference.sock")
+
+
+def send_message(connection: socket.socket, message: dict):
+    data = msgpack.packb(message, use_bin_type=True, default=str)
+    connection.sendall(HEADER.pack(len(data)) + data)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes | None:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(connection: socket.socket) -> dict | None:
+    """
+    :return: the next message, None once the other side closed the connection
+    """
+    header = _receive_exactly(connection, HEADER.size)
+    if header is None:
+        return None
+    data = _receive_exactly(connection, HEADER.unpack(header)[0])
+    return None if data is None else msgpack.unpackb(data, raw=False)
+
+
+class BatchHandler(ABC):
+    """
+    runs the requests of one operation. requests with the same key (the same model) that arrive within max_wait
+    seconds of each other are handed to run_batch together, up to max_batch of them.
+    """
+    max_batch = 8
+    max_wait = 0.05
+
+    def key(self, args: dict):
+        """
+        :return: the hashable identity of the model args needs, raise to reject the request
+        """
+        return None
+
+    @abstractmethod
+    def run_batch(self, key, batch: list) -> list:
+        """
+        :param key: the key of every request of the batch
+        :param batch: the args of the requests
+        :return: one result per request, an exception in place of a result fails only that request
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class WarmModels:
+    """
+    the models loaded by a handler, the least recently used one is dropped once there are more than max_models. a
+    dropped model that a batch still runs on through use is only released once that batch is done with it.
+    """
+
+    def __init__(self, load, max_models: int = 2, release=None):
+        self.load = load
+        self.release = release
+        self.max_models = max_models
+        self.models = OrderedDict()
+        self._lock = threading.Lock()
+        # id of a model -> number of batches running on it, and the dropped models waiting for their last batch
+        self._users = {}
+        self._dropped = {}
+
+    def get(self, key, hold: bool = False):
+        """
+        :param hold: whether the caller runs on the model until it calls put, see use
+        """
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                model = self.models[key]
+                if hold:
+                    self._users[id(model)] = self._users.get(id(model), 0) + 1
+                return model
+        model = self.load(key)
+        with self._lock:
+            self.models[key] = model
+            if hold:
+                self._users[id(model)] = self._users.get(id(model), 0) + 1
+            dropped = []
+            while len(self.models) > self.max_models:
+                dropped.append(self.models.popitem(last=False)[1])
+            dropped = self._drop(dropped)
+        self._release(dropped)
+        return model
+
+    def put(self, model):
+        """
+        the end of a batch that got the model with hold, the model is released if it was dropped meanwhile
+        """
+        with self._lock:
+            self._users[id(model)] -= 1
+            if self._users[id(model)] > 0:
+                return
+            del self._users[id(model)]
+            dropped = [self._dropped.pop(id(model))] if id(model) in self._dropped else []
+        self._release(dropped)
+
+    @contextmanager
+    def use(self, key):
+        """
+        the model of key, kept loaded until the block exits even if it is dropped meanwhile
+        """
+        model = self.get(key, hold=True)
+        try:
+            yield model
+        finally:
+            self.put(model)
+
+    def _drop(self, models: list) -> list:
+        """
+        :return: the models nobody runs on, the others are released by their last put
+        """
+        free = []
+        for i in models:
+            if id(i) in self._users:
+                self._dropped[id(i)] = i
+            else:
+                free.append(i)
+        return free
+
+    def _release(self, models: list):
+        if self.release is not None:
+            for i in models:
+                self.release(i)
+
+    def clear(self):
+        with self._lock:
+            models, self.models = list(self.models.values()), OrderedDict()
+            models = self._drop(models)
+        self._release(models)
+
+
+def run_groups(groups: list, run, size: int) -> list:
+    """
+    run the groups of a batch, a group whose run fails is run again request by request, so an error fails only the
+    requests it comes from
+    :param groups: lists of (position in the batch, args) of the requests run together
+    :param run: run(list of args) -> one result per args
+    :param size: the number of requests of the batch
+    :return: one result or exception per request of the batch
+    """
+    results = [None] * size
+    for members in groups:
+        try:
+            outputs = run([args for _, args in members])
+        except Exception as e:
+            if len(members) == 1:
+                outputs = [e]
+            else:
+                outputs = [run_groups([[member]], run, size)[member[0]] for member in members]
+        for (i, _), output in zip(members, outputs):
+            results[i] = output
+    return results
+
+
+def group_by(batch: list, key) -> list:
+    """
+    :param key: key(args) -> the repr of what the requests of a group must share
+    :return: lists of (position in the batch, args), in the order of the batch
+    """
+    groups = OrderedDict()
+    for i, args in enumerate(batch):
+        groups.setdefault(key(args), []).append((i, args))
+    return list(groups.values())
+
+
+class SeparateHandler(BatchHandler):
+    """
+    separate_vocal on warm demucs models, one per repo and backend. the tracks of a batch with the same separation
+    parameters are padded to the longest one and stacked, so demucs separates each segment position of all of them in
+    one forward pass, see quantized.separate_many
+    """
+    max_batch = 4
+    separate_args = ("split_mode", "split_num", "clip_mode", "shifts", "jobs", "wav_store_method", "extension")
+
+    def __init__(self, max_models: int = 2):
+        from quantized import load_demucs
+        self.models = WarmModels(lambda key: load_demucs(key[0], backend=key[1]), max_models)
+
+    def key(self, args: dict):
+        return str(args.get("repo", r"../resources/files/models/demucs/hdemucs_mmi")), args.get("backend", "torch")
+
+    def run_batch(self, key, batch: list) -> list:
+        from quantized import separate_many
+        params = lambda args: {name: value for name, value in args.items() if name in self.separate_args}
+        groups = group_by(batch, lambda args: repr((str(args["output_path"]), sorted(params(args).items()))))
+        with self.models.use(key) as model:
+            return run_groups(groups, lambda members: separate_many(
+                [Path(args["track_path"]) for args in members], Path(members[0]["output_path"]), key[0],
+                backend=key[1], model=model, **params(members[0])), len(batch))
+
+    def close(self):
+        self.models.clear()
+
+
+class ConvertHandler(BatchHandler):
+    """
+    apply_so_vits on warm so-vits models, one per model, config, cluster, backend, feature cache and f0 workers.
+    requests with the same conversion parameters share one apply_so_vits_batch call with batch_inputs covering all of
+    them: the features of every input are extracted once, and the chunks of all inputs and speakers are converted
+    together in padded forward passes, see svc_engine.SvcEngine.infer_batch
+    """
+    path_args = ("input_vocal", "output_path", "model_path", "config_file_path", "cluster")
+    engine_args = ("feature_cache", "f0_workers")
+
+    def __init__(self, max_models: int = 2):
+        self.models = WarmModels(self._load, max_models, release=lambda engine: engine.close())
+
+    @staticmethod
+    def _load(key):
+        from functions import load_so_vits_engine
+        model_path, config_file_path, cluster, backend, feature_cache, f0_workers = key
+        return load_so_vits_engine(Path(model_path), Path(config_file_path),
+                                   cluster=None if cluster is None else Path(cluster), feature_cache=feature_cache,
+                                   f0_workers=f0_workers, backend=backend)
+
+    def key(self, args: dict):
+        for name in ("input_vocal", "output_path", "model_path", "config_file_path", "speaker"):
+            if name not in args:
+                raise ValueError(f"{name} is required")
+        return (str(args["model_path"]), str(args["config_file_path"]),
+                None if args.get("cluster") is None else str(args["cluster"]), args.get("backend", "torch"),
+                bool(args.get("feature_cache", True)), int(args.get("f0_workers", 1)))
+
+    def run_batch(self, key, batch: list) -> list:
+        from functions import apply_so_vits_batch
+        batch = [{name: Path(value) if name in self.path_args and value is not None else value
+                  for name, value in args.items() if name not in ("save_to_config", "name")} for args in batch]
+        rest = lambda args: {name: value for name, value in args.items()
+                             if name not in ("input_vocal", "speaker") + self.engine_args}
+        groups = group_by(batch, lambda args: repr(sorted(rest(args).items())))
+        with self.models.use(key) as engine:
+            return run_groups(groups, lambda members: apply_so_vits_batch(
+                [(args["input_vocal"], args["speaker"]) for args in members], engine=engine,
+                feature_cache=key[4], f0_workers=key[5], batch_inputs=len(members), **rest(members[0])), len(batch))
+
+    def close(self):
+        self.models.clear()
+
+
+class _Request:
+    __slots__ = ("args", "reply")
+
+    def __init__(self, args, reply):
+        self.args = args
+        self.reply = reply
+
+
+class _Batcher:
+    def __init__(self, handler: BatchHandler, key, stats: list):
+        self.handler = handler
+        self.key = key
+        self.stats = stats
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.handler.max_wait
+            stop = False
+            while len(batch) < self.handler.max_batch:
+                try:
+                    request = self.queue.get(timeout=max(0., deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            self.stats.append(len(batch))
+            for request in batch:
+                request.reply({"event": "running", "batch": len(batch)})
+            try:
+                results = self.handler.run_batch(self.key, [i.args for i in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for request, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    request.reply({"event": "error", "error": "".join(
+                        traceback.format_exception(type(result), result, result.__traceback__)).strip()})
+                else:
+                    request.reply({"event": "result", "result": result})
+            if stop:
+                return
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class InferenceServer:
+    """
+    a long running process holding warm models for every client on the machine, listening on a unix socket.
+
+    messages are msgpack maps behind a 4 byte length. a client sends {"id", "op", "args"} and gets back
+    {"id", "event": "queued"}, {"id", "event": "running", "batch"} and {"id", "event": "result", "result"} or
+    {"id", "event": "error", "error"}. a connection may have many requests in flight, their events are interleaved.
+    """
+
+    def __init__(self, socket_path: Path = None, handlers: dict = None):
+        """
+        :param socket_path: the path of the socket, default is inference.sock in the cache directory
+        :param handlers: op -> BatchHandler, default is separate and convert on demucs and so-vits
+        """
+        self.socket_path = Path(default_socket_path() if socket_path is None else socket_path)
+        self.handlers = {"separate": SeparateHandler(), "convert": ConvertHandler()} if handlers is None \
+            else handlers
+        self.stats = {op: [] for op in self.handlers}
+        self._batchers = {}
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._closed = threading.Event()
+
+    def _batcher(self, op: str, key) -> _Batcher:
+        with self._lock:
+            if (op, key) not in self._batchers:
+                self._batchers[(op, key)] = _Batcher(self.handlers[op], key, self.stats[op])
+            return self._batchers[(op, key)]
+
+    def _serve_connection(self, connection: socket.socket):
+        lock = threading.Lock()
+
+        def reply_to(request_id):
+            def reply(message: dict):
+                with lock:
+                    try:
+                        send_message(connection, {"id": request_id, **message})
+                    except OSError:
+                        # the client went away, the result is dropped
+                        pass
+            return reply
+
+        with connection:
+            while not self._closed.is_set():
+                try:
+                    message = receive_message(connection)
+                except (OSError, ValueError, msgpack.UnpackException):
+                    return
+                if message is None:
+                    return
+                reply = reply_to(message.get("id"))
+                op = message.get("op")
+                if op == "ping":
+                    reply({"event": "result", "result": {"ops": list(self.handlers), "pid": os.getpid()}})
+                    continue
+                if op not in self.handlers:
+                    reply({"event": "error", "error": f"unknown op {op}"})
+                    continue
+                args = message.get("args") or {}
+                try:
+                    key = self.handlers[op].key(args)
+                except Exception as e:
+                    reply({"event": "error", "error": f"{type(e).__name__}: {e}"})
+                    continue
+                reply({"event": "queued"})
+                self._batcher(op, key).queue.put(_Request(args, reply))
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def start(self) -> "InferenceServer":
+        """
+        listen in a background thread
+        """
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            try:
+                with DaemonClient(self.socket_path, timeout=1) as client:
+                    client.ping()
+                raise RuntimeError(f"a server is already listening on {self.socket_path}")
+            except (ConnectionError, FileNotFoundError, OSError):
+                # left behind by a server that did not shut down
+                self.socket_path.unlink()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(str(self.socket_path))
+        os.chmod(self.socket_path, 0o660)
+        self._socket.listen()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._closed.wait()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed.is_set() and self._socket is None:
+            return
+        self._closed.set()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            self.socket_path.unlink(missing_ok=True)
+        for batcher in list(self._batchers.values()):
+            batcher.close()
+        for handler in self.handlers.values():
+            handler.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DaemonClient:
+    """
+    one connection to an InferenceServer, the methods mirror functions.separate_vocal and functions.apply_so_vits
+    """
+
+    def __init__(self, socket_path: Path = None, timeout: float = None):
+        """
+        :param socket_path: the path of the socket of the server, default is inference.sock in the cache directory
+        :param timeout: seconds to wait for the server to answer, default is forever
+        """
+        self.socket_path = Path(default_socket_path() if socket_path is None else socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(str(self.socket_path))
+        except OSError:
+            self._socket.close()
+            raise
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def request(self, op: str, **args):
+        """
+        :return: generator of the events of the request, the last one is a result or an error
+        """
+        request_id = uuid.uuid4().hex
+        with self._lock:
+            send_message(self._socket, {"id": request_id, "op": op, "args": args})
+            while True:
+                message = receive_message(self._socket)
+                if message is None:
+                    raise ConnectionError(f"the server on {self.socket_path} closed the connection")
+                if message.get("id") != request_id:
+                    continue
+                yield message
+                if message["event"] in ("result", "error"):
+                    return
+
+    def call(self, op: str, **args):
+        """
+        :return: the result of the request
+        :raise RuntimeError: if the request failed on the server
+        """
+        for message in self.request(op, **args):
+            if message["event"] == "error":
+                raise RuntimeError(f"{op} failed on the server:\n{message['error']}")
+            if message["event"] == "result":
+                return message["result"]
+
+    def ping(self) -> dict:
+        return self.call("ping")
+
+    def separate_vocal(self, track_path: Path, output_path: Path, **kwargs) -> dict[str, Path]:
+        """
+        functions.separate_vocal on the warm model of the server, run in the server process with the backend given,
+        the paths must be reachable by the server
+        """
+        result = self.call("separate", track_path=str(Path(track_path).resolve()),
+                           output_path=str(Path(output_path).resolve()), **kwargs)
+        return {name: Path(path) for name, path in result.items()}
+
+    def apply_so_vits(self, input_vocal: Path, output_path: Path, model_path: Path, config_file_path: Path,
+                      speaker: str, **kwargs) -> Path:
+        """
+        functions.apply_so_vits on the warm model of the server, the paths must be reachable by the server
+        """
+        kwargs = {name: str(Path(value).resolve()) if name == "cluster" and value is not None else value
+                  for name, value in kwargs.items()}
+        return Path(self.call("convert", input_vocal=str(Path(input_vocal).resolve()),
+                              output_path=str(Path(output_path).resolve()),
+                              model_path=str(Path(model_path).resolve()),
+                              config_file_path=str(Path(config_file_path).resolve()), speaker=speaker, **kwargs))
+
+
+def serve(socket_path: Path = None):
+    """
+    run the inference server with the demucs and so-vits handlers until interrupted
+    """
+    server = InferenceServer(socket_path)
+    print(f"listening on {server.socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,263 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import soundfile
+
+FINGERPRINT_NAME = "fingerprints.npz"
+AUDIO_SUFFIXES = (".wav", ".flac", ".ogg", ".mp3")
+SEGMENTS = 4
+BANDS = 17
+FRAME = 2048
+HOP = 512
+# the number of slices of a shared band value compared with each other, larger buckets are capped
+BUCKET_LIMIT = 64
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def fingerprint(audio: np.ndarray, sr: int) -> np.uint64:
+    """
+    64 bit spectral fingerprint of a slice. the slice is cut in 4 segments and the log energy of 17 log spaced bands
+    between 100 Hz and 8 kHz is averaged over each segment. the first 16 bits tell whether the energy difference of two
+    adjacent bands over the whole slice is above its median (the spectral shape), the other 48 whether it grows from a
+    segment to the next (how the spectrum moves). the bits do not depend on the gain, and re-exports, small shifts and
+    added noise flip only a few of them.
+    :param audio: (samples,) or (samples, channels)
+    :param sr: the sample rate of the audio
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    audio = audio.mean(axis=1) if audio.ndim > 1 else audio
+    if audio.shape[0] < FRAME:
+        audio = np.pad(audio, (0, FRAME - audio.shape[0]))
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FRAME)[::HOP] * np.hanning(FRAME).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    edges = np.geomspace(100, min(8000, sr / 2), BANDS + 1)
+    bins = np.clip(np.round(edges * FRAME / sr).astype(int), 1, power.shape[1] - 1)
+    bands = np.stack([power[:, bins[i]:max(bins[i + 1], bins[i] + 1)].sum(axis=1) for i in range(BANDS)], axis=1)
+    # bands more than 40 dB under the loudest one are floored, the noise in them would flip bits at random
+    energy = np.log(np.maximum(bands, 1e-4 * bands.max()) + 1e-10)
+    segments = np.stack([i.mean(axis=0) for i in np.array_split(energy, SEGMENTS, axis=0) if i.shape[0]] or
+                        [energy.mean(axis=0)])
+    segments = np.concatenate([segments, np.repeat(segments[-1:], SEGMENTS - segments.shape[0], axis=0)])
+    difference = segments[:, :-1] - segments[:, 1:]
+    shape = difference.mean(axis=0)
+    bits = np.concatenate([shape > np.median(shape), (difference[1:] > difference[:-1]).reshape(-1)])
+    return np.uint64(int("".join("1" if i else "0" for i in bits), 2))
+
+
+def fingerprint_file(path: Path) -> tuple:
+    """
+    :return: (fingerprint, duration in seconds)
+    """
+    audio, sr = soundfile.read(str(path), dtype="float32", always_2d=True)
+    return fingerprint(audio, sr), audio.shape[0] / sr
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    :return: the number of different bits of every pair of uint64 a[i], b[i]
+    """
+    xor = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return _POPCOUNT[np.ascontiguousarray(xor).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+@dataclass(slots=True)
+class DuplicateReport:
+    groups: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    dry_run: bool = True
+
+    @property
+    def duplicates(self) -> int:
+        return sum(len(i) - 1 for i in self.groups)
+
+    def __str__(self):
+        lines = [f"{len(self.groups)} groups of near duplicates, {self.duplicates} "
+                 f"{'would be removed' if self.dry_run else 'removed'}"]
+        for group in self.groups:
+            lines.append(f"  keep {group[0]}")
+            lines.extend(f"    {i}" for i in group[1:])
+        return "\n".join(lines)
+
+
+class FingerprintIndex:
+    """
+    the fingerprints of a folder of slices in flat arrays. near duplicates are found by splitting the fingerprints in
+    max_distance + 1 bands: two fingerprints within max_distance bits are equal on at least one band, so only the
+    fingerprints sharing a band value are compared, which keeps the search close to linear in the number of slices. a
+    band value shared by more than BUCKET_LIMIT slices, e.g. by many near silent ones, would make its comparisons
+    quadratic, such a bucket is sorted by duration and every slice is only compared with its BUCKET_LIMIT next ones.
+    """
+
+    def __init__(self, paths: list = (), fingerprints: np.ndarray = None, durations: np.ndarray = None,
+                 stamps: np.ndarray = None):
+        self.paths = [str(i) for i in paths]
+        self.fingerprints = np.zeros(0, dtype=np.uint64) if fingerprints is None else np.asarray(fingerprints,
+                                                                                                 dtype=np.uint64)
+        self.durations = np.zeros(len(self.paths)) if durations is None else np.asarray(durations, dtype=np.float64)
+        self.stamps = np.zeros((len(self.paths), 2), dtype=np.int64) if stamps is None else np.asarray(stamps,
+                                                                                                        dtype=np.int64)
+
+    def __len__(self):
+        return len(self.paths)
+
+    @staticmethod
+    def _stamp(path: Path) -> tuple:
+        stat = path.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def build(cls, paths: list, workers: int = 8, previous: "FingerprintIndex" = None) -> "FingerprintIndex":
+        """
+        :param paths: the slices
+        :param workers: the number of slices read and fingerprinted at the same time
+        :param previous: an older index of the same slices, the fingerprints of unchanged files are taken from it
+        """
+        paths = [Path(i) for i in paths]
+        stamps = [cls._stamp(i) for i in paths]
+        known = {} if previous is None else {
+            path: (fp, duration, tuple(stamp))
+            for path, fp, duration, stamp in zip(previous.paths, previous.fingerprints, previous.durations,
+                                                 previous.stamps)}
+        results = [None] * len(paths)
+        todo = []
+        for i, (path, stamp) in enumerate(zip(paths, stamps)):
+            cached = known.get(str(path))
+            if cached is not None and cached[2] == stamp:
+                results[i] = cached[:2]
+            else:
+                todo.append(i)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for i, result in zip(todo, executor.map(lambda i: fingerprint_file(paths[i]), todo)):
+                results[i] = result
+        return cls(paths, np.array([i[0] for i in results], dtype=np.uint64),
+                   np.array([i[1] for i in results], dtype=np.float64),
+                   np.array(stamps, dtype=np.int64).reshape(-1, 2))
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        tmp = path.with_name("." + path.name)
+        with open(tmp, "wb") as f:
+            np.savez(f, paths=np.array(self.paths, dtype=str), fingerprints=self.fingerprints,
+                     durations=self.durations, stamps=self.stamps)
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "FingerprintIndex":
+        with np.load(path) as data:
+            return cls(data["paths"].tolist(), data["fingerprints"], data["durations"], data["stamps"])
+
+    def candidate_pairs(self, max_distance: int = 3, bucket_limit: int = BUCKET_LIMIT) -> np.ndarray:
+        """
+        :param bucket_limit: the number of next slices by duration a slice of a larger bucket is compared with
+        :return: (pairs, 2) unique index pairs i < j that share at least one band, of close durations in large buckets
+        """
+        n_bands = max(1, min(64, max_distance + 1))
+        widths = [64 // n_bands + (1 if i < 64 % n_bands else 0) for i in range(n_bands)]
+        pairs, shift = [], 0
+        for width in widths:
+            keys = (self.fingerprints >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            shift += width
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            sizes = ends - starts
+            # most shared band values are shared by two fingerprints only, those pairs are taken at once
+            two = starts[sizes == 2]
+            pairs.append(np.sort(np.stack([order[two], order[two + 1]], axis=1), axis=1))
+            for start, end in zip(starts[sizes > 2], ends[sizes > 2]):
+                members = np.sort(order[start:end])
+                if len(members) <= bucket_limit + 1:
+                    i, j = np.triu_indices(len(members), k=1)
+                    pairs.append(np.stack([members[i], members[j]], axis=1))
+                    continue
+                members = members[np.argsort(self.durations[members], kind="stable")]
+                for offset in range(1, bucket_limit + 1):
+                    pairs.append(np.sort(np.stack([members[:-offset], members[offset:]], axis=1), axis=1))
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.unique(np.concatenate(pairs), axis=0)
+
+    def duplicates(self, max_distance: int = 3, duration_tolerance: float = 0.1) -> list:
+        """
+        :param max_distance: the number of different bits two near duplicates may have, default is 3
+        :param duration_tolerance: the relative difference of duration two near duplicates may have, default is 0.1
+        :return: groups of near duplicate paths, the longest slice of every group first and then the slices within
+            max_distance of it. near duplicates do not chain: a slice only close to a dropped one starts its own group
+        """
+        pairs = self.candidate_pairs(max_distance)
+        if len(pairs):
+            a, b = pairs[:, 0], pairs[:, 1]
+            longer = np.maximum(self.durations[a], self.durations[b])
+            close = (hamming(self.fingerprints[a], self.fingerprints[b]) <= max_distance) & \
+                    (np.abs(self.durations[a] - self.durations[b]) <= duration_tolerance * longer)
+            pairs = pairs[close]
+
+        neighbours = {}
+        for i, j in pairs.tolist():
+            neighbours.setdefault(i, []).append(j)
+            neighbours.setdefault(j, []).append(i)
+
+        def longest(i):
+            return -self.durations[i], self.paths[i]
+
+        taken, groups = set(), []
+        for i in sorted(neighbours, key=longest):
+            if i in taken:
+                continue
+            taken.add(i)
+            members = [j for j in neighbours[i] if j not in taken]
+            taken.update(members)
+            if members:
+                groups.append([i] + sorted(members, key=longest))
+        return [[self.paths[i] for i in group] for group in sorted(groups, key=min)]
+
+
+def dedup_dataset(
+        name: str = None,
+        directory: Path = None,
+        max_distance: int = 3,
+        duration_tolerance: float = 0.1,
+        drop: bool = False,
+        workers: int = 8,
+) -> DuplicateReport:
+    """
+    find the near duplicate slices of a dataset, e.g. from live versions or repeated choruses, and optionally remove
+    all but the longest of every group. the fingerprints are kept in fingerprints.npz next to the slices, so only new
+    or changed slices are fingerprinted again.
+    :param name: the name of the dataset under so_vits_dataset_path, its sliced folder is checked
+    :param directory: the folder of slices, instead of name
+    :param max_distance: the number of different fingerprint bits two near duplicates may have, default is 3
+    :param duration_tolerance: the relative difference of duration two near duplicates may have, default is 0.1
+    :param drop: whether to delete the duplicates, default is only reporting them
+    :param workers: the number of slices fingerprinted at the same time
+    """
+    if directory is None:
+        if name is None:
+            raise ValueError("name or directory must be given")
+        from environment import so_vits_dataset_path
+        directory = so_vits_dataset_path.joinpath(name).joinpath("sliced")
+    directory = Path(directory)
+    if not directory.exists():
+        raise FileNotFoundError(f"Directory {directory} not found")
+    index_path = directory.joinpath(FINGERPRINT_NAME)
+    previous = FingerprintIndex.load(index_path) if index_path.exists() else None
+    paths = sorted(i for i in directory.rglob("*") if i.suffix.lower() in AUDIO_SUFFIXES and i.is_file())
+    index = FingerprintIndex.build(paths, workers, previous)
+
+    report = DuplicateReport(groups=index.duplicates(max_distance, duration_tolerance), dry_run=not drop)
+    if drop:
+        for group in report.groups:
+            for path in group[1:]:
+                Path(path).unlink(missing_ok=True)
+                report.removed.append(path)
+        removed = set(report.removed)
+        keep = [i for i, path in enumerate(index.paths) if path not in removed]
+        index = FingerprintIndex([index.paths[i] for i in keep], index.fingerprints[keep], index.durations[keep],
+                                 index.stamps[keep])
+    index.save(index_path)
+    return report
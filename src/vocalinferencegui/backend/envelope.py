@@ -0,0 +1,141 @@
+import math
+from pathlib import Path
+
+import numpy as np
+
+from Slicer import block_energy
+
+
+class Envelope:
+    """
+    multi-resolution energy envelope of a waveform.
+
+    level 0 holds the sum of squared samples of every block of base_hop samples, level k aggregates 2 ** k blocks.
+    framed RMS for any frame/hop length is derived from level 0, coarser levels are meant for waveform previews.
+    """
+
+    def __init__(self, levels: list, sr: int, base_hop: int, n_samples: int):
+        self.levels = levels
+        self.sr = sr
+        self.base_hop = base_hop
+        self.n_samples = n_samples
+        self._cumulative = None
+
+    @classmethod
+    def from_audio(cls, y: np.ndarray, sr: int, base_hop: int = 64):
+        """
+        compute the envelope of a waveform
+        :param y: the waveform, multichannel input (channels, samples) is mixed down like in Slicer
+        :param sr: sample rate of the waveform
+        :param base_hop: block size of the finest level in samples, default is 64
+        :return: the envelope
+        """
+        energy = block_energy(y, base_hop, downmix=True)
+        # the finest level stays float64 so framed RMS of aligned frames is the one Slicer.get_rms computes
+        levels = [energy]
+        while energy.shape[0] > 1:
+            if energy.shape[0] % 2:
+                energy = np.append(energy, 0.)
+            energy = energy.reshape(-1, 2).sum(axis=1)
+            levels.append(energy.astype(np.float32))
+        return cls(levels, sr, base_hop, y.shape[-1])
+
+    @classmethod
+    def load(cls, path: Path):
+        """
+        load an envelope saved with save
+        :param path: path of the .npz file
+        """
+        with np.load(path) as data:
+            sr, base_hop, n_samples = (int(i) for i in data["meta"][:3])
+            levels = [data[f"level_{i}"] for i in range(len(data.files) - 1)]
+        return cls(levels, sr, base_hop, n_samples)
+
+    def save(self, path: Path, source_stat=(0, 0)):
+        """
+        save the envelope as a bundle of .npy arrays
+        :param path: path of the .npz file
+        :param source_stat: (mtime_ns, size) of the audio file, used to invalidate the cache
+        """
+        meta = np.array([self.sr, self.base_hop, self.n_samples, *source_stat], dtype=np.int64)
+        np.savez(path, meta=meta, **{f"level_{i}": level for i, level in enumerate(self.levels)})
+        return Path(path)
+
+    def aligned(self, frame_length=2048, hop_length=512) -> bool:
+        """
+        whether every frame edge falls on a block edge, rms is then exactly Slicer.get_rms
+        :param frame_length: frame length in samples
+        :param hop_length: hop length in samples
+        """
+        return hop_length % self.base_hop == 0 and frame_length % self.base_hop == 0 \
+            and (frame_length // 2) % self.base_hop == 0
+
+    def rms(self, frame_length=2048, hop_length=512) -> np.ndarray:
+        """
+        framed RMS with the same framing and shape as Slicer.get_rms, frame edges are rounded to base_hop blocks when
+        the frames are not aligned
+        :param frame_length: frame length in samples
+        :param hop_length: hop length in samples
+        :return: array of shape (1, n_frames)
+        """
+        if self._cumulative is None:
+            self._cumulative = np.zeros(self.levels[0].shape[0] + 1, dtype=np.float64)
+            np.cumsum(self.levels[0], dtype=np.float64, out=self._cumulative[1:])
+        half = frame_length // 2
+        n_frames = (self.n_samples + 2 * half - frame_length) // hop_length + 1
+        start = np.arange(n_frames, dtype=np.int64) * hop_length - half
+        n_blocks = self.levels[0].shape[0]
+        start_block = np.clip(np.rint(start / self.base_hop).astype(np.int64), 0, n_blocks)
+        end_block = np.clip(np.rint((start + frame_length) / self.base_hop).astype(np.int64), 0, n_blocks)
+        power = (self._cumulative[end_block] - self._cumulative[start_block]) / frame_length
+        return np.sqrt(np.maximum(power, 0.))[np.newaxis, :]
+
+    def preview(self, width: int) -> np.ndarray:
+        """
+        RMS of roughly width columns for drawing a waveform preview, read from the closest coarser level
+        :param width: the number of columns to draw
+        :return: array of at least width values
+        """
+        samples_per_column = max(1, self.n_samples // max(1, width))
+        level = min(len(self.levels) - 1, max(0, int(np.log2(max(1, samples_per_column // self.base_hop)))))
+        block = self.base_hop * 2 ** level
+        return np.sqrt(self.levels[level] / block)
+
+
+def aligned_hop(frame_length: int, hop_length: int) -> int:
+    """
+    :return: the largest base_hop whose envelope gives the exact RMS of frames of frame_length and hop_length
+    """
+    return math.gcd(hop_length, frame_length, frame_length // 2)
+
+
+def envelope_cache_path(audio_path: Path) -> Path:
+    return Path(audio_path).with_name(Path(audio_path).name + ".envelope.npz")
+
+
+def load_envelope(audio_path: Path, y: np.ndarray = None, sr: int = None, base_hop: int = 64) -> Envelope:
+    """
+    load the cached envelope of an audio file, computing and storing it next to the audio if missing or stale
+    :param audio_path: the path of the audio file
+    :param y: the already decoded waveform, decoded with librosa if None
+    :param sr: sample rate of y
+    :param base_hop: block size of the finest level in samples, default is 64, aligned_hop of the slicer frames makes
+        slicing with the envelope exact
+    :return: the envelope
+    """
+    audio_path = Path(audio_path)
+    cache_path = envelope_cache_path(audio_path)
+    stat = audio_path.stat()
+    source_stat = (stat.st_mtime_ns, stat.st_size)
+    if cache_path.exists():
+        with np.load(cache_path) as data:
+            meta = data["meta"]
+        if tuple(int(i) for i in meta[3:5]) == source_stat and int(meta[1]) == base_hop \
+                and (sr is None or int(meta[0]) == sr):
+            return Envelope.load(cache_path)
+    if y is None:
+        import librosa
+        y, sr = librosa.load(audio_path, sr=sr, mono=False)
+    envelope = Envelope.from_audio(y, sr, base_hop)
+    envelope.save(cache_path, source_stat)
+    return envelope
@@ -22,6 +22,10 @@ if not config_path.exists():
 			"so-vits": "../resources/files/datasets/so-vits"
 		},
 		"output": "../resources/files/output",
+		"cache": "../resources/files/cache",
+		"catalog": "../resources/files/catalog.sqlite3",
+		"cache_budget": 53687091200,
+		"pinned": [],
 		"sources": "../resources/files/sources.json",
 		"sources_export": "../resources/files/sources_export.json",
 		"key_path": "../resources/files/keys",
@@ -38,6 +42,8 @@ demucs_dataset_path = Path(config["dataset"]["demucs"]).resolve()
 so_vits_preset_path = Path(config["preset"]["so-vits"]).resolve()
 so_vits_dataset_path = Path(config["dataset"]["so-vits"]).resolve()
 output_path = Path(config["output"]).resolve()
+cache_path = Path(config.get("cache", "../resources/files/cache")).resolve()
+catalog_path = Path(config.get("catalog", "../resources/files/catalog.sqlite3")).resolve()
 key_path = Path(config["key_path"]).resolve()
 
 
@@ -51,6 +57,7 @@ so_vits_preset_path.mkdir(parents=True, exist_ok=True)
 so_vits_dataset_path.mkdir(parents=True, exist_ok=True)
 demucs_dataset_path.mkdir(parents=True, exist_ok=True)
 output_path.mkdir(parents=True, exist_ok=True)
+cache_path.mkdir(parents=True, exist_ok=True)
 key_path.mkdir(parents=True, exist_ok=True)
 sources_path = Path(config["sources"]).resolve()
 Path("../files").mkdir(exist_ok=True, parents=True)
@@ -72,7 +79,7 @@ print("done")
 
 
 def update_env():
-	global config, sources_path, sources, demucs_model_path, so_vits_model_path, demucs_preset_path, so_vits_preset_path, so_vits_dataset_path, demucs_dataset_path, output_path
+	global config, sources_path, sources, demucs_model_path, so_vits_model_path, demucs_preset_path, so_vits_preset_path, so_vits_dataset_path, demucs_dataset_path, output_path, cache_path, catalog_path
 	config = json.load(open(config_path, "r"))
 	sources_path = Path(config["sources"]).resolve()
 	if not sources_path.exists():
@@ -87,6 +94,8 @@ def update_env():
 	so_vits_dataset_path = Path(config["dataset"]["so-vits"]).resolve()
 	demucs_dataset_path = Path(config["dataset"]["demucs"]).resolve()
 	output_path = Path(config["output"]).resolve()
+	cache_path = Path(config.get("cache", "../resources/files/cache")).resolve()
+	catalog_path = Path(config.get("catalog", "../resources/files/catalog.sqlite3")).resolve()
 
 
 def update_keys():
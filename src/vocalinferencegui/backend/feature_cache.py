@@ -0,0 +1,147 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+class FeatureCache:
+    """
+    on-disk cache of per-audio feature arrays (f0, voiced mask, content embeddings, ...).
+
+    every entry is a directory of .npy files that are memory-mapped on load, or a single compressed .npz when compress is
+    set. the modification time of an entry is its last use, the least recently used entries are evicted once the cache
+    grows over max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 2 * 1024 ** 3, compress: bool = False):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def key(audio: np.ndarray, sr: int, f0_method: str, hop: int, *extra) -> str:
+        """
+        :param audio: the audio the features are computed from
+        :param sr: sample rate of the audio
+        :param f0_method: the method used to predict the f0
+        :param hop: hop length of the features in samples
+        :param extra: anything else the features depend on, e.g. the content model
+        :return: the cache key
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(audio).tobytes())
+        digest.update(repr((str(audio.dtype), audio.shape, sr, f0_method, hop) + extra).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / (key + (".npz" if self.compress else ""))
+
+    def _entries(self):
+        """
+        :return: list of (path, last use, size) of all entries
+        """
+        entries = []
+        for bucket in self.root.iterdir():
+            if not bucket.is_dir():
+                continue
+            for entry in bucket.iterdir():
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    size = sum(i.stat().st_size for i in entry.iterdir())
+                else:
+                    size = entry.stat().st_size
+                entries.append((entry, entry.stat().st_mtime, size))
+        return entries
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def get(self, key: str):
+        """
+        :param key: the cache key
+        :return: name -> array of the entry, or None if it is not cached
+        """
+        path = self._path(key)
+        try:
+            if self.compress:
+                with np.load(path) as data:
+                    arrays = {name: data[name] for name in data.files}
+            else:
+                arrays = {i.stem: np.load(i, mmap_mode="r") for i in path.iterdir()}
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return arrays
+
+    def put(self, key: str, **arrays):
+        """
+        store the arrays of an entry, the entry is written to a temporary location and renamed into place
+        :param key: the cache key
+        :param arrays: name -> array
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.compress:
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            size = Path(tmp).stat().st_size
+        else:
+            tmp = tempfile.mkdtemp(dir=path.parent, prefix=".")
+            for name, array in arrays.items():
+                np.save(Path(tmp) / f"{name}.npy", np.asarray(array))
+            size = sum(i.stat().st_size for i in Path(tmp).iterdir())
+        with self._lock:
+            # a compressed entry stored again replaces the old file, whose size is no longer in the cache
+            try:
+                replaced = path.stat().st_size if self.compress else 0
+            except FileNotFoundError:
+                replaced = 0
+            try:
+                os.replace(tmp, path)
+            except OSError:
+                # another process stored the same entry first
+                if self.compress:
+                    Path(tmp).unlink(missing_ok=True)
+                else:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                return
+            self._size += size - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self, max_bytes: int = None) -> list:
+        """
+        remove the least recently used entries until the cache fits in max_bytes
+        :param max_bytes: the budget, default is the budget of the cache
+        :return: the removed entries
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = []
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda i: i[1])
+            self._size = sum(size for _, _, size in entries)
+            for path, _, size in entries:
+                if self._size <= max_bytes:
+                    break
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+                self._size -= size
+                removed.append(path)
+        return removed
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def clear(self):
+        self.evict(0)
@@ -3,6 +3,7 @@ import struct
 import base64
 import os
 import librosa
+import numpy as np
 import soundfile
 from Crypto.Cipher import AES
 from demucs import separate
@@ -11,13 +12,22 @@ from tqdm import tqdm
 from pathlib import Path
 import json
 
-from classes import DemucsGenerateParam
-from environment import output_path, config, so_vits_dataset_path, demucs_model_path
-from so_vits_svc_fork.inference.main import infer
+from classes import DemucsGenerateParam, SoVitsGenerationParam
+from environment import output_path, config, so_vits_dataset_path, demucs_model_path, cache_path
+from so_vits_svc_fork.utils import get_optimal_device
 from so_vits_svc_fork.preprocessing.preprocess_flist_config import preprocess_config
 from pyannote.audio import Pipeline
 from df.enhance import enhance, init_df, load_audio, save_audio
 from Slicer import Slicer
+from envelope import aligned_hop, load_envelope
+from ingest import decode_audio, extract_audio_file
+from svc_engine import SvcEngine
+from feature_cache import FeatureCache
+from quantized import BACKENDS, model_name, separate_in_process
+from preprocess import preprocess_dataset
+from scheduler import current_budget, job_threads
+from writer import AsyncWriter, encode
+from catalog import open_catalog
 
 def convert_ncm(file_path:Path, output_path:Path) -> Path:
     """
@@ -93,6 +103,46 @@ def convert_ncm(file_path:Path, output_path:Path) -> Path:
     f.close()
     return Path(os.path.join(output_path, file_name))
 
+def demucs_args(track_path: Path, output_path: Path, repo, name: str, device: str, wav_store_method: str,
+                split_mode: str, split_num, clip_mode: str, jobs: int, shifts: int, mp3: bool) -> list[str]:
+    """
+    the demucs command line of separate_vocal, --segment takes whole seconds so split_num is rounded down, to 1 at least
+    :param name: the name of the model in repo, see quantized.model_name
+    :param mp3: whether demucs writes mp3
+    """
+    args = [str(track_path.resolve()),
+         "-o", str(output_path.resolve()),
+         "--repo", str(repo),
+         "--device", device if device in ["cpu", "cuda"] else "cpu",
+         "--" + wav_store_method if wav_store_method in ["float32", "int16"] else "--float32",
+         "--" + split_mode, None if split_mode == "no-split" else str(max(1, int(split_num))),
+         "--clip-mode", clip_mode if clip_mode in ["rescale", "clamp"] else "rescale",
+         "--name", name,
+         "--jobs", str(0) if jobs < 0 else str(jobs),
+         "--shifts", str(max(1, int(shifts))),
+         "--two-stems", "vocals",
+         "--mp3" if mp3 else None
+         ]
+    return list(filter((None).__ne__, args))
+
+
+def encode_stem(path: Path, extension: str, writer: AsyncWriter = None):
+    """
+    encode a wav stem written by the demucs command line to extension, the wav is removed once it is encoded
+    :param writer: the writer.AsyncWriter encoding the stem, a future of the path is then returned
+    :return: the path of the encoded stem, or a future of it
+    """
+    audio, sr = soundfile.read(path, dtype="float32", always_2d=True)
+    target = path.with_suffix("." + extension)
+    if writer is None:
+        encode(target, audio, sr)
+        path.unlink()
+        return target
+    future = writer.submit(target, audio, sr)
+    future.add_done_callback(lambda done: done.exception() is None and path.unlink(missing_ok=True))
+    return future
+
+
 def separate_vocal(
         track_path: Path,
         output_path: Path,
@@ -103,78 +153,101 @@ def separate_vocal(
         split_mode="segment",
         split_num=5,
         clip_mode="clamp",
-        jobs=os.cpu_count(),
+        shifts=1,
+        jobs=None,
         repo=r"../resources/files/models/demucs/hdemucs_mmi",
-        extension="wav"
+        extension="wav",
+        backend="torch",
+        writer=None,
+        audio: np.ndarray = None,
+        samplerate: int = 44100
 ) -> dict[str, Path]:
     """
     separate the music into vocals and instruments
-    :param track_path: the path of the track
+    :param track_path: the path of the track, any file ffmpeg can decode, video included, demucs reads it through ffmpeg
     :param output_path: the path of the output directory
     :param device: the device to use, cuda or cpu, default is cpu
     :param wav_store_method: the method to store the wav file, float32 or int16, default is
     :param split_mode: the method to split the track, --segment or --no-split
     :param split_num: the number of segments to split the track, only works when split_mode is --segment
     :param clip_mode: the method to clip the track, rescale or clamp, default is rescale
-    :param jobs: the number of jobs to use, default is use all the cpu logic core if in cpu mode
+    :param shifts: the number of random shifts averaged for the prediction, default is 1
+    :param jobs: the number of parallel jobs, every job runs single threaded so the jobs use jobs cores, 0 runs one job
+        with the whole core budget, default is the core budget of the process, every available core unless it runs in
+        a scheduler.CoreBudgetExecutor worker
     :param repo: the repo to download the model, default is the local model folder, comes from https://dl.fbaipublicfiles.com/demucs/hybrid_transformer/
+        the folder must hold one model, the outputs are written under its name, see quantized.model_name
     :param save_to_config: whether save the config of this function to a file
     :param name: the name of the config file
     :param extension: extension of output file, default is wav
+    :param backend: torch runs the demucs command line, int8 runs a dynamically quantized copy of the model in this
+        process on cpu, the copy is cached in the model folder, default is torch
+    :param writer: the writer.AsyncWriter encoding the stems, futures of the paths are then returned. with the torch
+        backend it only encodes the extensions the command line cannot write, which it writes as wav first
+    :param audio: the already decoded track, (samples, channels) or (samples,), e.g. ingest.decode_audio(track_path),
+        it is separated in this process with either backend as the command line only reads files, track_path is then
+        only used for naming the outputs
+    :param samplerate: the sample rate of audio, default is 44100
     """
     lossy = ["mp3", "m4a", "ogg", "aac"]
     lossless = ["flac", "wav"]
 
     if extension not in lossy and extension not in lossless:
         raise ValueError("extension must be one of mp3, m4a, ogg, aac, flac, wav")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
 
     split_mode = split_mode if split_mode in ["segment", "no-split"] else "segment"
+    jobs = current_budget() if jobs is None else jobs
+    name_of_model = model_name(repo)
 
-    args = [str(track_path.resolve()),
-         "-o", str(output_path.resolve()),
-         "--repo", str(repo),
-         "--device", device if device in ["cpu", "cuda"] else "cpu",
-         "--" + wav_store_method if wav_store_method in ["float32", "int16"] else "--float32",
-         "--" + split_mode, None if split_mode == "no-split" else str(split_num),
-         "--clip-mode", clip_mode if clip_mode in ["rescale", "clamp"] else "rescale",
-         "--name", "hdemucs_mmi",
-         "--jobs", str(0) if jobs < 0 else str(jobs),
-         "--two-stems", "vocals",
-         "--mp3" if extension in lossy else None
-         ]
+    args = demucs_args(track_path, output_path, repo, name_of_model, device, wav_store_method, split_mode, split_num,
+                       clip_mode, jobs, shifts, extension == "mp3")
 
     if save_to_config:
-        import pickle
-        args.extend([save_to_config, split_num, name])
-        conf = DemucsGenerateParam.from_list(args.copy(), extension)
-        conf.get.save_as(name if name != "" else str(int(pickle.dumps(config)) ** 2))
-    try:
-        args = list(filter((None).__ne__, args))
-        args = args[:args.index(save_to_config)]
-    except ValueError:
-        pass
-    separate.main(args)
+        DemucsGenerateParam(
+            name=name,
+            track_path=track_path,
+            output_path=output_path,
+            device=device,
+            wav_store_method=wav_store_method,
+            split_mode=split_mode,
+            split_num=split_num,
+            clip_mode=clip_mode,
+            shifts=shifts,
+            jobs=jobs,
+            repo=str(repo),
+            extension=extension,
+            backend=backend,
+        ).save_as()
+    catalog = open_catalog()
+    catalog.touch(*(i for i in Path(repo).glob("*") if i.is_file()), add=True)
+    if backend == "int8" or audio is not None:
+        with job_threads(jobs):
+            separated = separate_in_process(track_path, output_path, repo, backend=backend, split_mode=split_mode,
+                                            split_num=split_num, clip_mode=clip_mode, shifts=shifts, jobs=jobs,
+                                            wav_store_method=wav_store_method, extension=extension, writer=writer,
+                                            audio=audio, samplerate=samplerate)
+    else:
+        with job_threads(jobs):
+            separate.main(args)
 
-    output_vocal = Path(output_path).joinpath("hdemucs_mmi").joinpath(track_path.stem).joinpath("vocals." + extension.strip("."))
-    output_no_vocal = Path(output_path).joinpath("hdemucs_mmi").joinpath(track_path.stem).joinpath("no_vocals." + extension.strip("."))
-    return {"vocal": output_vocal, "instrumental": output_no_vocal}
+        # the command line writes wav or mp3, the other extensions are encoded from its wav
+        written = extension if extension in ["wav", "mp3"] else "wav"
+        output_vocal = Path(output_path).joinpath(name_of_model).joinpath(track_path.stem).joinpath("vocals." + written)
+        output_no_vocal = Path(output_path).joinpath(name_of_model).joinpath(track_path.stem).joinpath("no_vocals." + written)
+        separated = {"vocal": output_vocal, "instrumental": output_no_vocal}
+        if written != extension:
+            separated = {stem: encode_stem(path, extension, writer) for stem, path in separated.items()}
+    params = {"split_mode": split_mode, "split_num": split_num, "clip_mode": clip_mode, "shifts": shifts,
+              "backend": backend, "repo": str(repo)}
+    for stem, path in separated.items():
+        catalog.add_output(path, "demucs", speaker=stem, source_path=track_path, params=params)
+    return separated
 
 
 def separate_vocal_parameterized(param: DemucsGenerateParam) -> dict[str, Path]:
-    return separate_vocal(
-        track_path=param.data.track_path,
-        output_path=param.data.output_path,
-        save_to_config=param.data.save_to_config,
-        name=param.data.name,
-        device=param.data.device,
-        wav_store_method=param.data.wav_store_method,
-        split_mode=param.data.split_mode,
-        split_num=param.data.split_num,
-        clip_mode=param.data.clip_mode,
-        jobs=param.data.jobs,
-        repo=param.data.repo,
-        extension=param.data.extension
-    )
+    return separate_vocal(**param.kwargs())
 
 
 def apply_so_vits(input_vocal: Path,
@@ -194,6 +267,12 @@ def apply_so_vits(input_vocal: Path,
                   absolute_tresh=True,
                   save_to_config=False,
                   name="",
+                  feature_cache=True,
+                  f0_workers=1,
+                  skip_silence=False,
+                  silence_db=-40,
+                  backend="torch",
+                  writer=None,
                   ) -> Path:
     """
     :param input_vocal: the path of the extracted vocal
@@ -212,6 +291,140 @@ def apply_so_vits(input_vocal: Path,
     :param cluster_infer_ratio: the ratio to infer the cluster, default is 0
     :param save_to_config: whether save the config of this function to a file
     :param name: the name of the config file
+    :param feature_cache: whether to keep the f0 and content features on disk, later conversions of the same vocal with
+        other noise scales, cluster ratios or speakers then skip feature extraction, default is True
+    :param f0_workers: the number of processes extracting f0, long vocals are split at silences and extracted in
+        parallel, worth it for harvest and crepe on cpu, default is 1
+    :param skip_silence: whether to convert only the voiced ranges found by RMS analysis, with pad_seconds of margin,
+        silent parts are written as zeros at their exact positions, default is False
+    :param silence_db: the dB threshold under which a frame is silent when skip_silence is set, default is -40
+    :param backend: torch for the fp32 model, int8 for dynamically quantized content and synthesis models on cpu, the
+        quantized models are cached next to the model, default is torch
+    :param writer: the writer.AsyncWriter encoding the output, a future of the path is then returned once converted
+    :return: the path of the output file, named after the input and the speaker
+    """
+    if save_to_config:
+        SoVitsGenerationParam(
+            name=name,
+            input_vocal=input_vocal,
+            output_path=output_path,
+            model_path=model_path,
+            config_file_path=config_file_path,
+            speaker=speaker,
+            cluster=cluster,
+            db_threshold=db_threshold,
+            auto_predict_f0=auto_predict_f0,
+            noice_scale=noice_scale,
+            pad_seconds=pad_seconds,
+            f0_method=f0_method,
+            chunk_seconds=chunk_seconds,
+            max_chunk_seconds=max_chunk_seconds,
+            cluster_infer_ratio=cluster_infer_ratio,
+            absolute_tresh=absolute_tresh,
+            feature_cache=feature_cache,
+            f0_workers=f0_workers,
+            skip_silence=skip_silence,
+            silence_db=silence_db,
+            backend=backend,
+        ).save_as()
+    return apply_so_vits_batch(
+        [(input_vocal, speaker)],
+        output_path=output_path,
+        model_path=model_path,
+        config_file_path=config_file_path,
+        cluster=cluster,
+        db_threshold=db_threshold,
+        auto_predict_f0=auto_predict_f0,
+        noice_scale=noice_scale,
+        pad_seconds=pad_seconds,
+        f0_method=f0_method,
+        chunk_seconds=chunk_seconds,
+        max_chunk_seconds=max_chunk_seconds,
+        cluster_infer_ratio=cluster_infer_ratio,
+        absolute_tresh=absolute_tresh,
+        feature_cache=feature_cache,
+        f0_workers=f0_workers,
+        skip_silence=skip_silence,
+        silence_db=silence_db,
+        backend=backend,
+        writer=writer
+    )[0]
+
+
+def apply_so_vits_parameterized(param: SoVitsGenerationParam) -> Path:
+    return apply_so_vits(**param.kwargs())
+
+
+def load_so_vits_engine(model_path: Path,
+                        config_file_path: Path,
+                        cluster=None,
+                        feature_cache=True,
+                        f0_workers=1,
+                        backend="torch") -> SvcEngine:
+    """
+    load a model once for many conversions, e.g. for the engine parameter of apply_so_vits_batch
+    the parameters are the same as apply_so_vits
+    """
+    return SvcEngine(
+        net_g_path=Path(model_path).as_posix(),
+        config_path=Path(config_file_path).as_posix(),
+        cluster_model_path=Path(cluster).as_posix() if cluster is not None else None,
+        device=get_optimal_device() if backend == "torch" else "cpu",
+        feature_cache=FeatureCache(cache_path.joinpath("features")) if feature_cache else None,
+        f0_workers=f0_workers,
+        backend=backend
+    )
+
+
+def _reserve_output(path: Path) -> bool:
+    """
+    :return: whether path was free and is now an empty placeholder of this call
+    """
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def apply_so_vits_batch(jobs: list[tuple[Path, str]],
+                        output_path: Path,
+                        model_path: Path,
+                        config_file_path: Path,
+                        cluster=None,
+                        db_threshold=-35,
+                        auto_predict_f0=True,
+                        noice_scale=0.4,
+                        pad_seconds=0.5,
+                        f0_method="dio",
+                        chunk_seconds=0.5,
+                        max_chunk_seconds=40,
+                        cluster_infer_ratio=0,
+                        absolute_tresh=True,
+                        feature_cache=True,
+                        f0_workers=1,
+                        skip_silence=False,
+                        silence_db=-40,
+                        backend="torch",
+                        writer=None,
+                        engine=None,
+                        batch_inputs=1,
+                        ) -> list[Path]:
+    """
+    convert many (input, speaker) jobs with one loaded model. every input is split and its f0 and content features are
+    extracted once, then all its speakers are converted together chunk by chunk.
+    :param jobs: list of (input vocal path, speaker)
+    :param output_path: the path of the output directory
+    :param writer: the writer.AsyncWriter encoding the outputs, futures of the paths are then returned, default is a
+        writer of its own, every input is then written while the next one is converted
+    :param engine: an already loaded svc_engine.SvcEngine of model_path, kept open afterwards, e.g. the warm model of
+        the daemon, default is loading the model for this call. its cluster and backend are used, and it must have
+        been loaded with the same feature_cache and f0_workers, see load_so_vits_engine
+    :param batch_inputs: the number of inputs converted together, the chunks of different inputs then share forward
+        passes, up to batch_inputs chunks per pass, default is 1, every input alone while the last one is written
+    :return: the output paths in the order of jobs, every output is named after its input and speaker, with an index
+        when the name is already taken in output_path or by another input of the same stem
+    the other parameters are the same as apply_so_vits
     """
     clamp = lambda num, low, high: min(high, max(num, low))
     db_threshold = clamp(db_threshold, 0., -60.)
@@ -222,38 +435,105 @@ def apply_so_vits(input_vocal: Path,
     cluster_infer_ratio = clamp(cluster_infer_ratio, 0., 1.)
     print("model path: ", model_path)
     f0_method = f0_method if f0_method in ["crepe", "crepe-tiny", "parselmouth", "dio", "harvest"] else "dio"
-    if not input_vocal.exists():
-        raise FileNotFoundError(f"File {input_vocal} not found")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
     if not model_path.exists():
         raise FileNotFoundError(f"Model {model_path} not found")
     if not config_file_path.exists():
         raise FileNotFoundError(f"Config {config_file_path} not found")
     if cluster is not None and not cluster.exists():
         raise FileNotFoundError(f"Cluster model {cluster} not found")
+    with open(config_file_path) as f:
+        available_speakers = json.load(f)["spk"]
+    speakers_of_input = {}
+    for input_vocal, speaker in jobs:
+        if not Path(input_vocal).exists():
+            raise FileNotFoundError(f"File {input_vocal} not found")
+        if speaker not in available_speakers:
+            raise ValueError(f"Speaker {speaker} not found in config {config_file_path}")
+        speakers_of_input.setdefault(Path(input_vocal), [])
+        if speaker not in speakers_of_input[Path(input_vocal)]:
+            speakers_of_input[Path(input_vocal)].append(speaker)
 
-    if speaker not in json.load(open(config_file_path))["spk"]:
-        raise ValueError(f"Speaker {speaker} not found in config {config_file_path}")
+    catalog = open_catalog()
+    catalog.touch(model_path, config_file_path, *(() if cluster is None else (cluster,)), add=True)
+    catalog.touch(*speakers_of_input)
+    params = {"model_path": str(model_path), "cluster_infer_ratio": cluster_infer_ratio, "noice_scale": noice_scale,
+              "f0_method": f0_method, "auto_predict_f0": auto_predict_f0, "backend": backend}
 
-    output_file = output_path / Path(f"voice_generated_with_{speaker}.wav").name
-    infer(
-        input_path=input_vocal,
-        output_path=output_file,
-        model_path=model_path,
-        config_path=config_file_path,
-        speaker=speaker,
-        cluster_model_path=cluster,
-        auto_predict_f0=auto_predict_f0,
-        db_thresh=db_threshold,
-        noise_scale=noice_scale,
-        pad_seconds=pad_seconds,
-        f0_method=f0_method,
-        chunk_seconds=chunk_seconds,
-        max_chunk_seconds=max_chunk_seconds,
-        cluster_infer_ratio=cluster_infer_ratio,
-        absolute_thresh=absolute_tresh
-    )
-    path_out = output_path / Path(f"voice_generated_with_{speaker}.wav").name
-    return path_out
+    if engine is not None and (bool(feature_cache) != (engine.feature_cache is not None)
+                               or f0_workers != engine.f0_workers):
+        raise ValueError(f"engine is loaded with feature_cache={engine.feature_cache is not None} and "
+                         f"f0_workers={engine.f0_workers}, not {bool(feature_cache)} and {f0_workers}")
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    output_files = {}
+    for input_vocal, speakers in speakers_of_input.items():
+        for speaker in speakers:
+            output_file = output_path / f"{input_vocal.stem}_generated_with_{speaker}.wav"
+            index = 1
+            # outputs of earlier and concurrent calls are kept: a name is taken by creating an empty placeholder, which
+            # fails when the file exists, the writer then replaces the placeholder
+            while not _reserve_output(output_file):
+                output_file = output_path / f"{input_vocal.stem}_{index}_generated_with_{speaker}.wav"
+                index += 1
+            output_files[(input_vocal, speaker)] = output_file
+
+    svc_model = engine if engine is not None else load_so_vits_engine(
+        model_path, config_file_path, cluster=cluster, feature_cache=feature_cache, f0_workers=f0_workers,
+        backend=backend)
+    own_writer = writer is None
+    writer = AsyncWriter() if own_writer else writer
+    written = {}
+    try:
+        inputs = list(speakers_of_input.items())
+        for first in range(0, len(inputs), max(1, batch_inputs)):
+            group = inputs[first: first + max(1, batch_inputs)]
+            audios = [librosa.load(str(input_vocal), sr=svc_model.target_sample)[0].astype(np.float32)
+                      for input_vocal, _ in group]
+            converted = svc_model.infer_batch(
+                audios,
+                [speakers for _, speakers in group],
+                skip_silence=skip_silence,
+                auto_predict_f0=auto_predict_f0,
+                cluster_infer_ratio=cluster_infer_ratio,
+                noise_scale=noice_scale,
+                f0_method=f0_method,
+                db_thresh=db_threshold,
+                silence_db=silence_db,
+                pad_seconds=pad_seconds,
+                chunk_seconds=chunk_seconds,
+                absolute_thresh=absolute_tresh,
+                max_chunk_seconds=max_chunk_seconds,
+                max_batch=max(1, batch_inputs)
+            )
+            for (input_vocal, speakers), outputs in zip(group, converted):
+                for speaker in speakers:
+                    written[(input_vocal, speaker)] = writer.submit(output_files[(input_vocal, speaker)],
+                                                                    outputs[speaker], svc_model.target_sample)
+                    catalog.add_output(written[(input_vocal, speaker)], "so-vits", speaker=speaker,
+                                       source_path=input_vocal, params=params)
+            svc_model.clear_features()
+        if own_writer:
+            writer.wait()
+    except BaseException:
+        # free the names of the outputs that were never written
+        for key, output_file in output_files.items():
+            if key not in written or (own_writer and written[key].done() and written[key].exception() is not None):
+                if output_file.exists() and output_file.stat().st_size == 0:
+                    output_file.unlink()
+        raise
+    finally:
+        if own_writer:
+            writer.close()
+        if engine is None:
+            svc_model.close()
+        else:
+            svc_model.clear_features()
+        del svc_model
+    if not own_writer:
+        return [written[(Path(input_vocal), speaker)] for input_vocal, speaker in jobs]
+    return [output_files[(Path(input_vocal), speaker)] for input_vocal, speaker in jobs]
 
 
 def fuse_vocal_and_instrumental(
@@ -261,37 +541,57 @@ def fuse_vocal_and_instrumental(
         instrumental_path: Path,
         output_path: Path,
         speaker: str,
-        extension="wav"):
+        extension="wav",
+        vocal: np.ndarray = None,
+        instrumental: np.ndarray = None,
+        writer: AsyncWriter = None):
     """
-    :param vocal_path: the path of the vocal
-    :param instrumental_path: the path of the instrumental
+    :param vocal_path: the path of the vocal, only used for naming the output when vocal is given
+    :param instrumental_path: the path of the instrumental, not read when instrumental is given
     :param output_path: the path of the output file
     :param speaker: the speaker of the vocal
     :param extension: the extension of the output file, default is wav
+    :param vocal: the already decoded vocal at 44100Hz, e.g. from ingest.decode_audio, (samples,) or
+        (samples, channels) that is mixed down
+    :param instrumental: the already decoded instrumental at 44100Hz, the same shapes as vocal
+    :param writer: the writer.AsyncWriter encoding the output, a future of the path is then returned at once
+    :return: the path of the output file, or its future when writer is given
     """
-    if not vocal_path.exists():
+    if vocal is None and not vocal_path.exists():
         raise FileNotFoundError(f"File {vocal_path} not found")
-    if not instrumental_path.exists():
+    if instrumental is None and not instrumental_path.exists():
         raise FileNotFoundError(f"File {instrumental_path} not found")
     output_path.mkdir(parents=True, exist_ok=True)
-    
-    vocal, sr_vocal = librosa.load(str(vocal_path.resolve()), sr=44100)
-    instrumental, sr_instrumental = librosa.load(str(instrumental_path.resolve()), sr=44100)
+
+    sr_instrumental = 44100
+    if vocal is None:
+        vocal, _ = librosa.load(str(vocal_path.resolve()), sr=44100)
+    if instrumental is None:
+        instrumental, _ = librosa.load(str(instrumental_path.resolve()), sr=44100)
+    vocal, instrumental = np.asarray(vocal), np.asarray(instrumental)
+    if vocal.ndim > 2 or instrumental.ndim > 2:
+        raise ValueError("vocal and instrumental must be (samples,) or (samples, channels)")
+    # decoded audio is interleaved (samples, channels), flattening it would put the channels one after the other
+    vocal = vocal.mean(axis=1) if vocal.ndim == 2 else vocal
+    instrumental = instrumental.mean(axis=1) if instrumental.ndim == 2 else instrumental
     audio = instrumental + vocal
-    soundfile.write(output_path / Path(vocal_path.stem + f"_counterfeited_from_{speaker}." + extension.strip(".")).name, audio, sr_instrumental, format=extension.strip("."))
-    if not Path(output_path / Path(vocal_path.stem + f"_counterfeited_from_{speaker}." + extension.strip(".")).name).exists():
-        print(output_path / Path(vocal_path.stem + f"_counterfeited_from_{speaker}." + extension.strip(".")).name)
+    output_file = output_path / Path(vocal_path.stem + f"_counterfeited_from_{speaker}." + extension.strip(".")).name
+    if writer is not None:
+        return writer.submit(output_file, audio, sr_instrumental)
+    encode(output_file, audio, sr_instrumental)
     print("done")
-    return output_path / Path(vocal_path.stem + f"_counterfeited_from_{speaker}." + extension.strip(".")).name
+    return output_file
 
 
 def extract_video_audio(video_path: Path, dir_out: Path, desired_sample_rate=None) -> Path:
+    """
+    :param video_path: the path of the video
+    :param dir_out: the path of the output directory
+    :param desired_sample_rate: the sample rate of the output file, default is the sample rate of the video
+    :return: the path of the extracted wav file, ingest.decode_audio gives the audio without writing it
+    """
     dir_out.mkdir(parents=True, exist_ok=True)
-    cmd = f"ffmpeg -hide_banner -i {video_path} {dir_out / f'{video_path.stem}_audio.wav '} -y"
-    os.system(cmd)
-    while not (dir_out / f"{video_path.stem}_audio.wav").exists():
-        pass
-    return dir_out / f"{video_path.stem}_audio.wav"
+    return extract_audio_file(video_path, dir_out / f"{video_path.stem}_audio.wav", desired_sample_rate)
 
 
 def resample(input_path: Path, output_path: Path, sample_rate: int=44100):
@@ -304,8 +604,8 @@ def resample(input_path: Path, output_path: Path, sample_rate: int=44100):
     if not input_path.exists():
         raise FileNotFoundError(f"File {input_path} not found")
     output_path.mkdir(parents=True, exist_ok=True)
-    audio, sr = librosa.load(input_path)
-    librosa.resample(audio, sr, sample_rate)
+    audio, sr = librosa.load(input_path, sr=None)
+    audio = librosa.resample(audio, orig_sr=sr, target_sr=sample_rate)
     soundfile.write(output_path.joinpath(f"{input_path.stem}_resampled_{sample_rate}{input_path.suffix}").resolve(), audio, sample_rate, format='wav')
     return output_path.joinpath(f"{input_path.stem}_resampled_{sample_rate}{input_path.suffix}").resolve()
 
@@ -371,7 +671,12 @@ def slice_audio(
         hop_length_ms: int = 10,
         max_silence_len_ms: int = 500,
         extension: str = "wav",
-        desired_samplerate:int = 44100
+        desired_samplerate:int = 44100,
+        envelope_cache: bool = False,
+        channel_mode: str = "mean",
+        audio: np.ndarray = None,
+        decoder: str = "soundfile",
+        writer: AsyncWriter = None
 ) -> Path:
     """
     :param input_path: the path of the input file
@@ -383,30 +688,67 @@ def slice_audio(
     :param max_silence_len_ms: the max silence length in ms, default is 500
     :param extension: the extension of the output file, default is wav
     :param desired_samplerate: the desired sample rate of the output file, default is 44100
+    :param envelope_cache: whether to reuse the RMS envelope cached next to the input, re-slicing the same file with
+        other thresholds then skips the RMS computation, default is False
+    :param channel_mode: silence detection of multichannel input, "mean" for the downmix or "max" for the loudest
+        channel, default is mean
+    :param audio: the already decoded audio at desired_samplerate, (samples, channels) or (samples,), input_path is
+        then only used for naming the slices
+    :param decoder: "soundfile", or "ffmpeg" to decode any media file, video included, straight to desired_samplerate
+        without an intermediate file, default is soundfile
+    :param writer: the writer.AsyncWriter encoding the slices, the function then returns before they are written and
+        writer.wait() gives their paths, default is a writer of its own that is waited for before returning
     """
     if path_out is None:
         path_out = so_vits_dataset_path.joinpath(input_path.stem).joinpath("sliced")
-    if not input_path.exists():
+    if audio is None and not input_path.exists():
         raise FileNotFoundError(f"File {input_path} not found")
-    if librosa.get_samplerate(input_path) != desired_samplerate:
-        t = resample(input_path, Path(input_path.stem + f"_resampled_{desired_samplerate}" + input_path.suffix), desired_samplerate)
-        os.remove(input_path)
-        input_path = t
+    if audio is not None:
+        audio, sr = np.asarray(audio, dtype=np.float32).reshape(len(audio), -1), desired_samplerate
+    elif decoder == "ffmpeg":
+        audio, sr = decode_audio(input_path, desired_samplerate), desired_samplerate
+    else:
+        if librosa.get_samplerate(input_path) != desired_samplerate:
+            t = resample(input_path, Path(input_path.stem + f"_resampled_{desired_samplerate}" + input_path.suffix), desired_samplerate)
+            os.remove(input_path)
+            input_path = t
+        try:
+            # interleaved (samples, channels), every clip is then a contiguous block of rows
+            audio, sr = soundfile.read(input_path, dtype="float32", always_2d=True)
+        except RuntimeError:
+            # m4a, aac, mp4 and the other formats libsndfile cannot read are decoded by librosa through audioread
+            audio, sr = librosa.load(input_path, sr=None, mono=False)
+            audio = np.ascontiguousarray(audio.reshape(-1, audio.shape[-1]).T)
     path_out.mkdir(parents=True, exist_ok=True)
-    audio, sr = librosa.load(input_path, sr=None, mono=False)
+    waveform = audio.T if audio.shape[1] > 1 else audio[:, 0]
     slicer = Slicer(
         sr=sr,
         threshold=db_threshold,
         min_length=min_len_ms,
         min_interval=min_silence_interval_ms,
         hop_size=hop_length_ms,
-        max_sil_kept=max_silence_len_ms
+        max_sil_kept=max_silence_len_ms,
+        channel_mode=channel_mode
     )
-    chunks = slicer.slice(audio)
-    for i, chunk in enumerate(chunks):
-        if len(chunk.shape) > 1:
-            chunk = chunk.T
-        soundfile.write(path_out.joinpath(input_path.stem + f"_{i}th_slice" + f".{extension}"), chunk, sr)
+    envelope = load_envelope(input_path, waveform, sr, aligned_hop(slicer.win_size, slicer.hop_size)) \
+        if envelope_cache and input_path.exists() else None
+    catalog = open_catalog()
+    catalog.touch(input_path)
+    own_writer = writer is None
+    writer = AsyncWriter() if own_writer else writer
+    slices = []
+    try:
+        for i, (begin, end) in enumerate(slicer.slice_ranges(waveform, envelope)):
+            path = writer.submit(path_out.joinpath(input_path.stem + f"_{i}th_slice" + f".{extension}"), audio[begin:end],
+                                 sr)
+            slices.append({"path": path, "begin": begin, "end": end, "duration": (end - begin) / sr})
+        if own_writer:
+            for i in slices:
+                i["path"] = i["path"].result()
+        catalog.add_slices(catalog.add_dataset("so-vits", input_path.stem, path_out), slices)
+    finally:
+        if own_writer:
+            writer.close()
     return path_out
 
 def generate_config(
@@ -415,30 +757,44 @@ def generate_config(
         val_data_path: Path = None,
         test_data_path: Path = None,
         config_file_path: Path = None,
-        config_name: str = "config.json"
+        config_name: str = "config.json",
+        preprocess: bool = False,
+        workers: int = None
 ):
     """
     :param sliced_path: the path to the separated dataset folder
-    :param train_data_path: the output path of training dataset
-    :param val_data_path: the output path of validation dataset
-    :param test_data_path: the output path of testing dataset
+    :param train_data_path: the file list of the training slices written by preprocess_config, default is
+        filelists/train.txt in the folder of the dataset
+    :param val_data_path: the file list of the validation slices, default is filelists/val.txt
+    :param test_data_path: the file list of the testing slices, default is filelists/test.txt
     :param config_file_path: the path of the output config file
     :param config_name: the name of the output config file
+    :param preprocess: whether to compute the f0 and content features of the slices of the file lists with
+        preprocess.preprocess_dataset, into features in the folder of the dataset, only the slices added since the
+        last run are computed, default is False
+    :param workers: the number of preprocessing processes, default is one per core
     """
+    dataset_path = so_vits_dataset_path.joinpath(sliced_path.stem)
     if train_data_path is None:
-        train_data_path = so_vits_dataset_path.joinpath(sliced_path.stem).joinpath("train")
-        train_data_path.mkdir(parents=True, exist_ok=True)
+        train_data_path = dataset_path.joinpath("filelists").joinpath("train.txt")
     if val_data_path is None:
-        val_data_path = so_vits_dataset_path.joinpath(sliced_path.stem).joinpath("val")
-        val_data_path.mkdir(parents=True, exist_ok=True)
+        val_data_path = dataset_path.joinpath("filelists").joinpath("val.txt")
     if test_data_path is None:
-        test_data_path = so_vits_dataset_path.joinpath(sliced_path.stem).joinpath("test")
-        test_data_path.mkdir(parents=True, exist_ok=True)
+        test_data_path = dataset_path.joinpath("filelists").joinpath("test.txt")
+    for i in (train_data_path, val_data_path, test_data_path):
+        Path(i).parent.mkdir(parents=True, exist_ok=True)
     if config_file_path is None:
-        config_file_path = so_vits_dataset_path.joinpath(sliced_path.stem).joinpath(config_name)
-        so_vits_dataset_path.joinpath(sliced_path.stem).joinpath(config_name).touch(exist_ok=True)
+        config_file_path = dataset_path.joinpath(config_name)
+        dataset_path.mkdir(parents=True, exist_ok=True)
+        config_file_path.touch(exist_ok=True)
 
     preprocess_config(sliced_path, train_data_path, val_data_path, test_data_path, config_file_path, config_name)
 
-    return {"train": train_data_path, "val": val_data_path, "test": test_data_path, "config": config_file_path}
+    result = {"train": train_data_path, "val": val_data_path, "test": test_data_path, "config": config_file_path}
+    if preprocess:
+        result["features"] = preprocess_dataset(
+            {"train": train_data_path, "val": val_data_path, "test": test_data_path},
+            output_path=Path(config_file_path).parent.joinpath("features"), config_path=config_file_path,
+            workers=workers).root
+    return result
 
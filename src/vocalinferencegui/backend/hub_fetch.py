@@ -0,0 +1,93 @@
+import fnmatch
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HUB_LINK = re.compile(r"https://huggingface\.co/([-\w.]+)/([-\w.]+)(?:/(?:tree|blob|resolve)/([^/]+)(?:/(.*))?)?/?$")
+
+
+def parse_hub_link(link: str) -> tuple:
+    """
+    :param link: a huggingface.co link to a repo, optionally to a revision and a folder in it
+    :return: (repo_id, revision, folder), revision and folder are None when the link has none
+    """
+    match = HUB_LINK.match(link.strip())
+    if match is None:
+        raise ValueError(f"{link} is not a huggingface repo link")
+    owner, repo, revision, folder = match.groups()
+    return f"{owner}/{repo}", revision, (folder or "").strip("/") or None
+
+
+class HubClient:
+    """
+    the part of huggingface_hub fetch_files uses, replace it to fetch from somewhere else
+    """
+
+    def list_repo_files(self, repo_id: str, revision: str = None, token: str = None) -> list:
+        import huggingface_hub
+        return huggingface_hub.list_repo_files(repo_id, revision=revision, token=token)
+
+    def hf_hub_download(self, repo_id: str, filename: str, revision: str = None, token: str = None,
+                        force_download: bool = False) -> str:
+        import huggingface_hub
+        return huggingface_hub.hf_hub_download(repo_id, filename, revision=revision, token=token,
+                                               force_download=force_download)
+
+
+def link_file(source: Path, target: Path):
+    """
+    symlink target to source, hard link or copy where symlinks are not allowed
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.is_symlink() or target.exists():
+        target.unlink()
+    try:
+        os.symlink(source, target)
+    except OSError:
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+
+def fetch_files(
+        link: str,
+        local_dir: Path,
+        patterns: list = ("*.pth", "*.pt", "*.json"),
+        workers: int = 4,
+        force_download: bool = False,
+        token: str = None,
+        client: HubClient = None
+) -> dict:
+    """
+    download the files of a hub repo that match patterns, each file once, into the shared huggingface cache, and link
+    them into local_dir instead of copying
+    :param link: a huggingface.co link to a repo, or to a folder of it
+    :param local_dir: the directory the files are linked into, the repo layout is kept
+    :param patterns: fnmatch patterns, a file is fetched if its name or its path matches one of them
+    :param workers: the number of files downloaded at the same time
+    :param force_download: whether to download again files that are already cached
+    :param token: the huggingface token for private repos
+    :param client: the hub client, default is huggingface_hub
+    :return: path in the repo -> linked local path
+    """
+    client = HubClient() if client is None else client
+    repo_id, revision, folder = parse_hub_link(link)
+    files = client.list_repo_files(repo_id, revision=revision, token=token)
+    if folder is not None:
+        files = [i for i in files if i.startswith(folder + "/")]
+    files = [i for i in files
+             if any(fnmatch.fnmatch(i, pattern) or fnmatch.fnmatch(i.rsplit("/", 1)[-1], pattern)
+                    for pattern in patterns)]
+
+    def fetch(filename: str) -> Path:
+        cached = Path(client.hf_hub_download(repo_id, filename, revision=revision, token=token,
+                                             force_download=force_download))
+        target = Path(local_dir).joinpath(filename)
+        link_file(cached, target)
+        return target.absolute()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(files, executor.map(fetch, files)))
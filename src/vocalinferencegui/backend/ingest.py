@@ -0,0 +1,135 @@
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+
+
+def ffmpeg_command(path: Path, sr: int, channels: int, start: float = None, duration: float = None) -> list:
+    """
+    :return: the ffmpeg arguments decoding the first audio stream of path to raw float32 pcm on stdout
+    """
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if start is not None:
+        command += ["-ss", str(start)]
+    command += ["-i", str(path)]
+    if duration is not None:
+        command += ["-t", str(duration)]
+    command += ["-map", "0:a:0", "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(sr), "-ac", str(channels),
+                "pipe:1"]
+    return command
+
+
+def probe_channels(path: Path) -> int:
+    """
+    :return: the number of channels of the first audio stream of path
+    """
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=channels", "-of", "json", str(path)],
+        capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {path}: {result.stderr.decode(errors='replace').strip()}")
+    streams = json.loads(result.stdout).get("streams", [])
+    if not streams:
+        raise ValueError(f"{path} has no audio stream")
+    return int(streams[0]["channels"])
+
+
+def _check(path: Path):
+    if not Path(path).exists():
+        raise FileNotFoundError(f"File {path} not found")
+
+
+def decode_audio(path: Path, sr: int = 44100, channels: int = None, start: float = None,
+                 duration: float = None) -> np.ndarray:
+    """
+    decode the audio of any file ffmpeg can read, video included, without an intermediate file
+    :param path: the path of the media file
+    :param sr: the sample rate to decode to, default is 44100
+    :param channels: the number of channels to decode to, default is the number of channels of the file
+    :param start: where to start in seconds, default is the beginning
+    :param duration: how many seconds to decode, default is until the end
+    :return: float32 array of shape (samples, channels), the layout soundfile.read(always_2d=True) returns
+    """
+    _check(path)
+    channels = probe_channels(path) if channels is None else channels
+    result = subprocess.run(ffmpeg_command(path, sr, channels, start, duration), capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype="<f4").reshape(-1, channels)
+
+
+def stream_audio(path: Path, sr: int = 44100, channels: int = None, block_size: int = 65536, start: float = None,
+                 duration: float = None):
+    """
+    decode a media file block by block, only one block is held in memory at a time
+    :param path: the path of the media file
+    :param sr: the sample rate to decode to, default is 44100
+    :param channels: the number of channels to decode to, default is the number of channels of the file
+    :param block_size: samples per block, the last block may be shorter
+    :param start: where to start in seconds, default is the beginning
+    :param duration: how many seconds to decode, default is until the end
+    :return: generator of float32 arrays of shape (block_size, channels)
+    """
+    _check(path)
+    channels = probe_channels(path) if channels is None else channels
+    block_bytes = block_size * channels * 4
+    process = subprocess.Popen(ffmpeg_command(path, sr, channels, start, duration), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    try:
+        pending = b""
+        while True:
+            data = process.stdout.read(block_bytes - len(pending))
+            if not data:
+                break
+            pending += data
+            if len(pending) == block_bytes:
+                yield np.frombuffer(pending, dtype="<f4").reshape(-1, channels)
+                pending = b""
+        if pending:
+            usable = len(pending) - len(pending) % (channels * 4)
+            yield np.frombuffer(pending[:usable], dtype="<f4").reshape(-1, channels)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr.decode(errors='replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def decode_batch(paths: list, sr: int = 44100, channels: int = None, workers: int = 4) -> list:
+    """
+    decode several media files at the same time, every decode runs in its own ffmpeg process
+    :param paths: the paths of the media files
+    :param workers: the number of ffmpeg processes running at the same time, default is 4
+    :return: the decoded arrays in the order of paths
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(lambda path: decode_audio(path, sr, channels), paths))
+
+
+def extract_audio_file(path: Path, output: Path, sr: int = None) -> Path:
+    """
+    write the audio of a media file to a wav file
+    :param path: the path of the media file
+    :param output: the path of the wav file
+    :param sr: the sample rate of the wav file, default is the sample rate of the media file
+    :return: output
+    """
+    _check(path)
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", str(path), "-map", "0:a:0", "-vn"]
+    if sr is not None:
+        command += ["-ar", str(sr)]
+    result = subprocess.run(command + [str(output)], capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to extract the audio of {path}: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    return Path(output)
@@ -0,0 +1,390 @@
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+
+STATES = ("pending", "running", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, kind, created);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (state, lease_until);
+"""
+
+
+@dataclass(slots=True)
+class Job:
+    id: str
+    kind: str
+    payload: dict
+    state: str = "pending"
+    attempts: int = 0
+    max_attempts: int = 3
+    worker: str = None
+    lease_until: float = None
+    result: object = None
+    error: str = None
+
+
+class Broker(ABC):
+    """
+    the queue the workers share. a claimed job is leased to its worker, the worker renews the lease with heartbeat
+    while it runs the job, a job whose lease runs out (its worker died or lost the connection) is claimed again.
+    """
+
+    @abstractmethod
+    def submit(self, kind: str, payload: dict, max_attempts: int = 3) -> str:
+        """
+        :param kind: the handler that runs the job
+        :param payload: json serializable arguments of the handler
+        :param max_attempts: how many times the job runs before it is marked failed
+        :return: the id of the job
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, kinds=None, lease_seconds: float = 60) -> Job | None:
+        """
+        :param worker: the name of the claiming worker
+        :param kinds: the kinds the worker can run, every kind if None
+        :param lease_seconds: how long the job is leased before it can be claimed by another worker
+        :return: the oldest claimable job, None if there is none
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str, lease_seconds: float = 60) -> bool:
+        """
+        :return: whether the worker still holds the lease, it is renewed if so
+        """
+
+    @abstractmethod
+    def complete(self, job_id: str, worker: str, result=None) -> bool:
+        """
+        :return: whether the result was accepted, False if the lease was lost to another worker
+        """
+
+    @abstractmethod
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        """
+        put the job back in the queue, or mark it failed once it ran max_attempts times
+        :return: whether the failure was accepted, False if the lease was lost to another worker
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Job:
+        pass
+
+    @abstractmethod
+    def jobs(self, state: str = None) -> list:
+        pass
+
+    def wait(self, job_ids: list, timeout: float = None, poll: float = 0.5) -> list:
+        """
+        :return: the jobs once every one of them is done or failed
+        :raise TimeoutError: if they are not finished after timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            jobs = [self.get(i) for i in job_ids]
+            if all(i.state in ("done", "failed") for i in jobs):
+                return jobs
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{sum(i.state not in ('done', 'failed') for i in jobs)} jobs not finished")
+            time.sleep(poll)
+
+
+class SQLiteBroker(Broker):
+    """
+    a broker in one sqlite file, shared by the worker processes of a machine, or by several machines through a network
+    file system with working locks when shared is set. claiming is a single write transaction, so a job is never
+    leased twice.
+    """
+
+    def __init__(self, path: Path, shared: bool = False):
+        """
+        :param path: the path of the database file, created if missing
+        :param shared: whether the file is on a network file system used by several machines, the database then uses
+            the rollback journal, which only needs file locks, instead of the write-ahead log, whose shared memory
+            index only works for the processes of one machine. default is False
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._connection.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._connection)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            return result
+
+    @staticmethod
+    def _job(row) -> Job:
+        return Job(id=row["id"], kind=row["kind"], payload=json.loads(row["payload"]), state=row["state"],
+                   attempts=row["attempts"], max_attempts=row["max_attempts"], worker=row["worker"],
+                   lease_until=row["lease_until"], result=None if row["result"] is None else json.loads(row["result"]),
+                   error=row["error"])
+
+    def submit(self, kind: str, payload: dict, max_attempts: int = 3) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._transaction(lambda c: c.execute(
+            "INSERT INTO jobs (id, kind, payload, max_attempts, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, default=str), max(1, max_attempts), now, now)))
+        return job_id
+
+    def claim(self, worker: str, kinds=None, lease_seconds: float = 60) -> Job | None:
+        def claim(c):
+            now = time.time()
+            sql = "SELECT * FROM jobs WHERE (state = 'pending' OR (state = 'running' AND lease_until < ?))"
+            parameters = [now]
+            if kinds is not None:
+                kinds_ = list(kinds)
+                sql += f" AND kind IN ({', '.join('?' * len(kinds_))})"
+                parameters += kinds_
+            row = c.execute(sql + " ORDER BY created LIMIT 1", parameters).fetchone()
+            if row is None:
+                return None
+            if row["attempts"] >= row["max_attempts"]:
+                # the lease of the last attempt ran out
+                c.execute("UPDATE jobs SET state = 'failed', error = ?, worker = NULL, lease_until = NULL, "
+                          "updated = ? WHERE id = ?", (row["error"] or "lease expired", now, row["id"]))
+                return claim(c)
+            c.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, "
+                      "updated = ? WHERE id = ?", (worker, now + lease_seconds, now, row["id"]))
+            return self._job(c.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+        return self._transaction(claim)
+
+    def heartbeat(self, job_id: str, worker: str, lease_seconds: float = 60) -> bool:
+        now = time.time()
+        return self._transaction(lambda c: c.execute(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND state = 'running'",
+            (now + lease_seconds, now, job_id, worker)).rowcount) == 1
+
+    def complete(self, job_id: str, worker: str, result=None) -> bool:
+        return self._transaction(lambda c: c.execute(
+            "UPDATE jobs SET state = 'done', result = ?, error = NULL, lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND state = 'running'",
+            (json.dumps(result, default=str), time.time(), job_id, worker)).rowcount) == 1
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        return self._transaction(lambda c: c.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "error = ?, worker = NULL, lease_until = NULL, updated = ? "
+            "WHERE id = ? AND worker = ? AND state = 'running'",
+            (error, time.time(), job_id, worker)).rowcount) == 1
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Job {job_id} not found")
+        return self._job(row)
+
+    def jobs(self, state: str = None) -> list:
+        if state is not None and state not in STATES:
+            raise ValueError(f"state must be one of {', '.join(STATES)}")
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM jobs" + ("" if state is None else " WHERE state = ?") + " ORDER BY created",
+                () if state is None else (state,)).fetchall()
+        return [self._job(i) for i in rows]
+
+
+class OutputStore:
+    """
+    the directory the results of every job are published to, e.g. a shared network mount. a published file is
+    copied under a temporary name and renamed, so readers never see a partial file.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def publish(self, job_id: str, path: Path) -> Path:
+        """
+        :return: the path of the published copy, root/job_id/file name
+        """
+        path = Path(path)
+        target = self.root.joinpath(job_id, path.name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix="." + path.name)
+        os.close(fd)
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+        return target
+
+    def publish_result(self, job_id: str, result):
+        """
+        publish every existing file in result, a path, or a list or dict of them
+        :return: result with the published paths in place of the local ones
+        """
+        if isinstance(result, dict):
+            return {key: self.publish_result(job_id, value) for key, value in result.items()}
+        if isinstance(result, (list, tuple)):
+            return [self.publish_result(job_id, i) for i in result]
+        if isinstance(result, Path) and result.is_file():
+            return str(self.publish(job_id, result))
+        return result
+
+
+def _paths(payload: dict, *keys) -> dict:
+    return {key: Path(value) if key in keys and value is not None else value for key, value in payload.items()}
+
+
+def _ncm(payload: dict, work_dir: Path):
+    from functions import convert_ncm
+    return convert_ncm(Path(payload["file_path"]), work_dir)
+
+
+def _separate(payload: dict, work_dir: Path):
+    from functions import separate_vocal
+    return separate_vocal(**_paths(payload, "track_path"), output_path=work_dir)
+
+
+def _convert_voice(payload: dict, work_dir: Path):
+    from functions import apply_so_vits
+    return apply_so_vits(**_paths(payload, "input_vocal", "model_path", "config_file_path", "cluster"),
+                         output_path=work_dir)
+
+
+def _fuse(payload: dict, work_dir: Path):
+    from functions import fuse_vocal_and_instrumental
+    return fuse_vocal_and_instrumental(**_paths(payload, "vocal_path", "instrumental_path"), output_path=work_dir)
+
+
+# kind -> handler(payload, work_dir) -> result, the payload holds the arguments of the function except output_path
+PIPELINE_HANDLERS = {
+    "ncm": _ncm,
+    "separate": _separate,
+    "convert-voice": _convert_voice,
+    "fuse": _fuse,
+}
+
+
+class Worker:
+    """
+    claims jobs from a broker and runs them one at a time, run as many workers as there are processes or hosts to
+    spare, they only share the broker and the output store
+    """
+
+    def __init__(self, broker: Broker, store: OutputStore, handlers: dict = None, name: str = None,
+                 lease_seconds: float = 60, work_path: Path = None):
+        """
+        :param broker: the shared broker
+        :param store: the shared output store, the files a handler returns are published to it
+        :param handlers: kind -> handler(payload, work_dir) -> result, default is PIPELINE_HANDLERS
+        :param name: the name of the worker, default is host:pid:random
+        :param lease_seconds: the lease of a claimed job, renewed every third of it while the job runs
+        :param work_path: where the jobs write before publishing, default is a temporary directory
+        """
+        self.broker = broker
+        self.store = store
+        self.handlers = PIPELINE_HANDLERS if handlers is None else handlers
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.work_path = Path(tempfile.mkdtemp(prefix="vocal_worker_")) if work_path is None else Path(work_path)
+
+    def _heartbeat(self, job: Job, stop: threading.Event):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.broker.heartbeat(job.id, self.name, self.lease_seconds):
+                print(f"worker {self.name} lost the lease of job {job.id}")
+                return
+
+    def run_once(self) -> Job | None:
+        """
+        claim and run one job
+        :return: the job as it was claimed, None if there was nothing to claim
+        """
+        job = self.broker.claim(self.name, self.handlers.keys(), self.lease_seconds)
+        if job is None:
+            return None
+        work_dir = self.work_path.joinpath(job.id)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.store.publish_result(job.id, self.handlers[job.kind](job.payload, work_dir))
+        except Exception:
+            stop.set()
+            self.broker.fail(job.id, self.name, traceback.format_exc())
+        else:
+            stop.set()
+            self.broker.complete(job.id, self.name, result)
+        finally:
+            # also stops the heartbeat on KeyboardInterrupt and SystemExit, the job is then claimed again after its lease
+            stop.set()
+            heartbeat.join()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return job
+
+    def run(self, stop: threading.Event = None, max_jobs: int = None, idle_seconds: float = None,
+            poll: float = 1.):
+        """
+        run jobs until stop is set, max_jobs jobs ran, or the queue stayed empty for idle_seconds
+        :return: the number of jobs run
+        """
+        count, idle_since = 0, time.monotonic()
+        while (stop is None or not stop.is_set()) and (max_jobs is None or count < max_jobs):
+            if self.run_once() is None:
+                if idle_seconds is not None and time.monotonic() - idle_since > idle_seconds:
+                    break
+                time.sleep(poll)
+            else:
+                count += 1
+                idle_since = time.monotonic()
+        return count
+
+
+def run_worker(broker_path: Path, store_path: Path, max_jobs: int = None, idle_seconds: float = None,
+               lease_seconds: float = 60, shared: bool = False) -> int:
+    """
+    a worker process over the pipeline handlers, start one per process and host to scale, e.g. with
+    multiprocessing or scheduler.CoreBudgetExecutor
+    :param shared: whether the broker is on a network file system used by several hosts, see SQLiteBroker
+    :return: the number of jobs run
+    """
+    with SQLiteBroker(broker_path, shared=shared) as broker:
+        return Worker(broker, OutputStore(store_path), lease_seconds=lease_seconds).run(
+            max_jobs=max_jobs, idle_seconds=idle_seconds)
@@ -0,0 +1,110 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Slicer import Slicer
+
+
+def compute_f0(wav, p_len, sampling_rate, hop_length, method):
+    from so_vits_svc_fork.f0 import compute_f0 as so_vits_compute_f0
+    return so_vits_compute_f0(wav, p_len, sampling_rate=sampling_rate, hop_length=hop_length, method=method)
+
+
+def split_points(audio: np.ndarray, sr: int, hop_length: int, min_chunk_seconds: float = 10.,
+                 max_chunk_seconds: float = 30.) -> list:
+    """
+    cut points for chunked f0 extraction, in the middle of the silences found by Slicer and aligned to the f0 hop
+    :param audio: the mono waveform
+    :param sr: sample rate of the waveform
+    :param hop_length: hop length of the f0 contour in samples
+    :param min_chunk_seconds: the minimum length of a chunk
+    :param max_chunk_seconds: chunks without any silence longer than this are cut evenly
+    :return: sorted cut points including 0 and the last frame boundary
+    """
+    n_frames = audio.shape[-1] // hop_length
+    slicer = Slicer(sr=sr, min_length=int(min_chunk_seconds * 1000), min_interval=300, hop_size=10, max_sil_kept=500)
+    ranges = slicer.slice_ranges(audio)
+    cuts = [0]
+    for (_, end), (begin, _) in zip(ranges[:-1], ranges[1:]):
+        cuts.append(round((end + begin) / 2 / hop_length))
+    cuts.append(n_frames)
+    max_frames = max(1, int(max_chunk_seconds * sr / hop_length))
+    points = [0]
+    for begin, end in zip(cuts[:-1], cuts[1:]):
+        pieces = -(-(end - begin) // max_frames)
+        points.extend(begin + (end - begin) * (i + 1) // pieces for i in range(pieces))
+    return sorted(set(i * hop_length for i in points))
+
+
+def compute_f0_parallel(
+        audio: np.ndarray,
+        sr: int,
+        hop_length: int,
+        method: str = "harvest",
+        workers: int = None,
+        overlap_seconds: float = 0.5,
+        min_chunk_seconds: float = 10.,
+        max_chunk_seconds: float = 30.,
+        f0_fn=compute_f0,
+        executor=None
+) -> np.ndarray:
+    """
+    f0 contour of a long vocal computed chunk by chunk in a process pool, the same shape as a single pass
+    :param audio: the mono waveform
+    :param sr: sample rate of the waveform
+    :param hop_length: hop length of the contour in samples
+    :param method: the f0 method passed to f0_fn
+    :param workers: the number of worker processes, default is the number of cpu cores
+    :param overlap_seconds: extra audio given to each chunk on both sides, contours are cross-faded over its inner half
+    :param min_chunk_seconds: the minimum length of a chunk
+    :param max_chunk_seconds: the maximum length of a chunk without silence
+    :param f0_fn: picklable f0_fn(wav, p_len, sampling_rate, hop_length, method), default is so-vits-svc-fork's
+    :param executor: an executor to reuse instead of starting a process pool
+    :return: f0 of every frame, audio.shape[-1] // hop_length frames
+    """
+    n_frames = audio.shape[-1] // hop_length
+    points = split_points(audio, sr, hop_length, min_chunk_seconds, max_chunk_seconds)
+    if len(points) <= 2:
+        return np.asarray(f0_fn(audio, n_frames, sr, hop_length, method))
+    overlap = int(overlap_seconds * sr) // hop_length * hop_length
+    windows = []
+    for begin, end in zip(points[:-1], points[1:]):
+        begin, end = max(0, begin - overlap), min(audio.shape[-1], end + overlap)
+        windows.append((begin, end))
+
+    own_executor = executor is None
+    if own_executor:
+        # spawn, forking a process that holds torch and its thread pools is not safe
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [executor.submit(f0_fn, audio[begin:end], (end - begin) // hop_length, sr, hop_length, method)
+                   for begin, end in windows]
+        contours = [np.asarray(i.result()) for i in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    f0 = np.zeros(n_frames, dtype=np.float32)
+    weight = np.zeros(n_frames, dtype=np.float32)
+    overlap_frames = overlap // hop_length
+    margin = overlap_frames // 2
+    fade_in = np.linspace(0, 1, overlap_frames + 2, dtype=np.float32)[1:-1]
+    for (begin, end), contour in zip(windows, contours):
+        begin_frame = begin // hop_length
+        contour = contour[: n_frames - begin_frame]
+        chunk_weight = np.ones(contour.shape[0], dtype=np.float32)
+        if overlap_frames > 0 and contour.shape[0] > 2 * (margin + overlap_frames):
+            # the outer half of the extra audio is context only, the neighbouring contours are cross-faded over the
+            # inner half, so no frame near a window edge is used
+            if begin > 0:
+                chunk_weight[:margin] = 0.
+                chunk_weight[margin: margin + overlap_frames] = fade_in
+            if end < audio.shape[-1]:
+                chunk_weight[contour.shape[0] - margin:] = 0.
+                chunk_weight[contour.shape[0] - margin - overlap_frames: contour.shape[0] - margin] = fade_in[::-1]
+        # an unvoiced frame next to a voiced estimate of the same frame is a chunk edge artefact
+        chunk_weight[contour <= 0] *= 1e-3
+        f0[begin_frame: begin_frame + contour.shape[0]] += contour * chunk_weight
+        weight[begin_frame: begin_frame + contour.shape[0]] += chunk_weight
+    return np.where(weight > 0, f0 / np.maximum(weight, 1e-12), 0.).astype(np.float32)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from scheduler import CoreBudgetExecutor, available_cores
+
+AUDIO_SUFFIXES = (".wav", ".flac", ".ogg", ".mp3")
+INDEX_NAME = "index.json"
+
+# per process state of so_vits_features, the content model is loaded once per worker
+_models = {}
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def so_vits_features(path: Path, config_path: Path, f0_method: str = "dio") -> dict:
+    """
+    the training features of one slice, resampled to the sample rate of the config
+    :return: {"f0": (frames,), "uv": (frames,), "content": (frames, channels)}, frames of the hop of the config
+    """
+    import librosa
+    import torch
+    from so_vits_svc_fork import utils
+    from so_vits_svc_fork.f0 import compute_f0, interpolate_f0
+
+    if "hps" not in _models:
+        _models["hps"] = utils.get_hparams(str(config_path))
+        _models["hubert"] = utils.get_hubert_model("cpu")
+    hps = _models["hps"]
+    sr, hop = hps.data.sampling_rate, hps.data.hop_length
+    audio, _ = librosa.load(str(path), sr=sr)
+    f0, uv = interpolate_f0(compute_f0(audio, sampling_rate=sr, hop_length=hop, method=f0_method))
+    with torch.no_grad():
+        content = utils.get_content(_models["hubert"], audio, "cpu", sr,
+                                    hps.data.__dict__.get("contentvec_final_proj", True))
+    content = utils.repeat_expand_2d(content.squeeze(0), f0.shape[0])
+    return {"f0": f0.astype(np.float32), "uv": uv.astype(np.float32),
+            "content": content.T.contiguous().float().numpy()}
+
+
+def split_files(path: Path) -> list:
+    """
+    :param path: a directory of slices, or a file list as written by so-vits preprocess_config, one path per line
+    :return: the audio files of the split, sorted, none when path does not exist
+    """
+    path = Path(path)
+    if path.is_dir():
+        return sorted(i for i in path.rglob("*") if i.suffix.lower() in AUDIO_SUFFIXES and i.is_file())
+    if not path.is_file():
+        return []
+    listed = [Path(i.strip()) for i in path.read_text(encoding="utf-8").splitlines() if i.strip()]
+    return sorted(i for i in listed if i.suffix.lower() in AUDIO_SUFFIXES and i.is_file())
+
+
+def _build_shard(prefix: str, paths: list, feature_fn) -> dict:
+    """
+    compute the features of paths and write them as one shard, every feature to its own .npy file with the arrays of
+    every path concatenated along the first axis
+    :return: path -> {feature name: [start, end]}
+    """
+    arrays, offsets = {}, {}
+    for path in paths:
+        offsets[path] = {}
+        for name, value in feature_fn(Path(path)).items():
+            value = np.asarray(value)
+            arrays.setdefault(name, [])
+            start = sum(i.shape[0] for i in arrays[name])
+            arrays[name].append(value)
+            offsets[path][name] = [start, start + value.shape[0]]
+    for name, values in arrays.items():
+        tmp = f"{prefix}.{name}.npy.part"
+        with open(tmp, "wb") as f:
+            np.save(f, np.concatenate(values, axis=0))
+        os.replace(tmp, f"{prefix}.{name}.npy")
+    return offsets
+
+
+class FeatureIndex:
+    """
+    the features written by preprocess_dataset. features are kept in shards of .npy files opened memory-mapped, so
+    reading a slice only touches its part of the shard.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        index = json.loads(self.root.joinpath(INDEX_NAME).read_text(encoding="utf-8"))
+        self.features = index["features"]
+        self.files = index["files"]
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def entries(self, split: str = None) -> list:
+        """
+        :return: {"path", "split", "hash"} of every file, only those of split if given
+        """
+        return [i for i in self.files if split is None or i["split"] == split]
+
+    def _shard(self, shard: str, name: str) -> np.ndarray:
+        if (shard, name) not in self._shards:
+            self._shards[(shard, name)] = np.load(self.root.joinpath(f"{shard}.{name}.npy"), mmap_mode="r")
+        return self._shards[(shard, name)]
+
+    def get(self, entry) -> dict:
+        """
+        :param entry: an entry of entries, its hash, or the position of the file in the index
+        :return: feature name -> read only memory-mapped array
+        """
+        digest = self.files[entry]["hash"] if isinstance(entry, int) else entry.get("hash") \
+            if isinstance(entry, dict) else entry
+        record = self.features[digest]
+        return {name: self._shard(record["shard"], name)[start:end] for name, (start, end) in record["offsets"].items()}
+
+
+def preprocess_dataset(
+        splits: dict,
+        output_path: Path = None,
+        feature_fn=None,
+        config_path: Path = None,
+        workers: int = None,
+        shard_size: int = 64,
+) -> FeatureIndex:
+    """
+    compute the training features of every slice of a dataset in a process pool, into sharded memory-mappable files.
+    the features are kept by content hash, so running it again after slices were added only computes the new ones,
+    slices that were removed are dropped from the index and shards nobody uses any more are deleted.
+    :param splits: split name -> directory of slices or file list of split_files, e.g. the train, val and test file
+        lists of functions.generate_config
+    :param output_path: the directory of the shards and the index, default is features next to the first split
+    :param feature_fn: feature_fn(path) -> {name: array}, arrays of one name have the same shape except the first axis,
+        must be picklable, default is so_vits_features with config_path
+    :param config_path: the so-vits config of the dataset, needed by the default feature_fn
+    :param workers: the number of worker processes, each gets its share of the cores, default is one per core
+    :param shard_size: the number of slices per shard
+    :return: the index of the features
+    """
+    splits = {name: Path(path) for name, path in splits.items() if path is not None}
+    if not splits:
+        raise ValueError("no split to preprocess")
+    if feature_fn is None:
+        if config_path is None:
+            raise ValueError("config_path is needed by the default feature_fn")
+        feature_fn = partial(so_vits_features, config_path=str(config_path))
+    output_path = next(iter(splits.values())).parent.joinpath("features") if output_path is None else Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    index_path = output_path.joinpath(INDEX_NAME)
+    index = json.loads(index_path.read_text(encoding="utf-8")) if index_path.exists() else {"features": {}, "files": []}
+
+    files, todo = [], {}
+    for split, source in splits.items():
+        for path in split_files(source):
+            digest = file_hash(path)
+            files.append({"path": str(path.resolve()), "split": split, "hash": digest})
+            if digest not in index["features"] and digest not in todo:
+                todo[digest] = str(path.resolve())
+
+    if todo:
+        used = [int(i["shard"].rsplit("_", 1)[1]) for i in index["features"].values()]
+        first = max(used, default=-1) + 1
+        batches = list(todo.items())
+        batches = [batches[i:i + max(1, shard_size)] for i in range(0, len(batches), max(1, shard_size))]
+        workers = min(len(batches), workers or len(available_cores()))
+        with CoreBudgetExecutor(workers=workers) as executor:
+            futures = []
+            for number, batch in enumerate(batches, first):
+                shard = f"shard_{number:05d}"
+                futures.append((shard, batch, executor.submit(
+                    _build_shard, str(output_path.joinpath(shard)), [path for _, path in batch], feature_fn)))
+            for shard, batch, future in futures:
+                offsets = future.result()
+                for digest, path in batch:
+                    index["features"][digest] = {"shard": shard, "offsets": offsets[path]}
+
+    hashes = {i["hash"] for i in files}
+    index["features"] = {key: value for key, value in index["features"].items() if key in hashes}
+    index["files"] = files
+    shards = {i["shard"] for i in index["features"].values()}
+    for path in output_path.glob("shard_*.npy"):
+        if path.name.split(".", 1)[0] not in shards:
+            path.unlink()
+
+    fd, tmp = tempfile.mkstemp(dir=output_path, prefix="." + INDEX_NAME)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return FeatureIndex(output_path)
@@ -0,0 +1,207 @@
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ("torch", "int8")
+
+
+def snr(reference: np.ndarray, estimate: np.ndarray) -> float:
+    """
+    :return: signal to noise ratio of estimate against reference in dB
+    """
+    reference = np.asarray(reference, dtype=np.float64).reshape(-1)
+    estimate = np.asarray(estimate, dtype=np.float64).reshape(-1)[: reference.shape[0]]
+    noise = np.sum((reference[: estimate.shape[0]] - estimate) ** 2)
+    if noise == 0:
+        return float("inf")
+    return float(10 * np.log10(np.sum(reference ** 2) / noise))
+
+
+def quantized_cache_path(source_path: Path) -> Path:
+    return Path(source_path).with_name(Path(source_path).name + ".int8.pt")
+
+
+def quantize_module(module):
+    """
+    torch dynamic int8 quantization of the linear and recurrent layers, the convolutions stay fp32
+    :return: the quantized copy of the module, for cpu inference
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(
+        module.cpu().eval(), {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8)
+
+
+def cached_quantized(module, source_path, cache_path: Path = None):
+    """
+    the quantized module stored next to the model it comes from, quantized again when the model is newer
+    :param module: the loaded fp32 module
+    :param source_path: the model file the module is loaded from, or the list of them, the cache is stale once any
+        of them is newer. the cache is always used when none of them exists
+    :param cache_path: where to store the quantized module, default is <first model file>.int8.pt
+    """
+    import torch
+    sources = [Path(i) for i in source_path] if isinstance(source_path, (list, tuple)) else [Path(source_path)]
+    cache_path = quantized_cache_path(sources[0]) if cache_path is None else Path(cache_path)
+    newest = max((i.stat().st_mtime_ns for i in sources if i.exists()), default=None)
+    if cache_path.exists() and (newest is None or cache_path.stat().st_mtime_ns >= newest):
+        try:
+            return torch.load(cache_path, map_location="cpu", weights_only=False)
+        except Exception as e:
+            print(f"cannot load {cache_path} ({e}), quantizing again")
+    quantized = quantize_module(module)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name("." + cache_path.name)
+    torch.save(quantized, tmp)
+    tmp.replace(cache_path)
+    return quantized
+
+
+def model_name(repo: Path) -> str:
+    """
+    the name demucs knows the model of a local model folder by, the one of its .yaml file for a bag of models like
+    hdemucs_mmi, the signature of its .th file for a single model
+    :param repo: the local model folder
+    """
+    repo = Path(repo)
+    names = sorted(i.stem for i in repo.glob("*.yaml"))
+    if not names:
+        names = sorted({i.stem.split("-")[0] for i in repo.glob("*.th")})
+    if len(names) != 1:
+        raise ValueError(f"{repo} must hold exactly one demucs model, found {', '.join(names) or 'none'}")
+    return names[0]
+
+
+def load_demucs(repo: Path, name: str = None, backend: str = "torch"):
+    """
+    :param repo: the local model folder
+    :param name: the name of the model in the folder, default is model_name(repo)
+    :param backend: torch for the fp32 model, int8 for the quantized one cached in the model folder
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    from demucs.pretrained import get_model
+    name = model_name(repo) if name is None else name
+    model = get_model(name=name, repo=Path(repo))
+    if backend == "int8":
+        # a bag of models is its .yaml and the .th files it lists, a single model is its .th file
+        sources = [Path(repo).joinpath(f"{name}.yaml"), *Path(repo).glob("*.th")]
+        model = cached_quantized(model, sources, Path(repo).joinpath(f"{name}.int8.pt"))
+    return model.eval()
+
+
+def separate_in_process(
+        track_path: Path,
+        output_path: Path,
+        repo: Path,
+        backend: str = "int8",
+        split_mode: str = "segment",
+        split_num: float = 5,
+        clip_mode: str = "clamp",
+        shifts: int = 1,
+        jobs: int = 0,
+        wav_store_method: str = "float32",
+        extension: str = "wav",
+        model=None,
+        writer=None,
+        audio: np.ndarray = None,
+        samplerate: int = 44100
+) -> dict[str, Path]:
+    """
+    functions.separate_vocal without the demucs command line, so the model can be the quantized one. the outputs
+    are written where the command line writes them, under the model_name of repo.
+    :param model: an already loaded model, loaded from repo with backend if None
+    :param writer: the writer.AsyncWriter encoding the stems to any extension it supports, futures of the paths are
+        then returned, default is writing them with demucs before returning
+    :param audio: the already decoded track, (samples, channels) or (samples,), e.g. ingest.decode_audio(track_path),
+        track_path is then only used for naming the outputs
+    :param samplerate: the sample rate of audio, resampled to the one of the model
+    the other parameters are the same as functions.separate_vocal
+    """
+    return separate_many([track_path], output_path, repo, backend=backend, split_mode=split_mode, split_num=split_num,
+                         clip_mode=clip_mode, shifts=shifts, jobs=jobs, wav_store_method=wav_store_method,
+                         extension=extension, model=model, writer=writer,
+                         audios=None if audio is None else [audio], samplerate=samplerate)[0]
+
+
+def separate_many(
+        track_paths: list,
+        output_path: Path,
+        repo: Path,
+        backend: str = "int8",
+        split_mode: str = "segment",
+        split_num: float = 5,
+        clip_mode: str = "clamp",
+        shifts: int = 1,
+        jobs: int = 0,
+        wav_store_method: str = "float32",
+        extension: str = "wav",
+        model=None,
+        writer=None,
+        audios: list = None,
+        samplerate: int = 44100
+) -> list[dict[str, Path]]:
+    """
+    separate_in_process for several tracks with one apply_model call. the normalized tracks are padded with silence
+    to the longest one and stacked, so every segment position of all tracks is separated in one forward pass
+    :param track_paths: the tracks, best of similar length, the padding of shorter ones is separated too
+    :param audios: the already decoded tracks in the order of track_paths, the files are then not read
+    the other parameters are the same as separate_in_process
+    :return: the stems of every track, in the order of track_paths
+    """
+    import torch
+    from demucs.apply import apply_model
+    from demucs.audio import convert_audio
+    from demucs.separate import load_track
+
+    model = load_demucs(repo, backend=backend) if model is None else model
+    if audios is None:
+        wavs = [load_track(Path(i), model.audio_channels, model.samplerate) for i in track_paths]
+    else:
+        wavs = [convert_audio(torch.from_numpy(np.asarray(i, dtype=np.float32).reshape(len(i), -1).T.copy()),
+                              samplerate, model.samplerate, model.audio_channels) for i in audios]
+    refs = [i.mean(0) for i in wavs]
+    length = max(i.shape[-1] for i in wavs)
+    mix = torch.stack([torch.nn.functional.pad((wav - ref.mean()) / ref.std(), (0, length - wav.shape[-1]))
+                       for wav, ref in zip(wavs, refs)])
+    with torch.no_grad():
+        sources = apply_model(model, mix, device="cpu", shifts=max(1, int(shifts)),
+                              split=split_mode == "segment", overlap=0.25, num_workers=max(0, jobs),
+                              segment=split_num if split_mode == "segment" else None)
+    return [_save_stems(track_sources[..., : wav.shape[-1]] * ref.std() + ref.mean(), model, track_path, output_path,
+                        repo, clip_mode, wav_store_method, extension, writer)
+            for track_path, wav, ref, track_sources in zip(track_paths, wavs, refs, sources)]
+
+
+def _save_stems(sources, model, track_path: Path, output_path: Path, repo: Path, clip_mode: str,
+                wav_store_method: str, extension: str, writer) -> dict[str, Path]:
+    """
+    write the vocals and the sum of the other sources of one track
+    :param sources: (sources, channels, samples) of the track
+    """
+    from demucs.audio import save_audio
+    from writer import encode
+
+    vocal_index = model.sources.index("vocals")
+    stems = {"vocals": sources[vocal_index],
+             "no_vocals": sum(source for i, source in enumerate(sources) if i != vocal_index)}
+
+    directory = Path(output_path).joinpath(model_name(repo)).joinpath(Path(track_path).stem)
+    directory.mkdir(parents=True, exist_ok=True)
+    extension = extension.strip(".")
+    paths = {}
+    for stem, audio in stems.items():
+        path = directory.joinpath(f"{stem}.{extension}")
+        if writer is None and extension in ("wav", "mp3", "flac"):
+            save_audio(audio, str(path), model.samplerate, clip=clip_mode, as_float=wav_store_method == "float32")
+            paths[stem] = path
+        else:
+            if clip_mode == "rescale":
+                audio = audio / max(1.01 * audio.abs().max().item(), 1)
+            else:
+                audio = audio.clamp(-0.99, 0.99)
+            if writer is None:
+                # m4a, ogg, aac and the other extensions demucs cannot write
+                paths[stem] = encode(path, audio.t().contiguous().numpy(), model.samplerate)
+            else:
+                paths[stem] = writer.submit(path, audio.t().contiguous().numpy(), model.samplerate)
+    return {"vocal": paths["vocals"], "instrumental": paths["no_vocals"]}
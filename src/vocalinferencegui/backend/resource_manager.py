@@ -1,6 +1,6 @@
 import tqdm
 from environment import demucs_model_path, so_vits_model_path, config, sources
-from utilities import update_download_path, get_cow_transfer_file, get_hugging_face_file
+from utilities import update_download_path, get_cow_transfer_file, get_hugging_face_file, sources_store
 from classes import AttributeDict
 from pathlib import Path
 import requests
@@ -18,15 +18,17 @@ def get_data_from_source(engine_name: str, file_type: str, file_name: str, updat
 	except KeyError as e:
 		raise e
 
-	match engine_name:
-		case "demucs":
-			for i in model_download_data_dict["link"]:
-				download_result.update(get_demucs_model(model_name=file_name, link=i, download_path=demucs_model_path, update_cache=update_cache, auth=model_download_data_dict["auth"]))
-		case "so-vits":
-			for i in model_download_data_dict["link"]:
-				download_result.update(get_so_vits_model(model_name=file_name, link=i, download_path=so_vits_model_path, update_cache=update_cache, auth=model_download_data_dict["auth"]))
-		case _:
-			print(f"engine {engine_name} not supported, skipping")
+	# sources.json is written once for all the files of the model
+	with sources_store.transaction():
+		match engine_name:
+			case "demucs":
+				for i in model_download_data_dict["link"]:
+					download_result.update(get_demucs_model(model_name=file_name, link=i, download_path=demucs_model_path, update_cache=update_cache, auth=model_download_data_dict["auth"]))
+			case "so-vits":
+				for i in model_download_data_dict["link"]:
+					download_result.update(get_so_vits_model(model_name=file_name, link=i, download_path=so_vits_model_path, update_cache=update_cache, auth=model_download_data_dict["auth"]))
+			case _:
+				print(f"engine {engine_name} not supported, skipping")
 	return download_result
 
 
@@ -103,9 +105,10 @@ def get_all_models(update_cache=False):
 	download all models from sources.json
 	"""
 	ans = {}
-	for i in sources:
-		for j in sources[i]["models"]:
-			ans.update(get_data_from_source(i, "model", j, update_cache=update_cache))
+	with sources_store.transaction():
+		for i in sources:
+			for j in sources[i]["models"]:
+				ans.update(get_data_from_source(i, "model", j, update_cache=update_cache))
 	return ans
 
 
@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS")
+
+# the cores of a CoreBudgetExecutor worker, in the environment it is started with
+BUDGET_VARIABLE = "VOCAL_CORE_BUDGET"
+
+# the cores given to this process by CoreBudgetExecutor, None outside of its workers
+_budget = None
+# the environment is shared by the threads starting workers
+_environ_lock = threading.Lock()
+# the torch intra-op pool size set by job_threads, and how many of its blocks are running
+_job_threads = {"count": 0, "previous": None}
+_job_threads_lock = threading.Lock()
+
+
+def available_cores() -> list:
+    """
+    :return: the cores this process may run on
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores: list, workers: int) -> list:
+    """
+    :param cores: the cores to share
+    :param workers: the number of workers sharing them
+    :return: one list of cores per worker, as even as possible, every worker gets at least one core
+    """
+    workers = max(1, workers)
+    if workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    budgets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        budgets.append(cores[start:end])
+        start = end
+    return budgets
+
+
+def thread_env(threads: int) -> dict:
+    """
+    :return: the environment variables limiting the OpenMP, MKL and BLAS thread pools to threads
+    """
+    return {i: str(max(1, threads)) for i in THREAD_VARIABLES}
+
+
+def current_budget() -> int:
+    """
+    :return: the number of threads a job in this process should use, the core budget inside a CoreBudgetExecutor
+        worker, OMP_NUM_THREADS when it is set, the number of available cores otherwise
+    """
+    if _budget is not None:
+        return len(_budget)
+    if os.environ.get("OMP_NUM_THREADS", "").isdigit():
+        return max(1, int(os.environ["OMP_NUM_THREADS"]))
+    return len(available_cores())
+
+
+def limit_threads(threads: int, cores: list = None):
+    """
+    limit the thread pools of this process, to be called before torch or numpy are first used
+    :param threads: the number of intra-op threads
+    :param cores: pin the process to these cores, not pinned if None
+    """
+    os.environ.update(thread_env(threads))
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, threads))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # only possible before the first parallel work of the process
+        pass
+
+
+@contextmanager
+def job_threads(jobs: int):
+    """
+    size the torch intra-op pool of this process for jobs parallel jobs, so jobs x threads stays within the core
+    budget: every job runs single threaded when jobs > 0, one job gets the whole budget when jobs is 0. blocks of
+    concurrent threads share the setting, the previous size is restored when the last one exits.
+    :param jobs: the number of parallel jobs, e.g. the demucs --jobs
+    """
+    try:
+        import torch
+    except ImportError:
+        yield
+        return
+    with _job_threads_lock:
+        if _job_threads["count"] == 0:
+            _job_threads["previous"] = torch.get_num_threads()
+            torch.set_num_threads(1 if jobs > 0 else current_budget())
+        _job_threads["count"] += 1
+    try:
+        yield
+    finally:
+        with _job_threads_lock:
+            _job_threads["count"] -= 1
+            if _job_threads["count"] == 0:
+                torch.set_num_threads(_job_threads["previous"])
+
+
+class _BudgetProcess(SpawnProcess):
+    """
+    a spawned worker started with the thread variables of its budget in its environment, so the OpenMP/MKL/BLAS pools
+    are sized before anything imported by the main module of the parent loads them
+    """
+    budget = None
+
+    def start(self):
+        variables = {**thread_env(len(self.budget)), BUDGET_VARIABLE: ",".join(str(i) for i in self.budget)}
+        with _environ_lock:
+            previous = {i: os.environ.get(i) for i in variables}
+            os.environ.update(variables)
+            try:
+                super().start()
+            finally:
+                for key, value in previous.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+
+
+class _BudgetContext(SpawnContext):
+    """
+    the spawn context of CoreBudgetExecutor, it hands the budgets out to the workers in turn
+    """
+
+    def __init__(self, budgets: list):
+        self._budgets = budgets
+        self._started = 0
+
+    def Process(self, *args, **kwargs):
+        process = _BudgetProcess(*args, **kwargs)
+        process.budget = self._budgets[self._started % len(self._budgets)]
+        self._started += 1
+        return process
+
+
+def _initialize_worker(pin: bool):
+    global _budget
+    _budget = [int(i) for i in os.environ[BUDGET_VARIABLE].split(",")]
+    limit_threads(len(_budget), _budget if pin else None)
+
+
+class CoreBudgetExecutor:
+    """
+    a process pool whose workers share the cores instead of all using every core. every worker gets its own slice of
+    the cores, its OpenMP/MKL/BLAS thread variables are set in the environment it is started with and its torch thread
+    pool is sized to the slice, and it is pinned to the slice when pin is set, so concurrent separations and
+    conversions do not oversubscribe the cpu.
+    """
+
+    def __init__(self, workers: int = 2, cores: list = None, pin: bool = False):
+        """
+        :param workers: the number of jobs running at the same time, default is 2
+        :param cores: the cores to share, default is every core this process may run on
+        :param pin: whether to pin every worker to its cores, default is False
+        """
+        self.cores = available_cores() if cores is None else list(cores)
+        self.budgets = split_cores(self.cores, workers)
+        self._executor = ProcessPoolExecutor(max_workers=len(self.budgets), mp_context=_BudgetContext(self.budgets),
+                                             initializer=_initialize_worker, initargs=(pin,))
+
+    @property
+    def workers(self) -> int:
+        return len(self.budgets)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables, timeout=None):
+        return self._executor.map(fn, *iterables, timeout=timeout)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from classes import AttributeDict
+
+
+class SourcesStore:
+    """
+    sources.json with buffered updates. updates made inside a transaction are kept in memory and written once when the
+    outermost transaction ends, updates outside of any transaction are written right away. the file is replaced
+    atomically, so a crash never leaves a half written sources.json behind.
+
+    updates are safe to make from several threads, e.g. download workers running inside a transaction of the caller.
+    """
+
+    def __init__(self, path: Path, sources: AttributeDict = None):
+        """
+        :param path: the path of sources.json
+        :param sources: the already loaded sources, updated in place, loaded from path if None
+        """
+        self.path = Path(path)
+        self.sources = sources if sources is not None else AttributeDict(json.load(open(self.path, "r")))
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._dirty = False
+
+    @contextmanager
+    def transaction(self):
+        """
+        buffer every update until the outermost transaction ends, the buffered updates are written even if the block
+        raises
+        """
+        with self._lock:
+            self._depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0 and self._dirty:
+                    self._write()
+
+    def changed(self):
+        """
+        mark the sources as changed after modifying them directly
+        """
+        with self._lock:
+            self._dirty = True
+            if self._depth == 0:
+                self._write()
+
+    def set_local(self, engine_name: str, file_type: str, model_name: str, data: dict):
+        """
+        record downloaded files of a model
+        :param data: file name -> local path
+        """
+        with self._lock:
+            model = self.sources[engine_name][file_type][model_name]
+            if not isinstance(model.get("local"), dict):
+                model["local"] = {}
+            model["local"].update({key: str(value) for key, value in data.items()})
+            self.changed()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._write()
+
+    def _write(self):
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.sources, f, indent=4)
+            os.replace(tmp, self.path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self._dirty = False
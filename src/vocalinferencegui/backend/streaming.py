@@ -0,0 +1,169 @@
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(slots=True)
+class BlockStats:
+    samples: int
+    compute_seconds: float
+    realtime_factor: float
+    latency_seconds: float
+    over_budget: bool
+
+
+class StreamingConverter:
+    """
+    sliding window conversion of a live signal. every chunk_seconds of new input is converted together with
+    context_seconds of the input before it, the last crossfade_seconds of every converted chunk are held back and
+    cross-faded with the start of the next one, so the chunk edges do not click.
+
+    the delay between an input sample and its converted output is chunk_seconds + crossfade_seconds plus the time the
+    conversion of one window takes.
+    """
+
+    def __init__(self, converter, sr: int, chunk_seconds: float = 0.5, context_seconds: float = 1.,
+                 crossfade_seconds: float = 0.05, latency_budget: float = None):
+        """
+        :param converter: converter(window) -> converted window of the same length, window is a mono float32 array
+        :param sr: sample rate of the input and the output
+        :param chunk_seconds: new input converted per step, default is 0.5
+        :param context_seconds: past input given to the converter before the new input, default is 1
+        :param crossfade_seconds: length of the cross-fade between steps, at most context_seconds, default is 0.05
+        :param latency_budget: the allowed delay in seconds, blocks over it are marked in their stats, default is none
+        """
+        self.converter = converter
+        self.sr = sr
+        self.chunk = max(1, int(chunk_seconds * sr))
+        self.context = max(0, int(context_seconds * sr))
+        self.crossfade = min(int(crossfade_seconds * sr), self.context, self.chunk)
+        self.latency_budget = latency_budget
+        fade = 0.5 - 0.5 * np.cos(np.linspace(0, np.pi, self.crossfade + 2, dtype=np.float32)[1:-1])
+        self._fade_in, self._fade_out = fade, 1 - fade
+        self.stats = []
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(self.context, dtype=np.float32)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._held = None
+        self._received = 0
+        self._emitted = 0
+
+    @property
+    def latency_seconds(self) -> float:
+        """
+        the delay of the windowing alone, without the conversion time
+        """
+        return (self.chunk + self.crossfade) / self.sr
+
+    def _step(self, chunk: np.ndarray) -> np.ndarray:
+        window = np.concatenate([self._history, chunk])
+        start = time.perf_counter()
+        converted = np.asarray(self.converter(window), dtype=np.float32).reshape(-1)
+        compute = time.perf_counter() - start
+        if converted.shape[0] != window.shape[0]:
+            converted = np.pad(converted, (0, max(0, window.shape[0] - converted.shape[0])))[: window.shape[0]]
+        if self.context:
+            self._history = window[-self.context:]
+
+        # the window starts context samples before the chunk, the output of a step ends crossfade samples before the
+        # end of its chunk, the held back tail is faded into the next step
+        tail = window.shape[0] - self.crossfade
+        out = converted[self.context: tail]
+        if self._held is not None:
+            head = self._held * self._fade_out + converted[self.context - self.crossfade: self.context] * self._fade_in
+            out = np.concatenate([head, out])
+        self._held = converted[tail:]
+
+        latency = self.latency_seconds + compute
+        self.stats.append(BlockStats(
+            samples=chunk.shape[0],
+            compute_seconds=compute,
+            realtime_factor=compute / (chunk.shape[0] / self.sr),
+            latency_seconds=latency,
+            over_budget=self.latency_budget is not None and latency > self.latency_budget,
+        ))
+        return out
+
+    def process(self, block: np.ndarray) -> list:
+        """
+        :param block: new input samples, any length
+        :return: the converted blocks that are ready, chunk samples each, the first one crossfade samples shorter
+        """
+        block = np.asarray(block, dtype=np.float32).reshape(-1)
+        self._received += block.shape[0]
+        self._pending = np.concatenate([self._pending, block])
+        ready = []
+        while self._pending.shape[0] >= self.chunk:
+            chunk, self._pending = self._pending[: self.chunk], self._pending[self.chunk:]
+            out = self._step(chunk)
+            self._emitted += out.shape[0]
+            if out.shape[0]:
+                ready.append(out)
+        return ready
+
+    def flush(self) -> np.ndarray:
+        """
+        convert what is left of the input once the stream ends
+        :return: the rest of the output, the whole output is then as long as the whole input
+        """
+        out = []
+        if self._pending.shape[0]:
+            out.append(self._step(np.pad(self._pending, (0, self.chunk - self._pending.shape[0]))))
+        if self._held is not None:
+            out.append(self._held)
+        rest = np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+        rest = rest[: max(0, self._received - self._emitted)]
+        self._emitted += rest.shape[0]
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._held = None
+        return rest
+
+    def convert(self, blocks):
+        """
+        :param blocks: iterable of input blocks, e.g. reads of a file, a socket or a live input
+        :return: generator of converted blocks, chunk samples each, the last one shorter
+        """
+        for block in blocks:
+            yield from self.process(block)
+        rest = self.flush()
+        if rest.shape[0]:
+            yield rest
+
+
+def svc_converter(engine, speaker, transpose: int = 0, auto_predict_f0: bool = False, cluster_infer_ratio: float = 0,
+                  noise_scale: float = 0.4, f0_method: str = "dio"):
+    """
+    :param engine: a loaded svc_engine.SvcEngine, kept warm for the whole stream, better created without a feature cache
+        since every window is new audio
+    :return: a converter for StreamingConverter at engine.target_sample
+    """
+    def convert(window: np.ndarray) -> np.ndarray:
+        try:
+            return engine.infer_speakers([speaker], transpose, window, cluster_infer_ratio=cluster_infer_ratio,
+                                         auto_predict_f0=auto_predict_f0, noise_scale=noise_scale,
+                                         f0_method=f0_method)[0]
+        finally:
+            engine.clear_features()
+
+    return convert
+
+
+def stream_so_vits(blocks, model_path, config_file_path, speaker, chunk_seconds: float = 0.5,
+                   context_seconds: float = 1., crossfade_seconds: float = 0.05, transpose: int = 0,
+                   f0_method: str = "dio", noise_scale: float = 0.4, cluster=None, cluster_infer_ratio: float = 0,
+                   auto_predict_f0: bool = False, device: str = "cpu", latency_budget: float = None):
+    """
+    convert a stream of mono blocks at the sample rate of the model with so-vits-svc
+    :param blocks: iterable of input blocks
+    :return: (the StreamingConverter, whose stats fill up while converting, generator of converted blocks)
+    """
+    from svc_engine import SvcEngine
+    engine = SvcEngine(net_g_path=str(model_path), config_path=str(config_file_path), device=device,
+                       cluster_model_path=None if cluster is None else str(cluster))
+    converter = StreamingConverter(
+        svc_converter(engine, speaker, transpose, auto_predict_f0, cluster_infer_ratio, noise_scale, f0_method),
+        engine.target_sample, chunk_seconds, context_seconds, crossfade_seconds, latency_budget)
+    return converter, converter.convert(blocks)
@@ -0,0 +1,365 @@
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+import so_vits_svc_fork.f0
+from so_vits_svc_fork import cluster, utils
+from so_vits_svc_fork.inference.core import Svc, split_silence
+
+from feature_cache import FeatureCache
+from parallel_f0 import compute_f0, compute_f0_parallel
+from quantized import BACKENDS, cached_quantized
+from Slicer import voiced_ranges
+
+
+CONTENT_MODEL = "lengyue233/content-vec-best"
+
+
+def content_cache_path(final_proj: bool = True) -> Path:
+    """
+    the quantized content model is the same for every speaker model, it is cached once in the cache folder, keyed on
+    the content model so_vits_svc_fork.utils.get_hubert_model loads and on whether it has the final projection
+    """
+    from environment import cache_path
+    name = CONTENT_MODEL.split("/")[-1] + ("" if final_proj else "-no-final-proj")
+    return cache_path.joinpath("quantized").joinpath(f"{name}.int8.pt")
+
+
+class SvcEngine(Svc):
+    """
+    so-vits-svc model that keeps the speaker independent features (f0, voiced mask and content) of every chunk it
+    converted, so rendering one vocal in many voices extracts them once and converts all voices in one forward pass
+    """
+
+    def __init__(self, feature_cache=None, f0_workers: int = 1, backend: str = "torch", **kwargs):
+        """
+        :param feature_cache: a feature_cache.FeatureCache, features found there skip extraction entirely
+        :param f0_workers: the number of processes extracting f0, the chunks of a vocal are extracted at the same time
+            and a vocal of a single chunk is split at its silences, 1 extracts in this process
+        :param backend: torch for the fp32 models, int8 runs dynamically quantized content and synthesis models on cpu,
+            the quantized synthesis model is cached next to net_g_path and the content model in the cache folder
+        the other parameters are passed to Svc
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        if backend == "int8":
+            kwargs["device"] = "cpu"
+        super().__init__(**kwargs)
+        self.backend = backend
+        if backend == "int8":
+            self.dtype = torch.float32
+            self.hubert_model = cached_quantized(self.hubert_model, [],
+                                                 content_cache_path(self.contentvec_final_proj))
+            self.net_g = cached_quantized(self.net_g, kwargs["net_g_path"])
+        self.features = {}
+        self.feature_cache = feature_cache
+        self.f0_workers = f0_workers
+        self._f0_executor = None
+        self._f0_pending = {}
+
+    def clear_features(self):
+        self.features.clear()
+        self._f0_pending.clear()
+
+    def close(self):
+        if self._f0_executor is not None:
+            self._f0_executor.shutdown()
+            self._f0_executor = None
+
+    def _executor(self):
+        if self._f0_executor is None:
+            self._f0_executor = ProcessPoolExecutor(max_workers=self.f0_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+        return self._f0_executor
+
+    def _feature_keys(self, audio: np.ndarray, f0_method: str):
+        """
+        :return: (key of self.features, key of the feature cache or None)
+        """
+        key = (hashlib.sha1(audio.tobytes()).hexdigest(), f0_method)
+        if self.feature_cache is None:
+            return key, None
+        return key, FeatureCache.key(audio, self.target_sample, f0_method, self.hop_size, self.contentvec_final_proj,
+                                     *(() if self.backend == "torch" else (self.backend,)))
+
+    def prefetch_f0(self, chunks: list, f0_method: str = "dio"):
+        """
+        start the f0 extraction of every chunk at once in the process pool, the chunks of one vocal are at most
+        max_chunk_seconds long, so extracting them one after the other would leave the pool mostly idle
+        :param chunks: the padded chunks that are converted next, at the target sample rate
+        :param f0_method: the method to predict the f0
+        """
+        if self.f0_workers <= 1 or len(chunks) <= 1:
+            return
+        for chunk in chunks:
+            chunk = chunk.astype(np.float32)
+            key, cache_key = self._feature_keys(chunk, f0_method)
+            if key in self.features or key in self._f0_pending or (cache_key is not None
+                                                                    and cache_key in self.feature_cache):
+                continue
+            self._f0_pending[key] = self._executor().submit(
+                compute_f0, chunk, None, self.target_sample, self.hop_size, f0_method)
+
+    def compute_f0(self, audio: np.ndarray, f0_method: str = "dio") -> np.ndarray:
+        pending = self._f0_pending.pop((hashlib.sha1(audio.tobytes()).hexdigest(), f0_method), None)
+        if pending is not None:
+            return np.asarray(pending.result())
+        if self.f0_workers <= 1:
+            return so_vits_svc_fork.f0.compute_f0(
+                audio,
+                sampling_rate=self.target_sample,
+                hop_length=self.hop_size,
+                method=f0_method,
+            )
+        return compute_f0_parallel(audio, self.target_sample, self.hop_size, f0_method, executor=self._executor())
+
+    def get_features(self, audio: np.ndarray, f0_method: str = "dio"):
+        """
+        f0 (before transposing), voiced mask and content of a chunk, computed once per chunk and f0 method
+        :param audio: the chunk at the target sample rate
+        :param f0_method: the method to predict the f0
+        :return: (f0, uv, c) as numpy arrays, c is (channels, frames)
+        """
+        key, cache_key = self._feature_keys(audio, f0_method)
+        if key not in self.features and self.feature_cache is not None:
+            cached = self.feature_cache.get(cache_key)
+            if cached is not None:
+                self.features[key] = tuple(np.array(cached[i]) for i in ("f0", "uv", "c"))
+        if key not in self.features:
+            f0, uv = so_vits_svc_fork.f0.interpolate_f0(self.compute_f0(audio, f0_method))
+            c = utils.get_content(
+                self.hubert_model,
+                audio,
+                self.device,
+                self.target_sample,
+                self.contentvec_final_proj,
+            ).to(self.dtype)
+            c = utils.repeat_expand_2d(c.squeeze(0), f0.shape[0])
+            self.features[key] = (f0, uv, c.cpu().numpy())
+            if self.feature_cache is not None:
+                self.feature_cache.put(cache_key, f0=f0, uv=uv, c=self.features[key][2])
+        return self.features[key]
+
+    def get_unit_f0(self, audio, tran, cluster_infer_ratio, speaker, f0_method="dio"):
+        f0, uv, c = self.get_features(audio, f0_method)
+        f0 = torch.as_tensor(f0, dtype=self.dtype, device=self.device) * 2 ** (tran / 12)
+        uv = torch.as_tensor(uv, dtype=self.dtype, device=self.device)
+        c = torch.as_tensor(c, dtype=self.dtype, device=self.device)
+        if cluster_infer_ratio != 0:
+            cluster_c = cluster.get_cluster_center_result(self.cluster_model, c.cpu().numpy().T, speaker).T
+            cluster_c = torch.FloatTensor(cluster_c).to(self.device)
+            c = cluster_infer_ratio * cluster_c + (1 - cluster_infer_ratio) * c
+        return c.unsqueeze(0), f0.unsqueeze(0), uv.unsqueeze(0)
+
+    def speaker_id(self, speaker) -> int:
+        if isinstance(speaker, int):
+            return speaker
+        if speaker not in self.spk2id.__dict__:
+            raise ValueError(f"Speaker {speaker} not found in the model config")
+        return self.spk2id.__dict__[speaker]
+
+    def infer_chunks(
+            self,
+            items: list,
+            transpose: int = 0,
+            cluster_infer_ratio: float = 0,
+            auto_predict_f0: bool = False,
+            noise_scale: float = 0.4,
+            f0_method: str = "dio",
+    ) -> list:
+        """
+        convert chunks of different vocals, each into several voices, with a single batched forward pass. the features
+        of shorter chunks are padded with silent unvoiced frames up to the longest chunk, the padded frames are cut off
+        the outputs
+        :param items: (chunk, speakers) per chunk
+        :return: per item, one converted chunk per speaker
+        """
+        units, sid, frames = [], [], []
+        for audio, speakers in items:
+            audio = audio.astype(np.float32)
+            for speaker in speakers:
+                units.append(self.get_unit_f0(audio, transpose, cluster_infer_ratio, speaker, f0_method))
+                sid.append([self.speaker_id(speaker)])
+                frames.append(units[-1][1].shape[-1])
+        longest = max(frames)
+        c, f0, uv = (torch.cat([torch.nn.functional.pad(unit, (0, longest - length)) for unit, length in zip(i, frames)],
+                               dim=0) for i in zip(*units))
+        with torch.no_grad():
+            converted = self.net_g.infer(
+                c,
+                f0=f0,
+                g=torch.LongTensor(sid).to(self.device),
+                uv=uv,
+                predict_f0=auto_predict_f0,
+                noice_scale=noise_scale,
+            )[:, 0].data.float()
+        outputs = [i[: length * self.hop_size].cpu().numpy() for i, length in zip(converted, frames)]
+        results, start = [], 0
+        for _, speakers in items:
+            results.append(outputs[start: start + len(speakers)])
+            start += len(speakers)
+        return results
+
+    def infer_speakers(
+            self,
+            speakers: list,
+            transpose: int,
+            audio: np.ndarray,
+            cluster_infer_ratio: float = 0,
+            auto_predict_f0: bool = False,
+            noise_scale: float = 0.4,
+            f0_method: str = "dio",
+    ) -> list:
+        """
+        convert one chunk into several voices with a single batched forward pass
+        :return: one converted chunk per speaker
+        """
+        return self.infer_chunks([(audio, speakers)], transpose, cluster_infer_ratio=cluster_infer_ratio,
+                                 auto_predict_f0=auto_predict_f0, noise_scale=noise_scale, f0_method=f0_method)[0]
+
+    def silence_chunks(self, audio: np.ndarray, db_thresh: int = -40, pad_seconds: float = 0.5,
+                       chunk_seconds: float = 0.5, absolute_thresh: bool = False, max_chunk_seconds: float = 40) -> list:
+        """
+        the chunks of Svc.infer_silence, split at the silences of audio
+        :return: (begin, length, padded chunk or None when the chunk is silent) per chunk
+        """
+        sr = self.target_sample
+        chunk_length_min = int(min(sr / so_vits_svc_fork.f0.f0_min * 20 + 1, chunk_seconds * sr)) // 2
+        pad = np.zeros([int(sr * pad_seconds)], dtype=np.float32)
+        chunks, begin = [], 0
+        for chunk in split_silence(
+                audio,
+                top_db=-db_thresh,
+                frame_length=chunk_length_min * 2,
+                hop_length=chunk_length_min,
+                ref=1 if absolute_thresh else np.max,
+                max_chunk_length=int(max_chunk_seconds * sr),
+        ):
+            padded = np.concatenate([pad, chunk.audio, pad]) if chunk.is_speech else None
+            chunks.append((begin, chunk.audio.shape[0], padded))
+            begin += chunk.audio.shape[0]
+        return chunks
+
+    def voiced_chunks(self, audio: np.ndarray, silence_db: float = -40, pad_seconds: float = 0.5,
+                      max_chunk_seconds: float = 40) -> list:
+        """
+        the voiced ranges found by Slicer.voiced_ranges, split in chunks of max_chunk_seconds
+        :return: (begin, length, padded chunk) per chunk
+        """
+        sr = self.target_sample
+        pad = np.zeros([int(sr * pad_seconds)], dtype=np.float32)
+        max_chunk_length = max(1, int(max_chunk_seconds * sr))
+        chunks = []
+        for begin, end in voiced_ranges(audio, sr, threshold=silence_db, pad=pad_seconds * 1000):
+            for chunk_begin in range(begin, end, max_chunk_length):
+                chunk = audio[chunk_begin: min(end, chunk_begin + max_chunk_length)]
+                chunks.append((chunk_begin, chunk.shape[0], np.concatenate([pad, chunk, pad])))
+        return chunks
+
+    def infer_batch(
+            self,
+            audios: list,
+            speakers: list,
+            *,
+            skip_silence: bool = False,
+            transpose: int = 0,
+            auto_predict_f0: bool = False,
+            cluster_infer_ratio: float = 0,
+            noise_scale: float = 0.4,
+            f0_method: str = "dio",
+            db_thresh: int = -40,
+            silence_db: float = -40,
+            pad_seconds: float = 0.5,
+            chunk_seconds: float = 0.5,
+            absolute_thresh: bool = False,
+            max_chunk_seconds: float = 40,
+            max_batch: int = 8,
+    ) -> list:
+        """
+        convert several vocals at once. every vocal is split as by infer_silence_speakers, or infer_voiced_speakers
+        with skip_silence, then the chunks of all vocals are sorted by length and converted max_batch at a time, so
+        chunks of different vocals share forward passes and little of them is spent on padding
+        :param audios: the vocals at the target sample rate
+        :param speakers: the speakers of every vocal
+        :param max_batch: the number of chunks converted in one forward pass
+        :return: speaker -> converted audio, the same length as its vocal, for every vocal
+        """
+        plans = [self.voiced_chunks(audio, silence_db, pad_seconds, max_chunk_seconds) if skip_silence else
+                 self.silence_chunks(audio, db_thresh, pad_seconds, chunk_seconds, absolute_thresh, max_chunk_seconds)
+                 for audio in audios]
+        work = sorted(((i, begin, length, padded) for i, plan in enumerate(plans)
+                       for begin, length, padded in plan if padded is not None), key=lambda i: i[3].shape[0])
+        self.prefetch_f0([i[3] for i in work], f0_method)
+        results = [{speaker: np.zeros(audio.shape[0], dtype=np.float32) for speaker in vocal_speakers}
+                   for audio, vocal_speakers in zip(audios, speakers)]
+        for start in range(0, len(work), max(1, max_batch)):
+            batch = work[start: start + max(1, max_batch)]
+            converted = self.infer_chunks(
+                [(padded, speakers[i]) for i, _, _, padded in batch],
+                transpose,
+                cluster_infer_ratio=cluster_infer_ratio,
+                auto_predict_f0=auto_predict_f0,
+                noise_scale=noise_scale,
+                f0_method=f0_method,
+            )
+            for (i, begin, length, _), outputs in zip(batch, converted):
+                for speaker, audio_chunk_pad_infer in zip(speakers[i], outputs):
+                    cut_len_2 = (len(audio_chunk_pad_infer) - length) // 2
+                    converted_chunk = audio_chunk_pad_infer[cut_len_2: cut_len_2 + length]
+                    converted_chunk = converted_chunk[: results[i][speaker].shape[0] - begin]
+                    results[i][speaker][begin: begin + converted_chunk.shape[0]] = converted_chunk
+        return results
+
+    def infer_silence_speakers(
+            self,
+            audio: np.ndarray,
+            *,
+            speakers: list,
+            transpose: int = 0,
+            auto_predict_f0: bool = False,
+            cluster_infer_ratio: float = 0,
+            noise_scale: float = 0.4,
+            f0_method: str = "dio",
+            db_thresh: int = -40,
+            pad_seconds: float = 0.5,
+            chunk_seconds: float = 0.5,
+            absolute_thresh: bool = False,
+            max_chunk_seconds: float = 40,
+    ) -> dict:
+        """
+        Svc.infer_silence for several speakers at once, the silence split and the features are shared by all of them
+        :return: speaker -> converted audio
+        """
+        return self.infer_batch([audio], [speakers], transpose=transpose, auto_predict_f0=auto_predict_f0,
+                                cluster_infer_ratio=cluster_infer_ratio, noise_scale=noise_scale, f0_method=f0_method,
+                                db_thresh=db_thresh, pad_seconds=pad_seconds, chunk_seconds=chunk_seconds,
+                                absolute_thresh=absolute_thresh, max_chunk_seconds=max_chunk_seconds, max_batch=1)[0]
+
+    def infer_voiced_speakers(
+            self,
+            audio: np.ndarray,
+            *,
+            speakers: list,
+            transpose: int = 0,
+            auto_predict_f0: bool = False,
+            cluster_infer_ratio: float = 0,
+            noise_scale: float = 0.4,
+            f0_method: str = "dio",
+            silence_db: float = -40,
+            pad_seconds: float = 0.5,
+            max_chunk_seconds: float = 40,
+    ) -> dict:
+        """
+        convert only the voiced ranges found by Slicer.voiced_ranges, the rest of the output stays zero, so the
+        conversion time follows the amount of singing instead of the track length
+        :param silence_db: the dB threshold under which a frame is silent
+        :param pad_seconds: margin kept around every voiced range, also the zero padding given to the model
+        :return: speaker -> converted audio, the same length as audio
+        """
+        return self.infer_batch([audio], [speakers], skip_silence=True, transpose=transpose,
+                                auto_predict_f0=auto_predict_f0, cluster_infer_ratio=cluster_infer_ratio,
+                                noise_scale=noise_scale, f0_method=f0_method, silence_db=silence_db,
+                                pad_seconds=pad_seconds, max_chunk_seconds=max_chunk_seconds, max_batch=1)[0]
@@ -0,0 +1,238 @@
+import csv
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+
+from scheduler import available_cores
+
+# the apply_so_vits parameters that are fixed once the model is loaded
+ENGINE_PARAMS = ("model_path", "config_file_path", "cluster", "feature_cache", "f0_workers", "backend")
+
+
+def expand_grid(grid: dict) -> list:
+    """
+    :param grid: parameter name -> list of values, a single value is treated as a list of one
+    :return: one dict per combination, in the order of the grid
+    """
+    names = list(grid.keys())
+    values = [i if isinstance(i, (list, tuple)) else [i] for i in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+class TaskGraph:
+    """
+    a DAG of tasks keyed by their parameters, adding a task that already exists returns the existing one, so shared
+    upstream results are computed once
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, key, fn, dependencies=()):
+        """
+        :param key: hashable identity of the task
+        :param fn: called with the results of the dependencies, in order
+        :param dependencies: keys of the tasks this one needs
+        :return: key
+        """
+        if key not in self.tasks:
+            for dependency in dependencies:
+                if dependency not in self.tasks:
+                    raise KeyError(f"Task {dependency} not found")
+            self.tasks[key] = (fn, tuple(dependencies))
+        return key
+
+    def run(self, workers: int = None, raise_errors: bool = True) -> dict:
+        """
+        run every task once its dependencies are done, independent tasks run in parallel
+        :param workers: the number of worker threads, default is the number of cpu cores
+        :param raise_errors: whether the error of a task stops the run, otherwise the exception is the result of the
+            task and of every task depending on it, which are not run
+        :return: key -> (result, elapsed seconds)
+        """
+        results = {}
+        waiting = {key: set(dependencies) for key, (_, dependencies) in self.tasks.items()}
+        dependents = {key: [] for key in self.tasks}
+        for key, (_, dependencies) in self.tasks.items():
+            for dependency in dependencies:
+                dependents[dependency].append(key)
+
+        def timed(key):
+            fn, dependencies = self.tasks[key]
+            failed = [results[i][0] for i in dependencies if isinstance(results[i][0], Exception)]
+            if failed:
+                return failed[0], 0.
+            start = time.perf_counter()
+            try:
+                result = fn(*(results[i][0] for i in dependencies))
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"task {key} failed: {e}")
+                result = e
+            return result, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            running = {}
+            for key in [key for key, dependencies in waiting.items() if not dependencies]:
+                del waiting[key]
+                running[executor.submit(timed, key)] = key
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    results[key] = future.result()
+                    for dependent in dependents[key]:
+                        waiting[dependent].discard(key)
+                        if not waiting[dependent]:
+                            del waiting[dependent]
+                            running[executor.submit(timed, dependent)] = dependent
+        return results
+
+
+def _separate(track_path: Path, output_path: Path, jobs: int = None, **kwargs) -> dict:
+    from functions import separate_vocal
+    return separate_vocal(track_path, output_path, jobs=jobs, **kwargs)
+
+
+class EnginePool:
+    """
+    one loaded so-vits model per set of ENGINE_PARAMS, shared by the conversions of a sweep. a model converts one
+    vocal at a time, the conversions of other models run meanwhile.
+    """
+
+    def __init__(self):
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def get(self, **engine_params):
+        """
+        :return: (engine, lock to hold while converting with it)
+        """
+        key = tuple(sorted((name, str(value)) for name, value in engine_params.items()))
+        with self.lock:
+            if key not in self.engines:
+                self.engines[key] = (None, threading.Lock())
+            _, engine_lock = self.engines[key]
+        with engine_lock:
+            engine, _ = self.engines[key]
+            if engine is None:
+                from functions import load_so_vits_engine
+                engine = load_so_vits_engine(**engine_params)
+                self.engines[key] = (engine, engine_lock)
+        return engine, engine_lock
+
+    def close(self):
+        for engine, _ in self.engines.values():
+            if engine is not None:
+                engine.close()
+        self.engines.clear()
+
+
+def _convert(separated: dict, output_path: Path, engines: EnginePool, speaker: str, **kwargs) -> Path:
+    from functions import apply_so_vits_batch
+    engine_params = {name: kwargs[name] for name in ENGINE_PARAMS if name in kwargs}
+    engine, engine_lock = engines.get(**engine_params)
+    with engine_lock:
+        return apply_so_vits_batch([(separated["vocal"], speaker)], Path(output_path), engine=engine, **kwargs)[0]
+
+
+def run_sweep(
+        track_path: Path,
+        output_path: Path,
+        separate_grid: dict,
+        so_vits_grid: dict,
+        so_vits_args: dict,
+        workers: int = None,
+        separate_fn=None,
+        convert_fn=None
+) -> list:
+    """
+    run every combination of separate_vocal and apply_so_vits parameters, each separation is computed once and shared
+    by all the conversions that use it, and each so-vits model is loaded once for all the conversions with it. a
+    combination that fails is reported in its row instead of stopping the sweep.
+    :param track_path: the path of the track
+    :param output_path: the path of the output directory, every combination gets its own sub directory
+    :param separate_grid: separate_vocal parameter -> values, e.g. {"split_num": [5, 10], "clip_mode": ["rescale"],
+        "shifts": [1, 2]}
+    :param so_vits_grid: apply_so_vits parameter -> values, e.g. {"noice_scale": [0.2, 0.4], "f0_method": ["dio"],
+        "cluster_infer_ratio": [0, 0.5]}
+    :param so_vits_args: the fixed apply_so_vits arguments, model_path, config_file_path, speaker, ...
+    :param workers: the number of combinations run at the same time, default is the number of cpu cores
+    :param separate_fn: separate_fn(track_path, output_path, **params) -> {"vocal": path, ...}, default is
+        separate_vocal with the cores shared by the separations running at the same time, unless jobs is in the grid
+    :param convert_fn: convert_fn(separated, output_path, **params) -> path, default is apply_so_vits_batch with one
+        engine per model
+    :return: one row per combination with its parameters, output, separation/conversion seconds and error, output is
+        None and error the message when the combination failed
+    """
+    output_path = Path(output_path)
+    workers = workers or os.cpu_count()
+    if separate_fn is None:
+        separations = min(workers, len(expand_grid(separate_grid)))
+        separate_fn = partial(_separate, jobs=max(1, len(available_cores()) // max(1, separations)))
+    engines = None
+    if convert_fn is None:
+        engines = EnginePool()
+        convert_fn = partial(_convert, engines=engines)
+    graph = TaskGraph()
+    rows = []
+    for i, separate_params in enumerate(expand_grid(separate_grid)):
+        separate_key = ("separate", tuple(sorted(separate_params.items())))
+        separate_dir = output_path.joinpath(f"separate_{i}")
+        graph.add(separate_key, lambda p=separate_params, d=separate_dir: separate_fn(track_path, d, **p))
+        for j, so_vits_params in enumerate(expand_grid(so_vits_grid)):
+            convert_key = ("convert", separate_key, tuple(sorted(so_vits_params.items())))
+            convert_dir = separate_dir.joinpath(f"convert_{j}")
+            graph.add(convert_key,
+                      lambda separated, p=so_vits_params, d=convert_dir: convert_fn(separated, d,
+                                                                                   **{**so_vits_args, **p}),
+                      [separate_key])
+            rows.append((separate_key, convert_key, {**separate_params, **so_vits_params}))
+
+    try:
+        results = graph.run(workers, raise_errors=False)
+    finally:
+        if engines is not None:
+            engines.close()
+    return [{
+        **params,
+        "output": None if isinstance(results[convert_key][0], Exception) else results[convert_key][0],
+        "separate_seconds": round(results[separate_key][1], 3),
+        "convert_seconds": round(results[convert_key][1], 3),
+        "error": str(results[convert_key][0]) if isinstance(results[convert_key][0], Exception) else "",
+    } for separate_key, convert_key, params in rows]
+
+
+def format_table(rows: list) -> str:
+    """
+    :param rows: the rows returned by run_sweep
+    :return: the rows as an aligned plain text table
+    """
+    if not rows:
+        return ""
+    columns = list(rows[0].keys())
+    cells = [columns] + [[str(row[i]) for i in columns] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in cells]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def save_table(rows: list, path: Path) -> Path:
+    """
+    :param rows: the rows returned by run_sweep
+    :param path: the path of the csv file
+    :return: path
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
@@ -8,14 +8,19 @@ from py7zr import SevenZipFile
 from rarfile import RarFile
 from gzip import GzipFile
 from filetype import guess_extension
-from environment import sources, sources_path, update_env
-import json
+import environment
+from environment import sources, sources_path
+from sources_store import SourcesStore
+from hub_fetch import fetch_files
+from catalog import open_catalog
 import shutil
 import re
 import requests
 import huggingface_hub
 from typing import Any
 
+sources_store = SourcesStore(sources_path, sources)
+
 
 def cow_transfer_metadata(link: str) -> dict:
 	return get("https://api.kit9.cn/api/nainiu_netdisc/api.php?link=" + link).json()
@@ -60,38 +65,66 @@ def move_file(directory: Path, root_dir: Path):
 
 
 def update_download_path(engine_name: str, file_type: str, model_name: str, file_name: str, download_path: Path):
-	if not isinstance(sources[engine_name][file_type][model_name]["local"], dict):
-		sources[f"{engine_name}.{file_type}.{model_name}.local"] = {}
-	sources.__dict__[engine_name][file_type][model_name]["local"].update({file_name: str(download_path)})
-	json.dump(sources.__dict__, open(str(sources_path), "w+"), indent=4)
-	update_env()
+	# the files of a demucs model are downloaded into download_path/model_name
+	path = Path(download_path).joinpath(model_name).joinpath(file_name)
+	sources_store.set_local(engine_name, file_type, model_name, {file_name: path})
+	open_catalog().add_blob(path, engine_name, file_type, model_name, file_name)
 
 
 def update_download_path_dict(engine_name: str, file_type: str, model_name: str, data: dict):
-	if not isinstance(sources[engine_name][file_type][model_name]["local"], dict):
-		sources[f"{engine_name}.{file_type}.{model_name}.local"] = {}
-	sources[engine_name][file_type][model_name]["local"].update(data)
-	sources.make_json_able()
-	json.dump(sources, open(str(sources_path), "w+"), indent=4)
-	update_env()
+	sources_store.set_local(engine_name, file_type, model_name, data)
+	catalog = open_catalog()
+	for file_name, path in data.items():
+		catalog.add_blob(path, engine_name, file_type, model_name, file_name)
 	return sources_path
 
 
+def protected_paths() -> set:
+	"""
+	:return: the configured model, preset, dataset, output and cache roots, a listed local path is never one of them
+	"""
+	return {Path(i).resolve() for i in (
+		environment.demucs_model_path, environment.so_vits_model_path, environment.demucs_preset_path,
+		environment.so_vits_preset_path, environment.demucs_dataset_path, environment.so_vits_dataset_path,
+		environment.output_path, environment.cache_path)}
+
+
+def remove_local_file(path) -> bool:
+	"""
+	remove a downloaded file or directory, a configured root or a folder holding one is refused
+	:return: whether it existed and was removed
+	"""
+	path = Path(path)
+	resolved = path.resolve()
+	if any(resolved == i or resolved in i.parents for i in protected_paths()):
+		print(f"Refusing to remove {path}, it is or holds a configured model or output folder")
+		return False
+	try:
+		if path.is_dir():
+			shutil.rmtree(path)
+		else:
+			path.unlink()
+	except FileNotFoundError:
+		print(f"File {path} not found, it could be moved, renamed or deleted manually")
+		return False
+	print(f"Removed {path}")
+	return True
+
+
 def flush_sources_cache(remove_file=True, current_layer: dict = sources):
-	for i in current_layer.values():
-		if "local" in i and isinstance(i["local"], list):
-			while len(i["local"]) > 0:
-				removed = i["local"].pop()
+	with sources_store.transaction():
+		for i in current_layer.values():
+			if not isinstance(i, dict):
+				continue
+			if "local" in i and isinstance(i["local"], (list, dict)):
+				removed = list(i["local"].values()) if isinstance(i["local"], dict) else list(i["local"])
+				i["local"].clear()
 				if remove_file:
-					try:
-						shutil.rmtree(removed)
-					except FileNotFoundError:
-						print(f"File {removed} not found, it could be moved, renamed or deleted manually")
-						continue
-				print(f"Removed {removed}")
-		elif isinstance(i, dict):
-			flush_sources_cache(remove_file, i)
-	json.dump(sources, open(sources_path, "w+"), indent=4)
+					for j in removed:
+						remove_local_file(j)
+			elif "local" not in i:
+				flush_sources_cache(remove_file, i)
+		sources_store.changed()
 
 
 def get_cow_transfer_file(name, value, download_path, engine, type, auth:dict={}):
@@ -135,8 +168,21 @@ def get_cow_transfer_file(name, value, download_path, engine, type, auth:dict={}
 					[j.resolve() for j in download_path.joinpath(name).iterdir()]))
 
 
-def get_hugging_face_file(name, value, download_path, engine:str, type:str, patterns:list, update_cache=True, auth:dict={}) -> dict[Any, Any]:
+def get_hugging_face_file(name, value, download_path, engine:str, type:str, patterns:list, update_cache=True, auth:dict={}, mode="files", workers=4) -> dict[Any, Any]:
+	"""
+	download a model from huggingface
+	:param mode: files downloads only the files matching patterns, in parallel, into the shared huggingface cache and
+	links them into download_path/name, snapshot copies a whole snapshot into download_path/name
+	:param workers: the number of files downloaded at the same time in files mode
+	"""
 	download_path.mkdir(parents=True, exist_ok=True)
+	if mode == "files":
+		print("downloading: ", value)
+		files = fetch_files(value, download_path.joinpath(name), patterns, workers=workers, force_download=update_cache,
+							token=auth.get("huggingface", None))
+		print("downloaded: ", value)
+		update_download_path_dict(engine, type, name, files)
+		return files
 	pattern = r"https:\/\/huggingface\.co\/([-\w.]+)\/([\w.-]+)\/?"
 	match = re.match(pattern, value)
 	repo_id = match.group(1) + "/" + match.group(2).strip("/")
@@ -149,7 +195,7 @@ def get_hugging_face_file(name, value, download_path, engine:str, type:str, patt
 		for j in i.iterdir():
 			key.append(i.name + "/" + j.name)
 			value.append(j.resolve())
-			update_download_path(engine, type, name, i.name, j.resolve())
+	update_download_path_dict(engine, type, name, dict(zip(key, value)))
 	return dict(zip(key, value))
 
 
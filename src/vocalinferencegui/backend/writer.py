@@ -0,0 +1,129 @@
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import soundfile
+
+# extension -> (soundfile format, subtype), None for the default subtype of the format
+SOUNDFILE_FORMATS = {
+    "wav": ("WAV", None),
+    "flac": ("FLAC", None),
+    "mp3": ("MP3", None),
+    "ogg": ("OGG", "VORBIS"),
+    "opus": ("OGG", "OPUS"),
+}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _soundfile_supports(extension: str, sr: int) -> bool:
+    if extension not in SOUNDFILE_FORMATS:
+        return False
+    fmt, subtype = SOUNDFILE_FORMATS[extension]
+    if subtype == "OPUS" and sr not in OPUS_SAMPLE_RATES:
+        return False
+    return fmt in soundfile.available_formats() and (subtype is None or subtype in soundfile.available_subtypes(fmt))
+
+
+def _ffmpeg_encode(path: Path, audio: np.ndarray, sr: int):
+    from ingest import FFMPEG
+    channels = audio.shape[1]
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-f", "f32le", "-ar", str(sr),
+               "-ac", str(channels), "-i", "pipe:0"]
+    if path.suffix == ".opus" and sr not in OPUS_SAMPLE_RATES:
+        command += ["-ar", "48000"]
+    result = subprocess.run(command + [str(path)], input=np.ascontiguousarray(audio, dtype="<f4").tobytes(),
+                            capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {path}: {result.stderr.decode(errors='replace').strip()}")
+
+
+def encode(path: Path, audio: np.ndarray, sr: int, extension: str = None) -> Path:
+    """
+    write audio to path, through soundfile when it has the format, through ffmpeg otherwise. the file is written under
+    a temporary name and renamed, so a half written file is never seen under path.
+    :param path: the path of the output file
+    :param audio: (samples,) or (samples, channels)
+    :param sr: the sample rate of the audio
+    :param extension: wav, flac, mp3, ogg, opus or anything ffmpeg can encode, default is the suffix of path
+    :return: path
+    """
+    path = Path(path)
+    extension = (extension or path.suffix).strip(".").lower()
+    audio = np.asarray(audio, dtype=np.float32)
+    audio = audio.reshape(-1, 1) if audio.ndim == 1 else audio
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # a name of its own, two writes of the same path then never share their temporary file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=f".part.{extension}")
+    os.close(fd)
+    tmp = Path(tmp)
+    # mkstemp creates the file readable by its owner only, the output gets the mode of any other new file
+    os.chmod(tmp, 0o666 & ~_UMASK)
+    try:
+        if _soundfile_supports(extension, sr):
+            fmt, subtype = SOUNDFILE_FORMATS[extension]
+            soundfile.write(str(tmp), audio, sr, format=fmt, subtype=subtype)
+        else:
+            _ffmpeg_encode(tmp, audio, sr)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
+
+
+class AsyncWriter:
+    """
+    encodes and writes audio on background threads, so the next compute step starts while the last result is being
+    encoded. at most max_pending writes are queued, submit blocks once the queue is full, which bounds the memory held
+    by audio waiting to be written.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 8):
+        """
+        :param workers: the number of writes running at the same time, default is 2
+        :param max_pending: the number of writes queued or running before submit blocks, default is 8
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="writer")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, path: Path, audio: np.ndarray, sr: int, extension: str = None) -> Future:
+        """
+        queue a write, the arguments are the same as encode
+        :return: a future of the path, its result raises what the write raised
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(encode, path, audio, sr, extension)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self.pending.append(future)
+        return future
+
+    def wait(self) -> list:
+        """
+        wait for every write submitted so far
+        :return: the written paths, in the order they were submitted
+        """
+        with self._lock:
+            pending, self.pending = self.pending, []
+        return [i.result() for i in pending]
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
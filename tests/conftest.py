@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+from tests.synthetic import make_audio
+
+PROJECT_PATH = Path(__file__).parent.parent
+BACKEND_PATH = PROJECT_PATH / "src" / "vocalinferencegui" / "backend"
+SOURCES_EXPORT_PATH = PROJECT_PATH / "src" / "vocalinferencegui" / "resources" / "files" / "sources_export.json"
+
+# the backend modules import each other by bare name (``from environment import ...``)
+if str(BACKEND_PATH) not in sys.path:
+    sys.path.insert(0, str(BACKEND_PATH))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("vocalinferencegui")
+    group.addoption("--audio-seconds", type=float, default=10.,
+                    help="length of the synthetic audio used by the benchmarks, in seconds")
+    group.addoption("--audio-channels", type=int, default=2,
+                    help="channel count of the synthetic audio used by the benchmarks")
+    group.addoption("--audio-sr", type=int, default=44100,
+                    help="sample rate of the synthetic audio used by the benchmarks")
+
+
+@pytest.fixture(scope="session")
+def audio_spec(request):
+    """
+    (seconds, channels, sample rate) of the synthetic audio, configurable from the command line
+    """
+    return (request.config.getoption("--audio-seconds"),
+            request.config.getoption("--audio-channels"),
+            request.config.getoption("--audio-sr"))
+
+
+@pytest.fixture(scope="session")
+def synthetic_audio(audio_spec):
+    seconds, channels, sr = audio_spec
+    return make_audio(seconds, channels, sr)
+
+
+@pytest.fixture(scope="session")
+def synthetic_mono(audio_spec):
+    seconds, _, sr = audio_spec
+    return make_audio(seconds, 1, sr)
+
+
+@pytest.fixture(scope="session")
+def backend_environment(tmp_path_factory):
+    """
+    a scratch directory holding environment.json and sources.json, so importing environment never touches the network
+    """
+    root = tmp_path_factory.mktemp("environment")
+    files = root / "files"
+    config = {
+        "model": {"demucs": str(files / "models" / "demucs"), "so-vits": str(files / "models" / "so-vits")},
+        "preset": {"demucs": str(files / "presets" / "demucs"), "so-vits": str(files / "presets" / "so-vits")},
+        "dataset": {"demucs": str(files / "datasets" / "demucs"), "so-vits": str(files / "datasets" / "so-vits")},
+        "output": str(files / "output"),
+        "sources": str(files / "sources.json"),
+        "sources_export": str(files / "sources_export.json"),
+        "key_path": str(files / "keys"),
+        "keys": {}
+    }
+    files.mkdir(parents=True, exist_ok=True)
+    shutil.copy(SOURCES_EXPORT_PATH, files / "sources.json")
+    (root / "environment.json").write_text(json.dumps(config))
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        yield root
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def functions(backend_environment):
+    """
+    the backend functions module, skipped when the inference stack (demucs, so-vits-svc-fork, ...) is not installed
+    """
+    return pytest.importorskip("functions")
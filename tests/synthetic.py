@@ -0,0 +1,131 @@
+"""
+Deterministic synthetic inputs shared by the tests and benchmarks.
+"""
+import json
+import struct
+from pathlib import Path
+
+import pytest
+
+NCM_CORE_KEY = bytes.fromhex("687A4852416D736F356B496E62617857")
+NCM_META_KEY = bytes.fromhex("2331346C6A6B5F215C5D2630553C2728")
+
+
+def make_audio(seconds: float, channels: int = 1, sr: int = 44100, seed: int = 0):
+    """
+    generate deterministic audio that alternates between tone bursts and near silence, so the slicer has work to do
+    :param seconds: length of the audio
+    :param channels: channel count, 1 gives a 1d array, otherwise (channels, samples) like librosa
+    :param sr: sample rate
+    :param seed: seed of the noise floor
+    :return: float32 array
+    """
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    gate = (np.floor(t / 1.5) % 2 == 0).astype(np.float32)
+    channel_data = []
+    for c in range(channels):
+        tone = 0.5 * np.sin(2 * np.pi * (220. * (c + 1)) * t)
+        noise = 1e-4 * rng.standard_normal(n)
+        channel_data.append((tone * gate + noise).astype(np.float32))
+    if channels == 1:
+        return channel_data[0]
+    return np.stack(channel_data)
+
+
+def _pkcs7(data: bytes) -> bytes:
+    pad = 16 - len(data) % 16
+    return data + bytes([pad]) * pad
+
+
+def make_ncm(path: Path, payload: bytes, audio_format: str = "mp3", rc4_key: bytes = b"0123456789abcdef0123") -> Path:
+    """
+    build a NetEase ncm container around payload with the well known core and meta keys
+    :param path: where to write the ncm file
+    :param payload: the plain audio bytes
+    :param audio_format: the format recorded in the metadata
+    :param rc4_key: the per-file key
+    :return: path
+    """
+    from base64 import b64encode
+    AES = pytest.importorskip("Crypto.Cipher.AES")
+
+    key_data = bytearray(AES.new(NCM_CORE_KEY, AES.MODE_ECB).encrypt(_pkcs7(b"neteasecloudmusic" + rc4_key)))
+    for i in range(len(key_data)):
+        key_data[i] ^= 0x64
+    meta = b"music:" + json.dumps({"format": audio_format, "musicName": path.stem}).encode("utf-8")
+    meta_data = bytearray(b"163 key(Don't modify):" + b64encode(AES.new(NCM_META_KEY, AES.MODE_ECB).encrypt(_pkcs7(meta))))
+    for i in range(len(meta_data)):
+        meta_data[i] ^= 0x63
+
+    key_box = bytearray(range(256))
+    last_byte = 0
+    key_offset = 0
+    for i in range(256):
+        swap = key_box[i]
+        c = (swap + last_byte + rc4_key[key_offset]) & 0xff
+        key_offset = (key_offset + 1) % len(rc4_key)
+        key_box[i] = key_box[c]
+        key_box[c] = swap
+        last_byte = c
+    stream = bytes(key_box[(key_box[j] + key_box[(key_box[j] + j) & 0xff]) & 0xff] for j in range(256))
+    body = bytearray(payload)
+    for i in range(len(body)):
+        body[i] ^= stream[(i + 1) & 0xff]
+
+    image = b"\x89PNG" + bytes(60)
+    with open(path, "wb") as f:
+        f.write(b"CTENFDAM" + bytes(2))
+        f.write(struct.pack("<I", len(key_data)) + key_data)
+        f.write(struct.pack("<I", len(meta_data)) + meta_data)
+        f.write(struct.pack("<I", 0) + bytes(5))
+        f.write(struct.pack("<I", len(image)) + image)
+        f.write(body)
+    return path
+
+
+def cpu_work(size: int = 192, repeats: int = 20) -> dict:
+    """
+    cpu bound work for the scheduler benchmarks, a chain of BLAS matrix products
+    :return: the thread settings the work ran with, and a checksum
+    """
+    import os
+    import numpy as np
+    from scheduler import current_budget
+    a = np.random.default_rng(0).standard_normal((size, size)) / size ** 0.5
+    b = a
+    for _ in range(repeats):
+        b = np.tanh(a @ b)
+    return {"budget": current_budget(), "omp": os.environ.get("OMP_NUM_THREADS"), "checksum": float(b.sum())}
+
+
+def thread_report() -> dict:
+    """
+    the thread settings of a worker: OMP_NUM_THREADS in the environment its interpreter started with, and the sizes of
+    the BLAS/OpenMP pools numpy loaded when threadpoolctl is installed
+    """
+    from pathlib import Path
+    import numpy as np
+    environ = Path("/proc/self/environ")
+    startup = dict(i.split("=", 1) for i in environ.read_text().split("\0") if "=" in i) if environ.exists() else None
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        pools = None
+    else:
+        np.ones((2, 2)) @ np.ones((2, 2))
+        pools = [i["num_threads"] for i in threadpool_info()]
+    return {"startup_omp": None if startup is None else startup.get("OMP_NUM_THREADS"), "pools": pools}
+
+
+def toy_features(path) -> dict:
+    """
+    a cheap stand-in for the so-vits training features, one frame per 256 samples
+    """
+    import numpy as np
+    import soundfile
+    audio, _ = soundfile.read(str(path), dtype="float32", always_2d=True)
+    frames = audio[: audio.shape[0] // 256 * 256, 0].reshape(-1, 256)
+    return {"rms": np.sqrt((frames ** 2).mean(axis=1)), "stats": np.stack([frames.min(axis=1), frames.max(axis=1)], 1)}
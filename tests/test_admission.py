@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from admission import GiB, AdmissionController, MemoryModel, PeakMonitor, current_rss, downgrade, window_seconds
+
+
+@pytest.fixture
+def model(tmp_path):
+    return MemoryModel(tmp_path / "records.jsonl")
+
+
+def test_window_seconds():
+    assert window_seconds("separate", 200, {"split_mode": "segment", "split_num": 10}) == 10
+    assert window_seconds("separate", 200, {"split_mode": "no-split"}) == 200
+    assert window_seconds("convert", 20, {"max_chunk_seconds": 40}) == 20
+    with pytest.raises(ValueError):
+        window_seconds("train", 1, {})
+
+
+def test_model_is_calibrated_from_records(model, tmp_path):
+    # peak = 1 GiB + 10 bytes per track sample + 400 bytes per window sample
+    for duration, split_mode in [(30, "no-split"), (60, "segment"), (120, "no-split"), (240, "segment"),
+                                 (300, "segment"), (90, "no-split")]:
+        params = {"split_mode": split_mode, "split_num": 10}
+        samples = duration * 44100 * 2
+        window = window_seconds("separate", duration, params) * 44100 * 2
+        model.record("separate", "hdemucs", duration, 2, 44100, GiB + 10 * samples + 400 * window, params)
+    params = {"split_mode": "no-split"}
+    expected = GiB + 10 * 600 * 44100 * 2 + 400 * 600 * 44100 * 2
+    predicted = model.predict("separate", "hdemucs", 600, 2, 44100, params)
+    assert expected <= predicted <= expected * 1.2
+
+    reloaded = MemoryModel(tmp_path / "records.jsonl")
+    assert len(reloaded.records) == 6
+    assert reloaded.predict("separate", "hdemucs", 600, 2, 44100, params) == predicted
+    # another model has no records and falls back to the prior
+    assert reloaded.predict("separate", "other", 600, 2, 44100, params) != predicted
+
+
+def test_downgrade():
+    fits = lambda p: p.get("split_num", 0) <= 2
+    assert downgrade("separate", {"split_mode": "no-split"}, fits) == {"split_mode": "segment", "split_num": 2}
+    assert downgrade("separate", {"split_num": 7}, lambda p: p["split_num"] < 2) == {"split_num": 1}
+    assert downgrade("separate", {"split_num": 7}, lambda p: False) is None
+    assert downgrade("convert", {"max_chunk_seconds": 40}, lambda p: p["max_chunk_seconds"] <= 10) == \
+        {"max_chunk_seconds": 10}
+    assert downgrade("convert", {}, lambda p: False) is None
+
+
+def test_downgraded_segment_is_a_demucs_argument(functions, tmp_path):
+    params = downgrade("separate", {"split_mode": "segment", "split_num": 5}, lambda p: p["split_num"] <= 2)
+    args = functions.demucs_args(tmp_path / "track.wav", tmp_path, tmp_path, "hdemucs_mmi", "cpu", "float32",
+                                 params["split_mode"], params["split_num"], "clamp", 1, 1, False)
+    assert args[args.index("--segment") + 1] == "2"
+    args = functions.demucs_args(tmp_path / "track.wav", tmp_path, tmp_path, "hdemucs_mmi", "cpu", "float32",
+                                 "segment", 0.5, "clamp", 1, 1, False)
+    assert args[args.index("--segment") + 1] == "1"
+
+
+def test_peak_is_the_resident_memory_of_the_process():
+    with PeakMonitor(interval=0.01) as monitor:
+        before = current_rss()
+        block = bytearray(b"\x01") * (64 * 1024 * 1024)
+        time.sleep(0.05)
+        del block
+    assert monitor.peak >= before + 32 * 1024 * 1024
+
+
+def test_controller_queues_jobs_over_budget(model):
+    predicted = model.predict("convert", "m", 60, 1, 44100, {})
+    controller = AdmissionController(budget=int(predicted * 1.5), model=model, measure=False)
+    first = controller.admit("convert", "m", 60, 1, 44100)
+    started = threading.Event()
+
+    def second():
+        with controller.admit("convert", "m", 60, 1, 44100):
+            started.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.1)
+    assert not started.is_set() and controller.running == 1
+    first.release()
+    thread.join(5)
+    assert started.is_set() and controller.reserved == 0 and controller.running == 0
+    with pytest.raises(TimeoutError):
+        with controller.admit("convert", "m", 60, 1, 44100):
+            controller.admit("convert", "m", 60, 1, 44100, timeout=0.05)
+
+
+def test_controller_downgrades_or_refuses(model):
+    params = {"split_mode": "no-split"}
+    full = model.predict("separate", "m", 3600, 2, 44100, params)
+    controller = AdmissionController(budget=full // 4, model=model)
+    with controller.admit("separate", "m", 3600, 2, 44100, params) as ticket:
+        assert ticket.downgraded and ticket.params["split_mode"] == "segment"
+        assert ticket.predicted <= controller.budget
+    assert len(model.records) == 1 and model.records[0].window == ticket.params["split_num"]
+
+    with pytest.raises(MemoryError):
+        AdmissionController(budget=GiB // 2, model=model).admit("separate", "m", 3600, 2, 44100, params)
@@ -0,0 +1,75 @@
+import pickle
+
+import pytest
+
+from classes import AttributeDict
+
+
+def tree():
+    return {"so-vits": {"model": {"alto": {"link": ["https://example.com/alto"], "local": {}}}}, "__private": 1}
+
+
+def test_caller_dict_is_not_mutated():
+    data = tree()
+    sources = AttributeDict(data)
+    assert "__private" not in sources and "__private" in data
+    sources["so-vits"]["model"]["alto"]["local"].update({"G.pth": "/models/G.pth"})
+    sources["so-vits.model.tenor.local"] = {}
+    assert data == tree()
+    assert sources.get_attribute("so-vits.model.alto.local") == {"G.pth": "/models/G.pth"}
+    assert sources["so-vits"]["model"]["tenor"] == {"local": {}}
+
+
+def test_nested_values_are_wrapped_once():
+    sources = AttributeDict(tree())
+    assert isinstance(sources["so-vits"]["model"], AttributeDict)
+    assert sources["so-vits"]["model"] is sources["so-vits"]["model"]
+    assert getattr(sources, "so-vits").model.alto.link == ["https://example.com/alto"]
+    with pytest.raises(AttributeError):
+        sources.missing
+
+
+def test_attributes():
+    sources = AttributeDict(tree())
+    with pytest.raises(KeyError):
+        sources.get_attribute("so-vits.model.bass")
+    assert sources.get_attribute("so-vits.model.bass", strict=False) is None
+    with pytest.raises(KeyError):
+        sources.set_attribute("so-vits.model.bass.local", {})
+    sources.add_attribute("so-vits.model.bass.local", {})
+    assert sources.has_attribute("so-vits.model.bass.local")
+    sources.remove_attribute("so-vits.model.bass")
+    assert not sources.has_attribute("so-vits.model.bass")
+    with pytest.raises(TypeError):
+        sources[1] = 1
+
+
+def test_pickle_and_dict_views():
+    sources = AttributeDict(tree())
+    sources["so-vits"]["model"]["alto"]["local"].update({"G.pth": "/models/G.pth"})
+    assert pickle.loads(pickle.dumps(sources)) == sources
+    assert sources.__dict__ is sources and sources.dict is sources
+
+
+@pytest.mark.parametrize("read_before_copy", [False, True])
+def test_copy_does_not_share_wrapped_levels(read_before_copy):
+    a = AttributeDict({"x": {"y": 1, "z": {"w": 1}}})
+    if read_before_copy:
+        a["x"]["z"]
+    b = a.copy()
+    b["x"]["y"] = 3
+    b["x"]["z"]["w"] = 3
+    a["x"]["y"] = 2
+    a["x"]["z"]["w"] = 2
+    assert a["x"]["y"] == 2 and a["x"]["z"]["w"] == 2
+    assert b["x"]["y"] == 3 and b["x"]["z"]["w"] == 3
+    assert AttributeDict.from_attrib_dict(a) == a
+
+
+def test_reserved_keys_cannot_be_set():
+    sources = AttributeDict(tree())
+    with pytest.raises(ValueError):
+        sources["__private"] = 1
+    with pytest.raises(ValueError):
+        sources["so-vits.__private"] = 1
+    assert "__private" not in sources and "__private" not in sources["so-vits"]
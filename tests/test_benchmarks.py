@@ -0,0 +1,196 @@
+"""
+Benchmarks of the audio processing hot paths.
+
+Everything runs on CPU on deterministic synthetic audio, no network is needed. Store the results as json to compare
+them across commits:
+
+    python -m pytest tests/test_benchmarks.py --benchmark-autosave
+    python -m pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:10%
+
+The audio length and channel count can be changed with ``--audio-seconds`` and ``--audio-channels``. Peak traced
+memory of one call is recorded in the ``extra_info`` of every benchmark.
+"""
+import tracemalloc
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pytest_benchmark")
+
+from tests.synthetic import make_audio, make_ncm
+from classes import AttributeDict
+from Slicer import Slicer, get_rms
+
+
+def record_peak_memory(benchmark, func, *args, **kwargs):
+    """
+    run func once under tracemalloc and store the peak allocation in the benchmark json
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory_bytes"] = peak
+
+
+def write_wav(path, audio, sr):
+    soundfile = pytest.importorskip("soundfile")
+    soundfile.write(path, audio.T if audio.ndim > 1 else audio, sr)
+    return path
+
+
+def test_get_rms(benchmark, synthetic_mono, audio_spec):
+    sr = audio_spec[2]
+    hop = round(sr * 10 / 1000)
+    record_peak_memory(benchmark, get_rms, synthetic_mono, frame_length=4 * hop, hop_length=hop)
+    rms = benchmark(get_rms, synthetic_mono, frame_length=4 * hop, hop_length=hop)
+    assert rms.shape[-1] == synthetic_mono.shape[-1] // hop + 1
+
+
+def test_slicer_slice(benchmark, synthetic_audio, audio_spec):
+    slicer = Slicer(sr=audio_spec[2], min_length=1000, hop_size=10, max_sil_kept=500)
+    record_peak_memory(benchmark, slicer.slice, synthetic_audio)
+    chunks = benchmark(slicer.slice, synthetic_audio)
+    assert len(chunks) > 1
+
+
+def test_convert_ncm(benchmark, functions, tmp_path, audio_spec):
+    # roughly a 320kbps stream of the configured length
+    payload = np.random.default_rng(0).integers(0, 256, int(audio_spec[0] * 40000), dtype=np.uint8).tobytes()
+    ncm = make_ncm(tmp_path / "synthetic.ncm", payload)
+    record_peak_memory(benchmark, functions.convert_ncm, ncm, tmp_path / "out")
+    out = benchmark(functions.convert_ncm, ncm, tmp_path / "out")
+    assert out.read_bytes() == payload
+
+
+def test_fuse_vocal_and_instrumental(benchmark, functions, tmp_path, audio_spec):
+    seconds, _, sr = audio_spec
+    vocal = write_wav(tmp_path / "vocal.wav", make_audio(seconds, 1, sr, seed=1), sr)
+    instrumental = write_wav(tmp_path / "instrumental.wav", make_audio(seconds, 1, sr, seed=2), sr)
+    args = (vocal, instrumental, tmp_path / "fused", "synthetic")
+    record_peak_memory(benchmark, functions.fuse_vocal_and_instrumental, *args)
+    out = benchmark(functions.fuse_vocal_and_instrumental, *args)
+    assert out.exists()
+
+
+def test_resample(benchmark, functions, tmp_path, audio_spec):
+    seconds, _, sr = audio_spec
+    source = write_wav(tmp_path / "source.wav", make_audio(seconds, 1, sr), sr)
+    record_peak_memory(benchmark, functions.resample, source, tmp_path / "resampled", 22050)
+    out = benchmark(functions.resample, source, tmp_path / "resampled", 22050)
+    assert out.exists()
+
+
+def make_sources_tree(engines=4, models=250, files=8):
+    return {
+        f"engine{e}": {
+            "model": {
+                f"model{m}": {
+                    "private": False,
+                    "auth": {},
+                    "link": [f"https://example.com/{e}/{m}"],
+                    "local": {f"file{f}.pth": f"/models/{e}/{m}/file{f}.pth" for f in range(files)}
+                } for m in range(models)
+            }
+        } for e in range(engines)
+    }
+
+
+@pytest.fixture(scope="module")
+def sources_tree():
+    return make_sources_tree()
+
+
+def test_attribute_dict_construct(benchmark, sources_tree):
+    record_peak_memory(benchmark, AttributeDict, sources_tree)
+    benchmark(AttributeDict, sources_tree)
+
+
+def test_attribute_dict_get_attribute(benchmark, sources_tree):
+    sources = AttributeDict(sources_tree)
+    value = benchmark(sources.get_attribute, "engine3.model.model249.local", sources)
+    assert value["file7.pth"] == "/models/3/249/file7.pth"
+
+
+def test_attribute_dict_item_lookup(benchmark, sources_tree):
+    sources = AttributeDict(sources_tree)
+    value = benchmark(lambda: sources["engine3"]["model"]["model249"]["local"]["file7.pth"])
+    assert value == "/models/3/249/file7.pth"
+
+
+def test_attribute_dict_set_item(benchmark, sources_tree):
+    sources = AttributeDict(sources_tree)
+
+    def write():
+        for m in range(0, 250, 10):
+            sources[f"engine3.model.model{m}.local"] = {"new.pth": f"/models/3/{m}/new.pth"}
+
+    benchmark(write)
+    assert sources["engine3"]["model"]["model240"]["local"] == {"new.pth": "/models/3/240/new.pth"}
+    assert sources_tree["engine3"]["model"]["model240"]["local"] != {"new.pth": "/models/3/240/new.pth"}
+
+
+def test_attribute_dict_load_and_update(benchmark, sources_tree):
+    # what a download does to sources.json: load the tree, then record the local file of one model
+    def load_and_update():
+        sources = AttributeDict(sources_tree)
+        sources["engine1"]["model"]["model100"]["local"].update({"file8.pth": "/models/1/100/file8.pth"})
+        return sources
+
+    sources = benchmark(load_and_update)
+    assert len(sources["engine1"]["model"]["model100"]["local"]) == 9
+
+
+def test_slicer_reslice_from_envelope(benchmark, synthetic_audio, audio_spec):
+    from envelope import Envelope, aligned_hop
+    slicer = Slicer(sr=audio_spec[2], threshold=-30., min_length=1000, hop_size=10, max_sil_kept=500)
+    envelope = Envelope.from_audio(synthetic_audio, audio_spec[2], aligned_hop(slicer.win_size, slicer.hop_size))
+    record_peak_memory(benchmark, slicer.slice, synthetic_audio, envelope)
+    chunks = benchmark(slicer.slice, synthetic_audio, envelope)
+    assert len(chunks) > 1
+
+
+@pytest.fixture(scope="module")
+def demucs_repo():
+    pytest.importorskip("torch")
+    pytest.importorskip("demucs")
+    import environment
+    repo = environment.demucs_model_path.joinpath("hdemucs_mmi")
+    if not repo.joinpath("hdemucs_mmi.yaml").exists():
+        pytest.skip(f"no hdemucs_mmi model in {repo}")
+    return repo
+
+
+@pytest.mark.parametrize("backend", ["torch", "int8"])
+def test_separate_backend(benchmark, demucs_repo, synthetic_audio, audio_spec, tmp_path, backend):
+    # real time factor of in-process separation, int8 must stay close to the fp32 output
+    from quantized import load_demucs, separate_in_process, snr
+    track = write_wav(tmp_path / "track.wav", synthetic_audio, audio_spec[2])
+    model = load_demucs(demucs_repo, backend=backend)
+    outputs = benchmark.pedantic(separate_in_process, args=(track, tmp_path / backend, demucs_repo),
+                                 kwargs={"model": model}, rounds=1, iterations=1)
+    benchmark.extra_info["realtime_factor"] = benchmark.stats.stats.mean / audio_spec[0]
+    if backend == "int8":
+        soundfile = pytest.importorskip("soundfile")
+        reference = separate_in_process(track, tmp_path / "torch", demucs_repo, model=load_demucs(demucs_repo))
+        for stem in ("vocal", "instrumental"):
+            benchmark.extra_info[f"{stem}_snr_db"] = snr(soundfile.read(reference[stem])[0],
+                                                         soundfile.read(outputs[stem])[0])
+            assert benchmark.extra_info[f"{stem}_snr_db"] > 20
+
+
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_core_budget_throughput(benchmark, workers):
+    # aggregate throughput of cpu bound jobs, each worker limited to its share of the cores
+    from scheduler import CoreBudgetExecutor, available_cores
+    from tests.synthetic import cpu_work
+    if workers > len(available_cores()):
+        pytest.skip(f"needs {workers} cores")
+    jobs = 8
+    with CoreBudgetExecutor(workers=workers) as executor:
+        list(executor.map(cpu_work, [32] * workers))
+        results = benchmark.pedantic(lambda: list(executor.map(cpu_work, [192] * jobs)), rounds=3, iterations=1)
+    benchmark.extra_info["jobs_per_second"] = jobs / benchmark.stats.stats.mean
+    assert len({i["checksum"] for i in results}) == 1
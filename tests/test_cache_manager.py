@@ -0,0 +1,119 @@
+import json
+import os
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from cache_manager import CacheManager
+from catalog import Catalog
+from sources_store import SourcesStore
+
+
+def write(path, size, age=0.):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"0" * size)
+    when = time.time() - age
+    os.utime(path, (when, when))
+    return path
+
+
+@pytest.fixture
+def tree(tmp_path):
+    models, output = tmp_path / "models", tmp_path / "output"
+    write(models / "alto" / "G_0.pth", 1000, age=300)
+    write(models / "tenor" / "G_0.pth", 1000, age=200)
+    write(models / "bass" / "G_0.pth", 1000, age=100)
+    write(output / "hdemucs_mmi" / "track" / "vocals.wav", 500, age=400)
+    write(output / "track_generated_with_alto.wav", 500, age=50)
+    return {"model": models, "output": output}
+
+
+def test_dry_run_keeps_files(tree):
+    manager = CacheManager(tree, budget=2500)
+    report = manager.evict(dry_run=True)
+    assert [i.path.name for i in report.removed] == ["vocals.wav", "alto"]
+    assert report.freed_bytes == 1500 and report.total_bytes == 4000
+    assert "would remove 2 entries" in str(report)
+    assert (tree["output"] / "hdemucs_mmi" / "track" / "vocals.wav").exists()
+
+
+def test_lru_eviction_with_pins(tree):
+    manager = CacheManager(tree, budget=2500, pinned=[tree["model"] / "alto" / "G_0.pth"])
+    report = manager.evict()
+    assert [i.path.name for i in report.removed] == ["vocals.wav", "tenor"]
+    assert not (tree["output"] / "hdemucs_mmi").exists()
+    assert (tree["model"] / "alto").exists() and not (tree["model"] / "tenor").exists()
+    assert manager.plan().removed == []
+
+
+def test_catalog_usage_and_lfu(tree, tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    for name in ("alto", "tenor", "bass"):
+        catalog.add_blob(tree["model"] / name / "G_0.pth", file_name="G_0.pth")
+    catalog.touch(*[tree["model"] / "bass" / "G_0.pth"] * 3, tree["model"] / "alto" / "G_0.pth")
+    catalog.pin(tree["model"] / "tenor" / "G_0.pth")
+
+    report = CacheManager({"model": tree["model"]}, budget=2000, catalog=catalog, policy="lfu").evict()
+    assert [i.path.name for i in report.removed] == ["alto"]
+    assert catalog.usage(tree["model"] / "alto")["last_used"] is None
+    assert catalog.usage(tree["model"] / "bass")["use_count"] == 3
+
+
+def test_evicted_files_leave_sources(tree, tmp_path):
+    sources_path = tmp_path / "sources.json"
+    sources_path.write_text(json.dumps({"so-vits": {"model": {
+        "alto": {"link": [], "local": {"G_0.pth": str(tree["model"] / "alto" / "G_0.pth")}},
+        "bass": {"link": [], "local": {"G_0.pth": str(tree["model"] / "bass" / "G_0.pth")}},
+    }}}))
+    store = SourcesStore(sources_path)
+    CacheManager({"model": tree["model"]}, budget=2000, sources_store=store).evict()
+    models = json.loads(sources_path.read_text())["so-vits"]["model"]
+    assert models["alto"]["local"] == {} and len(models["bass"]["local"]) == 1
+
+
+def test_eviction_follows_recorded_use(tree, tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    # the order conversions used the models in, the opposite of their file times
+    for name in ("bass", "tenor", "alto"):
+        catalog.touch(tree["model"] / name / "G_0.pth", add=True)
+        time.sleep(0.01)
+    output = Future()
+    catalog.add_output(output, "so-vits", speaker="alto")
+    assert catalog.outputs() == []
+    output.set_result(tree["output"] / "track_generated_with_alto.wav")
+    assert len(catalog.outputs()) == 1
+    catalog.touch(tree["output"] / "hdemucs_mmi" / "track" / "vocals.wav", add=True)
+
+    report = CacheManager(tree, budget=1500, catalog=catalog).evict(dry_run=True)
+    assert [i.path.name for i in report.removed] == ["bass", "tenor", "alto"]
+    assert catalog.blobs(order_by="oldest")[0]["path"].endswith("bass/G_0.pth")
+
+
+def test_linked_hub_blobs_are_counted_and_evicted(tmp_path):
+    hub = tmp_path / "hub" / "models--owner--repo"
+    models = tmp_path / "models"
+    for name in ("alto", "shared"):
+        write(hub / "blobs" / name, 1000)
+        (hub / "snapshots" / "main").mkdir(parents=True, exist_ok=True)
+        (hub / "snapshots" / "main" / f"{name}.pth").symlink_to(f"../../blobs/{name}")
+    for model, blob, age in (("alto", "alto", 300), ("tenor", "shared", 200), ("bass", "shared", 100)):
+        (models / model).mkdir(parents=True)
+        (models / model / "G_0.pth").symlink_to(hub / "snapshots" / "main" / f"{blob}.pth")
+        os.utime(models / model / "G_0.pth", (time.time() - age, time.time() - age), follow_symlinks=False)
+    write(models / "tenor" / "config.json", 10, age=50)
+
+    manager = CacheManager({"model": models}, budget=0)
+    sizes = {i.path.name: i.size for i in manager.scan()}
+    # only alto owns its blob, the shared one is kept while two models link it
+    assert sizes["alto"] > 1000 and sizes["tenor"] < 1000 and sizes["bass"] < 1000
+    report = manager.evict(budget=sizes["tenor"] + sizes["bass"])
+    assert [i.path.name for i in report.removed] == ["alto"]
+    assert not (hub / "blobs" / "alto").exists() and not (hub / "snapshots" / "main" / "alto.pth").is_symlink()
+    assert (hub / "blobs" / "shared").exists()
+
+    manager.evict(budget=sizes["tenor"])
+    assert (hub / "blobs" / "shared").exists()
+    manager.evict(budget=0)
+    assert not (hub / "blobs" / "shared").exists()
+    assert not any(models.iterdir())
@@ -0,0 +1,81 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from catalog import Catalog
+
+SOURCES_EXPORT = Path(__file__).parents[1] / "src" / "vocalinferencegui" / "resources" / "files" / "sources_export.json"
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog(tmp_path / "catalog.sqlite3") as catalog:
+        yield catalog
+
+
+def test_export_round_trip(catalog):
+    sources = json.loads(SOURCES_EXPORT.read_text())
+    catalog.import_sources(sources)
+    catalog.import_sources(sources)
+    for engine in sources.values():
+        for entry in engine["model"].values():
+            # one entry of the shipped sources has "private": {}, the catalog stores it as a bool
+            entry["private"] = bool(entry["private"])
+    assert catalog.export_sources() == sources
+    assert len(catalog.sources(engine="demucs")) == len(sources["demucs"]["model"])
+
+
+def test_private_sources_and_local_files(catalog, tmp_path):
+    model = tmp_path / "G_0.pth"
+    model.write_bytes(b"0" * 100)
+    catalog.import_sources({"so-vits": {"model": {
+        "alto": {"private": False, "auth": {}, "link": ["https://example.com/alto"], "local": {"G_0.pth": str(model)}},
+        "secret": {"private": True, "auth": {}, "link": [], "local": {}},
+    }}})
+    assert list(catalog.export_sources()["so-vits"]["model"]) == ["alto"]
+    assert catalog.export_sources()["so-vits"]["model"]["alto"]["local"] == {}
+    assert len(catalog.export_sources(ignore_private=True)["so-vits"]["model"]) == 2
+    exported = catalog.export_sources(include_local=True)["so-vits"]["model"]["alto"]["local"]
+    assert exported == {"G_0.pth": str(model.resolve())}
+    blob, = catalog.blobs(engine="so-vits", name="alto")
+    assert blob["size"] == 100 and blob["use_count"] == 0
+
+
+def test_slices_and_outputs(catalog, tmp_path):
+    dataset = catalog.add_dataset("so-vits", "alto", tmp_path / "alto", speaker="alto")
+    catalog.add_slices(dataset, [{"path": tmp_path / "alto" / f"{i}.wav", "speaker": "alto", "begin": i * 44100,
+                                  "end": (i + 1) * 44100, "duration": 1. + i % 10} for i in range(10000)])
+    assert len(catalog.slices(dataset_id=dataset)) == 10000
+    assert len(catalog.slices(speaker="alto", min_duration=10.)) == 1000
+
+    for i in range(3):
+        output = tmp_path / f"out{i}.wav"
+        output.write_bytes(b"0" * (i + 1) * 10)
+        catalog.add_output(output, "so-vits", speaker="tenor" if i else "alto", params={"noice_scale": 0.4})
+    catalog.touch(tmp_path / "out0.wav")
+    assert catalog.outputs(order_by="last_used", limit=1)[0]["path"] == str((tmp_path / "out0.wav").resolve())
+    assert [i["size"] for i in catalog.outputs(speaker="tenor", order_by="size")] == [30, 20]
+    assert len(catalog.outputs(min_size=20)) == 2
+    catalog.remove(tmp_path / "out0.wav")
+    assert len(catalog.outputs()) == 2
+    with pytest.raises(ValueError):
+        catalog.outputs(order_by="speaker; DROP TABLE outputs")
+
+
+def test_slices_written_by_a_writer(catalog, tmp_path):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("soundfile")
+    from writer import AsyncWriter
+
+    # what slice_audio records with a writer it does not own
+    dataset = catalog.add_dataset("so-vits", "alto", tmp_path / "sliced")
+    with AsyncWriter() as writer:
+        slices = [{"path": writer.submit(tmp_path / "sliced" / f"alto_{i}th_slice.wav", np.zeros(800, np.float32), 8000),
+                   "begin": i * 800, "end": (i + 1) * 800, "duration": 0.1} for i in range(3)]
+        catalog.add_slices(dataset, slices)
+        writer.wait()
+    recorded = catalog.slices(dataset_id=dataset, order_by="path")
+    assert [Path(i["path"]).name for i in recorded] == [f"alto_{i}th_slice.wav" for i in range(3)]
+    assert all(i["size"] > 0 for i in recorded)
+    assert catalog.usage(tmp_path / "sliced")["last_used"] is not None
@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("msgpack")
+
+from daemon import BatchHandler, ConvertHandler, DaemonClient, InferenceServer, SeparateHandler, WarmModels, run_groups
+from tests.test_so_vits_batch import StubEngine, model, write_vocal  # noqa: F401
+
+
+class EchoHandler(BatchHandler):
+    max_batch = 4
+    max_wait = 0.2
+
+    def __init__(self):
+        self.loads = []
+        self.models = WarmModels(lambda key: self.loads.append(key) or key.upper())
+        self.batches = []
+
+    def key(self, args):
+        if "model" not in args:
+            raise ValueError("model is required")
+        return args["model"]
+
+    def run_batch(self, key, batch):
+        model = self.models.get(key)
+        self.batches.append([i["text"] for i in batch])
+        return [ValueError("bad text") if i["text"] == "bad" else f"{model}:{i['text']}" for i in batch]
+
+
+@pytest.fixture
+def server(tmp_path):
+    handler = EchoHandler()
+    with InferenceServer(tmp_path / "inference.sock", {"echo": handler}) as server:
+        yield server, handler
+
+
+def test_ping_and_stream(server):
+    server, _ = server
+    with DaemonClient(server.socket_path) as client:
+        assert client.ping()["ops"] == ["echo"]
+        events = [i["event"] for i in client.request("echo", model="a", text="x")]
+    assert events == ["queued", "running", "result"]
+
+
+def test_concurrent_requests_are_batched_on_one_warm_model(server):
+    server, handler = server
+    results = {}
+
+    def run(i):
+        with DaemonClient(server.socket_path) as client:
+            results[i] = client.call("echo", model="m", text=str(i))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    assert results == {i: f"M:{i}" for i in range(4)}
+    assert server.stats["echo"] == [4]
+    assert handler.loads == ["m"]
+
+    with DaemonClient(server.socket_path) as client:
+        assert client.call("echo", model="m", text="again") == "M:again"
+    assert handler.loads == ["m"]
+
+
+def test_errors_fail_only_their_request(server):
+    server, _ = server
+    with DaemonClient(server.socket_path) as client:
+        with pytest.raises(RuntimeError, match="bad text"):
+            client.call("echo", model="m", text="bad")
+        with pytest.raises(RuntimeError, match="model is required"):
+            client.call("echo", text="x")
+        with pytest.raises(RuntimeError, match="unknown op"):
+            client.call("nope")
+        assert client.call("echo", model="m", text="ok") == "M:ok"
+
+
+def test_dropped_model_is_released_after_its_batch():
+    released = []
+    models = WarmModels(lambda key: key.upper(), max_models=2, release=released.append)
+    with models.use("a") as model:
+        assert model == "A"
+        models.get("b")
+        models.get("c")
+        # a is dropped from the warm models, but its batch still runs on it
+        assert list(models.models) == ["b", "c"] and released == []
+    assert released == ["A"]
+    with models.use("b"):
+        models.clear()
+        assert released == ["A", "C"]
+    assert released == ["A", "C", "B"]
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = tmp_path / "inference.sock"
+    path.touch()
+    with InferenceServer(path, {"echo": EchoHandler()}) as server:
+        with DaemonClient(server.socket_path) as client:
+            assert client.ping()["ops"] == ["echo"]
+        with pytest.raises(RuntimeError, match="already listening"):
+            InferenceServer(path, {"echo": EchoHandler()}).start()
+    assert not path.exists()
+
+
+def test_convert_key_holds_the_engine_settings():
+    handler = ConvertHandler()
+    args = {"input_vocal": "a.wav", "output_path": "out", "model_path": "G.pth", "config_file_path": "config.json",
+            "speaker": "alto"}
+    assert handler.key(args) == ("G.pth", "config.json", None, "torch", True, 1)
+    assert handler.key({**args, "feature_cache": False, "f0_workers": 4}) == ("G.pth", "config.json", None, "torch",
+                                                                            False, 4)
+    with pytest.raises(ValueError):
+        handler.key({"input_vocal": "a.wav"})
+
+
+def test_convert_batch_on_a_warm_engine(functions, tmp_path, model):
+    first = write_vocal(tmp_path / "first.wav", 1.)
+    second = write_vocal(tmp_path / "second.wav", 2.)
+    engine = StubEngine(f0_workers=2)
+    handler = ConvertHandler()
+    handler.models = WarmModels(lambda key: engine)
+    common = {"output_path": str(tmp_path / "out"), "model_path": str(model[0]), "config_file_path": str(model[1]),
+              "f0_workers": 2}
+    batch = [{**common, "input_vocal": str(first), "speaker": "alto"},
+             {**common, "input_vocal": str(first), "speaker": "tenor"},
+             {**common, "input_vocal": str(second), "speaker": "alto", "noice_scale": 0.2},
+             {**common, "input_vocal": str(second), "speaker": "bass", "noice_scale": 0.3},
+             {**common, "input_vocal": str(second), "speaker": "tenor"}]
+    results = handler.run_batch(handler.key(batch[0]), batch)
+
+    # the inputs of the same parameters are converted together, other parameters get their own apply_so_vits_batch
+    assert engine.calls == [(8000, ["alto", "tenor"]), (16000, ["tenor"]), (16000, ["alto"])]
+    assert engine.batches == [2, 1]
+    assert [i.name for i in results[:3]] == ["first_generated_with_alto.wav", "first_generated_with_tenor.wav",
+                                             "second_generated_with_alto.wav"]
+    assert results[4].name == "second_generated_with_tenor.wav"
+    assert isinstance(results[3], ValueError)
+
+
+def test_batch_handler_is_abstract():
+    with pytest.raises(TypeError):
+        BatchHandler()
+
+
+def test_failed_group_is_run_again_request_by_request():
+    def run(members):
+        if "bad" in members:
+            raise ValueError("bad member")
+        return [i.upper() for i in members]
+
+    results = run_groups([[(0, "a"), (2, "bad"), (3, "b")], [(1, "c")]], run, 4)
+    assert results[0] == "A" and results[1] == "C" and results[3] == "B"
+    assert isinstance(results[2], ValueError)
+
+
+def test_separations_with_the_same_parameters_are_stacked(monkeypatch, tmp_path):
+    import quantized
+    calls = []
+
+    def separate_many(track_paths, output_path, repo, model=None, **kwargs):
+        calls.append(([i.name for i in track_paths], kwargs.get("split_num")))
+        return [{"vocal": output_path / i.name} for i in track_paths]
+
+    monkeypatch.setattr(quantized, "separate_many", separate_many)
+    handler = SeparateHandler()
+    handler.models = WarmModels(lambda key: "model")
+    batch = [{"track_path": str(tmp_path / "a.wav"), "output_path": str(tmp_path)},
+             {"track_path": str(tmp_path / "b.wav"), "output_path": str(tmp_path), "split_num": 2},
+             {"track_path": str(tmp_path / "c.wav"), "output_path": str(tmp_path)}]
+    results = handler.run_batch(handler.key(batch[0]), batch)
+    assert calls == [(["a.wav", "c.wav"], None), (["b.wav"], 2)]
+    assert [i["vocal"].name for i in results] == ["a.wav", "b.wav", "c.wav"]
@@ -0,0 +1,81 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+soundfile = pytest.importorskip("soundfile")
+
+from dedup import FINGERPRINT_NAME, FingerprintIndex, dedup_dataset, fingerprint, hamming
+
+SR = 16000
+
+
+def phrase(seed: int, seconds: float = 2.) -> np.ndarray:
+    # a sung phrase stand-in: a few notes of random pitch with harmonics
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SR)) / SR
+    notes = rng.uniform(150, 600, 4)
+    f0 = notes[np.minimum((t / seconds * 4).astype(int), 3)]
+    phase = 2 * np.pi * np.cumsum(f0) / SR
+    audio = sum(np.sin(k * phase) / k for k in range(1, 6)) * 0.2
+    return (audio + 0.002 * rng.standard_normal(t.shape[0])).astype(np.float32)
+
+
+def test_hamming():
+    a = np.array([0, 0b1011, 2 ** 64 - 1], dtype=np.uint64)
+    b = np.array([0, 0b0001, 0], dtype=np.uint64)
+    assert hamming(a, b).tolist() == [0, 2, 64]
+
+
+def test_fingerprint_is_robust_to_gain_and_noise():
+    audio = phrase(0)
+    noisy = audio * 0.5 + 0.0005 * np.random.default_rng(9).standard_normal(audio.shape[0]).astype(np.float32)
+    fps = np.array([fingerprint(audio, SR), fingerprint(noisy, SR)] + [fingerprint(phrase(i), SR) for i in range(1, 6)],
+                   dtype=np.uint64)
+    assert hamming(fps[:1], fps[1:2])[0] <= 3
+    assert hamming(np.repeat(fps[:1], 5), fps[2:]).min() > 8
+
+
+def test_index_groups_near_duplicates():
+    fps = np.array([0b1111, 0b1110, 0b1111 << 40, 0b1111 << 40 | 1, 2 ** 63], dtype=np.uint64)
+    index = FingerprintIndex(["a", "b", "c", "d", "e"], fps, np.array([2., 1.95, 1., 3., 2.]))
+    assert index.duplicates(max_distance=1) == [["a", "b"]]
+    assert index.duplicates(max_distance=1, duration_tolerance=2) == [["a", "b"], ["d", "c"]]
+    assert index.duplicates(max_distance=0) == []
+
+
+def test_near_duplicates_do_not_chain():
+    # b is within one bit of a and c, but a and c are two bits apart
+    fps = np.array([0b00, 0b01, 0b11], dtype=np.uint64)
+    index = FingerprintIndex(["a", "b", "c"], fps, np.array([3., 2.9, 2.8]))
+    assert index.duplicates(max_distance=1) == [["a", "b"]]
+
+
+def test_large_buckets_are_capped():
+    # every fingerprint shares its low band, so a slice is only compared with its next ones by duration
+    fps = np.arange(200, dtype=np.uint64) << np.uint64(40)
+    index = FingerprintIndex([str(i) for i in range(200)], fps, np.arange(200, dtype=np.float64))
+    pairs = index.candidate_pairs(max_distance=1, bucket_limit=8)
+    assert len(pairs) == sum(200 - i for i in range(1, 9))
+    assert (pairs[:, 1] - pairs[:, 0] <= 8).all()
+    assert len(index.candidate_pairs(max_distance=1, bucket_limit=200)) == 200 * 199 // 2
+
+
+def test_dedup_dataset(tmp_path):
+    directory = tmp_path / "sliced"
+    directory.mkdir()
+    for i in range(6):
+        soundfile.write(directory / f"slice_{i}.wav", phrase(i), SR)
+    soundfile.write(directory / "slice_0_live.wav", phrase(0) * 0.8, SR)
+    soundfile.write(directory / "slice_3_reexport.flac", phrase(3), SR)
+
+    report = dedup_dataset(directory=directory)
+    assert sorted(sorted(i) for i in report.groups) == [
+        sorted([str(directory / "slice_0.wav"), str(directory / "slice_0_live.wav")]),
+        sorted([str(directory / "slice_3.wav"), str(directory / "slice_3_reexport.flac")]),
+    ]
+    assert (directory / FINGERPRINT_NAME).exists() and report.removed == []
+
+    report = dedup_dataset(directory=directory, drop=True)
+    assert len(report.removed) == 2
+    assert len(list(directory.glob("slice_*"))) == 6
+    assert len(FingerprintIndex.load(directory / FINGERPRINT_NAME)) == 6
+    assert dedup_dataset(directory=directory).groups == []
@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tests.synthetic import make_audio
+from envelope import Envelope, aligned_hop, envelope_cache_path, load_envelope
+from Slicer import Slicer, get_rms
+
+
+def test_rms_matches_get_rms_on_block_aligned_frames():
+    y = make_audio(3., 1, 16000)
+    envelope = Envelope.from_audio(y, 16000, base_hop=32)
+    expected = get_rms(y, frame_length=1280, hop_length=320)
+    assert np.allclose(envelope.rms(frame_length=1280, hop_length=320), expected, rtol=1e-4, atol=1e-7)
+
+
+def test_rms_close_to_get_rms_on_unaligned_frames():
+    y = make_audio(3., 1, 44100)
+    envelope = Envelope.from_audio(y, 44100)
+    expected = get_rms(y, frame_length=1764, hop_length=441)
+    actual = envelope.rms(frame_length=1764, hop_length=441)
+    assert actual.shape == expected.shape
+    assert np.max(np.abs(actual - expected)) < 0.05
+
+
+def test_pyramid_levels_aggregate():
+    envelope = Envelope.from_audio(make_audio(2., 2, 8000), 8000, base_hop=16)
+    assert envelope.levels[-1].shape == (1,)
+    assert np.isclose(envelope.levels[-1][0], envelope.levels[0].sum(), rtol=1e-4)
+    assert envelope.preview(100).shape[0] >= 100
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+def test_slice_with_aligned_envelope_is_exact(channels):
+    y = make_audio(12., channels, 44100)
+    slicer = Slicer(sr=44100, min_length=1000, hop_size=10, max_sil_kept=500)
+    envelope = Envelope.from_audio(y, 44100, base_hop=aligned_hop(slicer.win_size, slicer.hop_size))
+    assert envelope.aligned(slicer.win_size, slicer.hop_size)
+    assert slicer.slice_ranges(y, envelope) == slicer.slice_ranges(y)
+
+
+def test_slice_with_unaligned_envelope_falls_back_to_exact_rms():
+    y = make_audio(12., 2, 44100)
+    slicer = Slicer(sr=44100, min_length=1000, hop_size=10, max_sil_kept=500)
+    envelope = Envelope.from_audio(y, 44100)
+    assert not envelope.aligned(slicer.win_size, slicer.hop_size)
+    assert slicer.slice_ranges(y, envelope) == slicer.slice_ranges(y)
+
+
+def test_load_envelope_caches_next_to_audio(tmp_path):
+    soundfile = pytest.importorskip("soundfile")
+    y = make_audio(2., 1, 8000)
+    audio_path = tmp_path / "vocal.wav"
+    soundfile.write(audio_path, y, 8000)
+    first = load_envelope(audio_path, y, 8000)
+    assert envelope_cache_path(audio_path).exists()
+    second = load_envelope(audio_path, sr=8000)
+    assert second.n_samples == first.n_samples
+    assert np.array_equal(second.levels[0], first.levels[0])
@@ -0,0 +1,60 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from feature_cache import FeatureCache
+
+
+def features(seed, frames=1000):
+    rng = np.random.default_rng(seed)
+    return {"f0": rng.random(frames, dtype=np.float32), "uv": np.ones(frames, dtype=np.float32),
+            "c": rng.random((256, frames), dtype=np.float32)}
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    cache = FeatureCache(tmp_path, compress=compress)
+    audio = np.zeros(44100, dtype=np.float32)
+    key = FeatureCache.key(audio, 44100, "dio", 512)
+    assert cache.get(key) is None
+    cache.put(key, **features(0))
+    cached = cache.get(key)
+    for name, array in features(0).items():
+        assert np.array_equal(cached[name], array)
+    assert key in FeatureCache(tmp_path, compress=compress)
+
+
+def test_key_depends_on_parameters():
+    audio = np.zeros(100, dtype=np.float32)
+    keys = {FeatureCache.key(audio, 44100, "dio", 512), FeatureCache.key(audio, 44100, "harvest", 512),
+            FeatureCache.key(audio, 22050, "dio", 512), FeatureCache.key(audio, 44100, "dio", 256),
+            FeatureCache.key(audio + 1, 44100, "dio", 512)}
+    assert len(keys) == 5
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_size = sum(i.nbytes for i in features(0).values())
+    cache = FeatureCache(tmp_path, max_bytes=int(entry_size * 2.5))
+    for i in range(3):
+        cache.put(f"key{i}", **features(i))
+        # make the order of last use unambiguous
+        past = time.time() - 100 + i
+        os.utime(cache._path(f"key{i}"), (past, past))
+        if i == 1:
+            cache.get("key0")
+    assert "key0" in cache
+    assert "key1" not in cache
+    assert "key2" in cache
+    assert cache.size <= cache.max_bytes
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_storing_an_entry_again_counts_it_once(tmp_path, compress):
+    cache = FeatureCache(tmp_path, compress=compress)
+    cache.put("key0", **features(0))
+    cache.put("key0", **features(1))
+    assert cache.size == FeatureCache(tmp_path).size
+    assert not [i for i in (tmp_path / "ke").iterdir() if i.name.startswith(".")]
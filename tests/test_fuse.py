@@ -0,0 +1,22 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+soundfile = pytest.importorskip("soundfile")
+
+from tests.synthetic import make_audio
+
+
+def test_interleaved_stereo_is_mixed_down(functions, tmp_path):
+    vocal = np.ascontiguousarray(make_audio(1., 2, 44100).T)
+    instrumental = np.ascontiguousarray(make_audio(1., 2, 44100, seed=1).T)
+    output = functions.fuse_vocal_and_instrumental(tmp_path / "vocals.wav", tmp_path / "no_vocals.wav", tmp_path,
+                                                   "alto", vocal=vocal, instrumental=instrumental)
+    fused, sr = soundfile.read(output, dtype="float32")
+    assert sr == 44100 and fused.shape == (44100,)
+    assert np.allclose(fused, vocal.mean(axis=1) + instrumental.mean(axis=1), atol=1e-4)
+
+
+def test_more_dimensions_are_rejected(functions, tmp_path):
+    with pytest.raises(ValueError):
+        functions.fuse_vocal_and_instrumental(tmp_path / "vocals.wav", tmp_path / "no_vocals.wav", tmp_path, "alto",
+                                              vocal=np.zeros((10, 2, 2)), instrumental=np.zeros(10))
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from hub_fetch import fetch_files, parse_hub_link
+
+
+class MockHub:
+    """
+    a local hub, downloads land in cache_dir like they do in the huggingface cache
+    """
+
+    def __init__(self, cache_dir, files):
+        self.cache_dir = cache_dir
+        self.files = files
+        self.listed = 0
+        self.downloaded = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def list_repo_files(self, repo_id, revision=None, token=None):
+        self.listed += 1
+        return list(self.files)
+
+    def hf_hub_download(self, repo_id, filename, revision=None, token=None, force_download=False):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        path = self.cache_dir / repo_id / (revision or "main") / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(self.files[filename])
+        with self.lock:
+            self.active -= 1
+            self.downloaded.append(filename)
+        return str(path)
+
+
+def test_parse_hub_link():
+    assert parse_hub_link("https://huggingface.co/owner/repo") == ("owner/repo", None, None)
+    assert parse_hub_link("https://huggingface.co/owner/repo/tree/main/nahida") == ("owner/repo", "main", "nahida")
+    with pytest.raises(ValueError):
+        parse_hub_link("https://example.com/owner/repo")
+
+
+def test_fetch_matching_files(tmp_path):
+    files = {f"alto/G_{i}.pth": bytes([i]) * 100 for i in range(8)}
+    files.update({"alto/config.json": b"{}", "alto/samples.wav": b"0", "tenor/G_0.pth": b"1", "README.md": b""})
+    hub = MockHub(tmp_path / "cache", files)
+    fetched = fetch_files("https://huggingface.co/owner/repo/tree/main/alto", tmp_path / "models" / "alto",
+                          workers=3, client=hub)
+    assert hub.listed == 1
+    assert sorted(hub.downloaded) == sorted(fetched) == sorted(i for i in files if i.startswith("alto/")
+                                                               and not i.endswith(".wav"))
+    assert 1 < hub.max_active <= 3
+    for name, path in fetched.items():
+        assert path.is_symlink() and path.read_bytes() == files[name]
+        assert path.resolve().is_relative_to((tmp_path / "cache").resolve())
@@ -0,0 +1,59 @@
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import ingest
+from tests.synthetic import make_audio
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(ingest.FFMPEG) is None or shutil.which(ingest.FFPROBE) is None,
+                                  reason="ffmpeg is not installed")
+
+
+def test_command_decodes_to_raw_pcm():
+    command = ingest.ffmpeg_command("in put.mp4", 22050, 1, start=1.5)
+    assert command[0] == ingest.FFMPEG and "in put.mp4" in command
+    assert command[command.index("-f") + 1] == "f32le"
+    assert command[command.index("-ar") + 1] == "22050" and command[command.index("-ac") + 1] == "1"
+    assert command.index("-ss") < command.index("-i") and command[-1] == "pipe:1"
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ingest.decode_audio(tmp_path / "missing.mp4", channels=1)
+
+
+@pytest.fixture
+def stereo_wav(tmp_path):
+    soundfile = pytest.importorskip("soundfile")
+    audio = make_audio(5, 2, 44100).T.astype(np.float32)
+    soundfile.write(tmp_path / "stereo.wav", audio, 44100, subtype="FLOAT")
+    return tmp_path / "stereo.wav", audio
+
+
+@needs_ffmpeg
+def test_decode_matches_soundfile(stereo_wav):
+    path, audio = stereo_wav
+    decoded = ingest.decode_audio(path, 44100)
+    assert decoded.shape == audio.shape
+    assert np.allclose(decoded, audio, atol=1e-6)
+
+
+@needs_ffmpeg
+def test_stream_blocks_are_continuous(stereo_wav):
+    path, audio = stereo_wav
+    blocks = list(ingest.stream_audio(path, 44100, block_size=10000))
+    assert all(i.shape == (10000, 2) for i in blocks[:-1])
+    assert np.allclose(np.concatenate(blocks), audio, atol=1e-6)
+
+
+@needs_ffmpeg
+def test_batch_and_failures(stereo_wav, tmp_path):
+    path, audio = stereo_wav
+    decoded = ingest.decode_batch([path] * 4, 22050, channels=1)
+    assert len(decoded) == 4 and all(i.shape == (audio.shape[0] // 2, 1) for i in decoded)
+    broken = tmp_path / "broken.mp4"
+    broken.write_bytes(b"not a video")
+    with pytest.raises(RuntimeError):
+        ingest.decode_audio(broken, channels=1)
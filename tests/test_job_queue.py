@@ -0,0 +1,111 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from job_queue import OutputStore, SQLiteBroker, Worker
+
+
+def write_upper(payload, work_dir):
+    path = Path(work_dir) / f"{payload['name']}.txt"
+    path.write_text(payload["text"].upper())
+    return {"text": path, "length": len(payload["text"])}
+
+
+@pytest.fixture
+def broker(tmp_path):
+    with SQLiteBroker(tmp_path / "queue.db") as broker:
+        yield broker
+
+
+def test_worker_runs_and_publishes(broker, tmp_path):
+    job_id = broker.submit("upper", {"name": "a", "text": "hello"})
+    worker = Worker(broker, OutputStore(tmp_path / "store"), {"upper": write_upper}, work_path=tmp_path / "work")
+    assert worker.run_once().id == job_id
+    job = broker.get(job_id)
+    assert job.state == "done" and job.attempts == 1
+    assert Path(job.result["text"]).read_text() == "HELLO"
+    assert Path(job.result["text"]).parent == tmp_path / "store" / job_id
+    assert job.result["length"] == 5
+    assert worker.run_once() is None
+
+
+def test_failed_job_is_retried_then_failed(broker, tmp_path):
+    calls = []
+
+    def flaky(payload, work_dir):
+        calls.append(payload)
+        if len(calls) < 2:
+            raise RuntimeError("first attempt fails")
+        return "ok"
+
+    retried = broker.submit("flaky", {}, max_attempts=3)
+    worker = Worker(broker, OutputStore(tmp_path / "store"), {"flaky": flaky})
+    worker.run(max_jobs=2, poll=0)
+    assert broker.get(retried).state == "done" and broker.get(retried).attempts == 2
+
+    broken = broker.submit("broken", {}, max_attempts=2)
+    worker = Worker(broker, OutputStore(tmp_path / "store"), {"broken": lambda p, w: 1 / 0})
+    worker.run(max_jobs=2, poll=0)
+    job = broker.get(broken)
+    assert job.state == "failed" and job.attempts == 2 and "ZeroDivisionError" in job.error
+
+
+def test_expired_lease_is_claimed_again(broker):
+    job_id = broker.submit("upper", {})
+    assert broker.claim("dead", lease_seconds=-1).id == job_id
+    job = broker.claim("alive", lease_seconds=60)
+    assert job.id == job_id and job.attempts == 2
+    # the first worker lost its lease, its result is rejected
+    assert not broker.complete(job_id, "dead", "late")
+    assert not broker.heartbeat(job_id, "dead")
+    assert broker.heartbeat(job_id, "alive")
+    assert broker.complete(job_id, "alive", "ok")
+    assert broker.get(job_id).result == "ok"
+
+
+def test_claim_filters_kinds(broker):
+    broker.submit("separate", {})
+    assert broker.claim("w", kinds=["fuse"]) is None
+    assert broker.claim("w", kinds=["separate"]).kind == "separate"
+
+
+def test_workers_share_the_queue(tmp_path):
+    path = tmp_path / "queue.db"
+    with SQLiteBroker(path) as broker:
+        job_ids = [broker.submit("upper", {"name": str(i), "text": f"job {i}"}) for i in range(20)]
+    store = OutputStore(tmp_path / "store")
+    counts = []
+
+    def run():
+        with SQLiteBroker(path) as broker:
+            counts.append(Worker(broker, store, {"upper": write_upper}).run(idle_seconds=0, poll=0))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    with SQLiteBroker(path) as broker:
+        jobs = broker.wait(job_ids, timeout=5)
+    assert sum(counts) == 20
+    assert all(i.state == "done" and i.attempts == 1 for i in jobs)
+
+
+def test_interrupted_job_stops_its_heartbeat(broker, tmp_path):
+    def interrupted(payload, work_dir):
+        raise KeyboardInterrupt
+
+    broker.submit("interrupted", {})
+    worker = Worker(broker, OutputStore(tmp_path / "store"), {"interrupted": interrupted}, lease_seconds=60)
+    before = threading.active_count()
+    with pytest.raises(KeyboardInterrupt):
+        worker.run_once()
+    assert threading.active_count() == before
+
+
+def test_shared_broker_uses_the_rollback_journal(tmp_path):
+    with SQLiteBroker(tmp_path / "queue.db", shared=True) as broker:
+        assert broker._connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        job_id = broker.submit("upper", {})
+        assert broker.claim("w").id == job_id
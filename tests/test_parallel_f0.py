@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from parallel_f0 import compute_f0_parallel, split_points
+
+
+def zero_crossing_f0(wav, p_len, sampling_rate, hop_length, method, window=2048):
+    # a frame-local pitch estimate, good enough to check chunking and stitching
+    padded = np.pad(wav, window // 2)
+    crossings = np.concatenate([[0], np.cumsum(np.abs(np.diff(np.signbit(padded).astype(np.int8))))])
+    energy = np.concatenate([[0.], np.cumsum(padded.astype(np.float64) ** 2)])
+    start = np.arange(p_len) * hop_length
+    end = start + window
+    f0 = (crossings[end - 1] - crossings[start]) * sampling_rate / (2 * window)
+    rms = np.sqrt((energy[end] - energy[start]) / window)
+    return np.where(rms > 0.01, f0, 0.).astype(np.float32)
+
+
+def singing(seconds=60., sr=16000):
+    t = np.arange(int(seconds * sr)) / sr
+    pitch = 220. * 2 ** (np.sin(2 * np.pi * 0.2 * t) / 2)
+    phase = 2 * np.pi * np.cumsum(pitch) / sr
+    # 4 seconds of singing, 1 second of breath
+    gate = (t % 5.) < 4.
+    return (0.5 * np.sin(phase) * gate).astype(np.float32)
+
+
+def test_split_points_cut_in_silence():
+    audio = singing()
+    points = split_points(audio, 16000, 160, min_chunk_seconds=8., max_chunk_seconds=20.)
+    assert points[0] == 0 and points[-1] == audio.shape[0] // 160 * 160
+    assert len(points) > 3
+    for point in points[1:-1]:
+        assert point % 160 == 0
+        assert (point / 16000) % 5. >= 4.
+
+
+def test_stitched_contour_matches_single_pass():
+    audio = singing()
+    expected = zero_crossing_f0(audio, audio.shape[0] // 160, 16000, 160, "zc")
+    with ThreadPoolExecutor(4) as executor:
+        actual = compute_f0_parallel(audio, 16000, 160, method="zc", min_chunk_seconds=8., max_chunk_seconds=20.,
+                                     f0_fn=zero_crossing_f0, executor=executor)
+    assert actual.shape == expected.shape
+    voiced = (expected > 0) & (actual > 0)
+    assert np.mean((expected > 0) == (actual > 0)) > 0.99
+    assert np.allclose(actual[voiced], expected[voiced], rtol=0.01)
+
+
+def test_process_pool_matches_single_pass():
+    audio = singing(30.)
+    expected = zero_crossing_f0(audio, audio.shape[0] // 160, 16000, 160, "zc")
+    actual = compute_f0_parallel(audio, 16000, 160, method="zc", workers=2, min_chunk_seconds=8.,
+                                 max_chunk_seconds=12., f0_fn=zero_crossing_f0)
+    voiced = (expected > 0) & (actual > 0)
+    assert np.allclose(actual[voiced], expected[voiced], rtol=0.01)
@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+soundfile = pytest.importorskip("soundfile")
+
+from preprocess import FeatureIndex, preprocess_dataset
+from tests.synthetic import make_audio, toy_features
+
+
+def write_slices(directory, count, seed=0, sr=16000):
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        soundfile.write(directory / f"slice_{seed}_{i}.wav", make_audio(0.5, sr=sr, seed=seed * 100 + i), sr)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    write_slices(tmp_path / "train", 5)
+    write_slices(tmp_path / "val", 2, seed=1)
+    return {"train": tmp_path / "train", "val": tmp_path / "val"}
+
+
+def test_features_are_sharded_and_indexed(dataset, tmp_path):
+    index = preprocess_dataset(dataset, feature_fn=toy_features, workers=2, shard_size=3)
+    assert index.root == tmp_path / "features"
+    assert len(index) == 7 and len(index.entries("val")) == 2
+    assert len(list(index.root.glob("shard_*.rms.npy"))) == 3
+    for entry in index.entries():
+        features = index.get(entry)
+        expected = toy_features(entry["path"])
+        assert isinstance(features["rms"], np.memmap)
+        np.testing.assert_allclose(features["rms"], expected["rms"])
+        np.testing.assert_allclose(features["stats"], expected["stats"])
+
+
+def test_rerun_only_processes_new_slices(dataset, tmp_path):
+    preprocess_dataset(dataset, feature_fn=toy_features, workers=1, shard_size=4)
+    before = json.loads((tmp_path / "features" / "index.json").read_text())["features"]
+    write_slices(tmp_path / "train", 2, seed=2)
+    (tmp_path / "val" / "slice_1_0.wav").unlink()
+
+    index = preprocess_dataset(dataset, feature_fn=toy_features, workers=1, shard_size=4)
+    assert len(index) == 8
+    new = {key: value for key, value in index.features.items() if key not in before}
+    assert len(new) == 2 and {i["shard"] for i in new.values()} == {"shard_00002"}
+    assert all(index.features[key] == value for key, value in before.items() if key in index.features)
+    assert index.get(len(index) - 1)["rms"].shape[0] == 31
+
+
+def test_removed_shards_are_deleted(dataset, tmp_path):
+    preprocess_dataset(dataset, feature_fn=toy_features, workers=1, shard_size=5)
+    for i in (tmp_path / "val").iterdir():
+        i.unlink()
+    index = preprocess_dataset(dataset, feature_fn=toy_features, workers=1, shard_size=5)
+    assert sorted(i.name for i in index.root.glob("shard_*")) == ["shard_00000.rms.npy", "shard_00000.stats.npy"]
+    assert FeatureIndex(index.root).entries("val") == []
+
+
+def test_file_lists_are_read(dataset, tmp_path):
+    # the lists preprocess_config writes, one slice per line
+    lists = tmp_path / "filelists"
+    lists.mkdir()
+    slices = sorted((tmp_path / "train").iterdir())
+    (lists / "train.txt").write_text("\n".join(str(i) for i in slices[:3]) + "\n")
+    (lists / "val.txt").write_text(str(slices[3]) + "\n")
+    index = preprocess_dataset({"train": lists / "train.txt", "val": lists / "val.txt", "test": lists / "test.txt"},
+                               output_path=tmp_path / "features", feature_fn=toy_features, workers=1)
+    assert [i["path"] for i in index.entries("train")] == [str(i.resolve()) for i in slices[:3]]
+    assert len(index.entries("val")) == 1 and index.entries("test") == []
+
+
+def test_generate_config_preprocesses_the_listed_slices(functions, monkeypatch, tmp_path):
+    write_slices(tmp_path / "singer", 4)
+
+    def preprocess_config(input_dir, train_list_path, val_list_path, test_list_path, config_path, config_name):
+        # the split of so-vits: the lists name the slices, the config is written next to them
+        slices = sorted(str(i) for i in Path(input_dir).glob("*.wav"))
+        for path, listed in ((train_list_path, slices[:2]), (val_list_path, slices[2:3]), (test_list_path, slices[3:])):
+            Path(path).write_text("\n".join(listed) + "\n")
+        Path(config_path).write_text(json.dumps({"spk": {"singer": 0}}))
+
+    monkeypatch.setattr(functions, "preprocess_config", preprocess_config)
+    monkeypatch.setattr(functions, "so_vits_dataset_path", tmp_path / "datasets")
+    monkeypatch.setattr(functions, "preprocess_dataset",
+                        lambda splits, **kwargs: preprocess_dataset(splits, **{**kwargs, "feature_fn": toy_features}))
+    result = functions.generate_config(tmp_path / "singer", preprocess=True, workers=1)
+    index = FeatureIndex(result["features"])
+    assert result["train"] == tmp_path / "datasets" / "singer" / "filelists" / "train.txt"
+    assert [len(index.entries(i)) for i in ("train", "val", "test")] == [2, 1, 1]
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from classes import DemucsGenerateParam, PresetRegistry, SoVitsGenerationParam
+
+
+@pytest.mark.parametrize("fmt", ["msgpack", "json"])
+def test_round_trip(fmt):
+    pytest.importorskip("msgpack")
+    param = SoVitsGenerationParam(name="alto", input_vocal=Path("vocals.wav"), speaker="alto", noice_scale=0.2)
+    assert SoVitsGenerationParam.loads(param.dumps(fmt), fmt) == param
+
+
+def test_presets_are_hashable():
+    params = {DemucsGenerateParam(split_num=i % 10) for i in range(1000)}
+    assert len(params) == 10
+    assert DemucsGenerateParam(split_num=5).digest() == DemucsGenerateParam(split_num=5).digest()
+    assert DemucsGenerateParam(split_num=5).digest() != DemucsGenerateParam(split_num=6).digest()
+    with pytest.raises(AttributeError):
+        DemucsGenerateParam().split_num = 3
+
+
+def test_kwargs_skip_unset_fields():
+    kwargs = DemucsGenerateParam(name="fast", track_path=Path("a.wav"), split_num=10).kwargs()
+    assert kwargs["split_num"] == 10
+    assert "device" not in kwargs and "jobs" not in kwargs
+
+
+def test_older_presets_load(tmp_path):
+    # presets written from the demucs argv hold every value as a string
+    path = tmp_path / "old.json"
+    path.write_text(json.dumps({"param_type": "DemucsGenerate", "name": "old", "track_path": "/music/a.wav",
+                                "split_num": "10", "save_to_config": "True", "unknown": 1}))
+    param = DemucsGenerateParam.from_file(path)
+    assert param.split_num == 10 and param.save_to_config is True
+    assert param.track_path == Path("/music/a.wav")
+    with pytest.raises(ValueError):
+        SoVitsGenerationParam.from_file(path)
+
+
+def test_fractional_db_threshold_loads():
+    param = SoVitsGenerationParam.from_dict({"param_type": "SoVitsGenerate", "db_threshold": "-37.5"})
+    assert param.db_threshold == -37.5
+
+
+def test_registry_loads_lazily(tmp_path, monkeypatch):
+    registry = PresetRegistry(DemucsGenerateParam, tmp_path)
+    path = registry.add(DemucsGenerateParam(name="fine", split_num=20))
+    registry.add(DemucsGenerateParam(name="coarse", split_num=2))
+    assert sorted(registry.names()) == ["coarse", "fine"]
+
+    loaded = []
+    original = DemucsGenerateParam.from_file.__func__
+    monkeypatch.setattr(DemucsGenerateParam, "from_file",
+                        classmethod(lambda cls, p: loaded.append(p) or original(cls, p)))
+    registry = PresetRegistry(DemucsGenerateParam, tmp_path)
+    assert len(registry) == 2 and loaded == []
+    assert registry["fine"].split_num == 20
+    assert registry["fine"] is registry["fine"]
+    assert loaded == [path]
+    assert registry.get("missing") is None
+    registry.remove("coarse")
+    assert "coarse" not in registry and not (tmp_path / "coarse.json").exists()
@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from quantized import model_name
+
+
+def test_model_name_of_a_bag(tmp_path):
+    (tmp_path / "htdemucs_ft.yaml").write_text("models: [f7e0c4bc, d12395a8]")
+    (tmp_path / "f7e0c4bc-ba3fe64a.th").write_bytes(b"")
+    assert model_name(tmp_path) == "htdemucs_ft"
+
+
+def test_model_name_of_a_single_model(tmp_path):
+    (tmp_path / "955717e8-8726e21a.th").write_bytes(b"")
+    assert model_name(tmp_path) == "955717e8"
+
+
+def test_model_name_needs_exactly_one_model(tmp_path):
+    with pytest.raises(ValueError):
+        model_name(tmp_path)
+    (tmp_path / "hdemucs_mmi.yaml").write_text("")
+    (tmp_path / "htdemucs.yaml").write_text("")
+    with pytest.raises(ValueError):
+        model_name(tmp_path)
+
+
+def test_separate_decoded_audio_without_reading_the_track(monkeypatch, tmp_path):
+    torch = pytest.importorskip("torch")
+    import numpy as np
+    demucs_apply = pytest.importorskip("demucs.apply")
+    import demucs.separate
+    from quantized import separate_in_process
+
+    class Model:
+        audio_channels = 2
+        samplerate = 44100
+        sources = ["drums", "bass", "other", "vocals"]
+
+    def apply_model(model, mix, **kwargs):
+        return torch.stack([mix] * len(model.sources), dim=1)
+
+    def load_track(*args):
+        raise AssertionError("the track must not be read")
+
+    monkeypatch.setattr(demucs_apply, "apply_model", apply_model)
+    monkeypatch.setattr(demucs.separate, "load_track", load_track)
+    (tmp_path / "htdemucs.yaml").write_text("")
+    audio = np.sin(np.linspace(0, 100, 44100, dtype=np.float32)) * 0.5
+    stems = separate_in_process(tmp_path / "missing.mp4", tmp_path / "out", tmp_path, model=Model(), audio=audio)
+    assert stems["vocal"] == tmp_path / "out" / "htdemucs" / "missing" / "vocals.wav"
+    assert stems["vocal"].exists() and stems["instrumental"].exists()
+
+
+def test_quantized_cache_is_stale_once_any_model_file_is_newer(monkeypatch, tmp_path):
+    pytest.importorskip("torch")
+    import os
+    import quantized
+    quantizations = []
+    monkeypatch.setattr(quantized, "quantize_module", lambda module: quantizations.append(module) or len(quantizations))
+    sources = [tmp_path / "htdemucs_ft.yaml", tmp_path / "f7e0c4bc-ba3fe64a.th", tmp_path / "d12395a8-e57c48e6.th"]
+    for i in sources:
+        i.write_bytes(b"")
+        os.utime(i, (1000, 1000))
+    cache = tmp_path / "htdemucs_ft.int8.pt"
+    assert quantized.cached_quantized("model", sources, cache) == 1
+    assert quantized.cached_quantized("model", sources, cache) == 1
+    os.utime(sources[2], None)
+    os.utime(cache, (2000, 2000))
+    assert quantized.cached_quantized("model", sources, cache) == 2
+    assert quantized.cached_quantized("model", [], tmp_path / "content" / "content-vec-best.int8.pt") == 3
+    assert quantized.cached_quantized("other speaker model", [], tmp_path / "content" / "content-vec-best.int8.pt") == 3
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from scheduler import CoreBudgetExecutor, current_budget, job_threads, split_cores, thread_env
+from tests.synthetic import cpu_work, thread_report
+
+
+def test_split_cores_even():
+    assert split_cores([0, 1, 2, 3, 4, 5, 6], 3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert split_cores([0, 1, 2, 3], 1) == [[0, 1, 2, 3]]
+
+
+def test_split_cores_more_workers_than_cores():
+    assert split_cores([0, 1], 3) == [[0], [1], [0]]
+
+
+def test_thread_env():
+    env = thread_env(3)
+    assert env["OMP_NUM_THREADS"] == env["MKL_NUM_THREADS"] == "3"
+    assert thread_env(0)["OMP_NUM_THREADS"] == "1"
+
+
+def test_current_budget_outside_workers(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "2")
+    assert current_budget() == 2
+
+
+def test_executor_gives_every_worker_its_budget():
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    if len(cores) < 2:
+        pytest.skip("needs two cores")
+    with CoreBudgetExecutor(workers=2, cores=cores[:2]) as executor:
+        results = [executor.submit(cpu_work, 32, 2).result() for _ in range(2)]
+    assert all(i["budget"] == 1 and i["omp"] == "1" for i in results)
+
+
+def test_workers_start_with_their_thread_variables():
+    # the variables must be there when the interpreter starts, the BLAS pools are sized when numpy is imported
+    before = dict(os.environ)
+    with CoreBudgetExecutor(workers=2, cores=[0, 0, 0]) as executor:
+        reports = [executor.submit(thread_report).result() for _ in range(4)]
+    if reports[0]["startup_omp"] is None:
+        pytest.skip("needs /proc/self/environ")
+    assert {i["startup_omp"] for i in reports} <= {"1", "2"}
+    assert dict(os.environ) == before
+
+
+def test_workers_blas_pools_fit_their_budget():
+    pytest.importorskip("threadpoolctl")
+    with CoreBudgetExecutor(workers=1, cores=[0, 0]) as executor:
+        report = executor.submit(thread_report).result()
+    assert report["pools"] and all(i <= 2 for i in report["pools"])
+
+
+def test_job_threads_single_threaded_jobs():
+    torch = pytest.importorskip("torch")
+    previous = torch.get_num_threads()
+    with job_threads(4):
+        assert torch.get_num_threads() == 1
+        with job_threads(2):
+            assert torch.get_num_threads() == 1
+        assert torch.get_num_threads() == 1
+    assert torch.get_num_threads() == previous
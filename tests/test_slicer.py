@@ -0,0 +1,108 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tests.synthetic import make_audio
+from Slicer import Slicer, get_rms
+
+
+def strided_rms(y, frame_length=2048, hop_length=512):
+    # the previous librosa-derived implementation, kept as the reference
+    padding = (int(frame_length // 2), int(frame_length // 2))
+    y = np.pad(y, padding, mode="constant")
+    out_strides = y.strides + tuple([y.strides[-1]])
+    x_shape_trimmed = list(y.shape)
+    x_shape_trimmed[-1] -= frame_length - 1
+    out_shape = tuple(x_shape_trimmed) + tuple([frame_length])
+    xw = np.lib.stride_tricks.as_strided(y, shape=out_shape, strides=out_strides)
+    xw = np.moveaxis(xw, -1, -2)
+    x = xw[..., ::hop_length]
+    power = np.mean(np.abs(x) ** 2, axis=-2, keepdims=True)
+    return np.sqrt(power)
+
+
+@pytest.mark.parametrize("frame_length, hop_length", [(2048, 512), (1764, 441), (1001, 250), (64, 64)])
+def test_get_rms_matches_strided_reference(frame_length, hop_length):
+    y = make_audio(2., 1, 44100)
+    expected = strided_rms(y, frame_length, hop_length)
+    actual = get_rms(y, frame_length=frame_length, hop_length=hop_length)
+    assert actual.shape == expected.shape
+    assert actual.dtype == y.dtype
+    assert np.allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_get_rms_multichannel():
+    y = make_audio(2., 3, 22050)
+    actual = get_rms(y, frame_length=882, hop_length=220)
+    assert actual.shape[:2] == (3, 1)
+    for channel in range(3):
+        assert np.allclose(actual[channel], strided_rms(y[channel], 882, 220), rtol=1e-5, atol=1e-6)
+
+
+def test_get_rms_reflect_padding():
+    y = make_audio(1., 1, 8000)
+    librosa = pytest.importorskip("librosa")
+    expected = librosa.feature.rms(y=y, frame_length=400, hop_length=100, pad_mode="reflect")
+    assert np.allclose(get_rms(y, frame_length=400, hop_length=100, pad_mode="reflect"), expected, atol=1e-6)
+
+
+def test_slice_is_unchanged():
+    y = make_audio(12., 1, 44100)
+    slicer = Slicer(sr=44100, min_length=1000, hop_size=10, max_sil_kept=500)
+    chunks = slicer.slice(y)
+    assert len(chunks) == 4
+    assert sum(i.shape[0] for i in chunks) < y.shape[0]
+
+
+def test_downmix_rms_matches_mean_channel():
+    y = make_audio(3., 6, 44100)
+    expected = get_rms(y.mean(axis=0), frame_length=1764, hop_length=441)
+    assert np.allclose(get_rms(y, frame_length=1764, hop_length=441, downmix=True), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_slice_ranges_of_interleaved_audio():
+    interleaved = np.ascontiguousarray(make_audio(12., 2, 44100).T)
+    slicer = Slicer(sr=44100, min_length=1000, hop_size=10, max_sil_kept=500)
+    ranges = slicer.slice_ranges(interleaved.T)
+    chunks = slicer.slice(interleaved.T)
+    assert [end - begin for begin, end in ranges] == [i.shape[-1] for i in chunks]
+    assert all(interleaved[begin:end].flags["C_CONTIGUOUS"] for begin, end in ranges)
+
+
+def test_max_channel_mode_keeps_single_channel_singing():
+    y = make_audio(12., 2, 44100)
+    # the right channel only sings where the left one is silent, the downmix is quiet everywhere
+    y[1] = np.roll(y[0], int(1.5 * 44100)) * 0.15
+    y[0] *= 0.15
+    mean_slicer = Slicer(sr=44100, threshold=-30., min_length=1000, hop_size=10, max_sil_kept=500)
+    max_slicer = Slicer(sr=44100, threshold=-30., min_length=1000, hop_size=10, max_sil_kept=500, channel_mode="max")
+    kept_mean = sum(end - begin for begin, end in mean_slicer.slice_ranges(y))
+    kept_max = sum(end - begin for begin, end in max_slicer.slice_ranges(y))
+    assert kept_max > kept_mean
+
+
+def test_multichannel_slicing_allocates_no_full_length_copy():
+    import tracemalloc
+    y = make_audio(20., 6, 44100)
+    # slice_audio passes the transposed view of interleaved (samples, channels) audio
+    interleaved = np.ascontiguousarray(y.T)
+    for channel_mode in ["mean", "max"]:
+        slicer = Slicer(sr=44100, min_length=1000, hop_size=10, max_sil_kept=500, channel_mode=channel_mode)
+        for waveform in [y, interleaved.T]:
+            tracemalloc.start()
+            slicer.slice_ranges(waveform)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert peak < y[0].nbytes / 4
+
+
+def test_voiced_ranges_cover_tones_only():
+    from Slicer import voiced_ranges
+    y = make_audio(12., 1, 16000)
+    ranges = voiced_ranges(y, 16000, pad=100)
+    # tone bursts are on during [0, 1.5), [3, 4.5), ...
+    assert len(ranges) == 4
+    for i, (begin, end) in enumerate(ranges):
+        assert abs(begin - max(0, (3 * i - 0.1) * 16000)) < 0.05 * 16000
+        assert abs(end - (3 * i + 1.6) * 16000) < 0.05 * 16000
+    assert voiced_ranges(np.zeros(16000, dtype=np.float32), 16000) == []
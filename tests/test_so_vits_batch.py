@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+soundfile = pytest.importorskip("soundfile")
+
+from tests.synthetic import make_audio
+
+
+class StubEngine:
+    """
+    stands in for svc_engine.SvcEngine, every speaker gets the input scaled by its position in the batch
+    """
+    target_sample = 8000
+
+    def __init__(self, feature_cache="cache", f0_workers=1):
+        self.feature_cache = feature_cache
+        self.f0_workers = f0_workers
+        self.calls = []
+        self.batches = []
+        self.cleared = 0
+
+    def infer_batch(self, audios, speakers, **kwargs):
+        self.batches.append(len(audios))
+        self.calls.extend((audio.shape[0], list(i)) for audio, i in zip(audios, speakers))
+        return [{speaker: audio * (k + 1) / 4 for k, speaker in enumerate(i)} for audio, i in zip(audios, speakers)]
+
+    def clear_features(self):
+        self.cleared += 1
+
+    def close(self):
+        raise AssertionError("an engine that is passed in is kept open")
+
+
+@pytest.fixture
+def model(tmp_path):
+    model_path = tmp_path / "G_100.pth"
+    model_path.write_bytes(b"")
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"spk": {"alto": 0, "tenor": 1}}))
+    return model_path, config_path
+
+
+def write_vocal(path, seconds):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    soundfile.write(path, make_audio(seconds, 1, 8000), 8000)
+    return path
+
+
+def test_batch_outputs_follow_jobs(functions, tmp_path, model):
+    first = write_vocal(tmp_path / "a" / "vocal.wav", 1.)
+    second = write_vocal(tmp_path / "b" / "vocal.wav", 2.)
+    engine = StubEngine()
+    jobs = [(second, "tenor"), (first, "alto"), (second, "alto"), (first, "tenor"), (second, "tenor")]
+    paths = functions.apply_so_vits_batch(jobs, tmp_path / "out", *model, engine=engine)
+
+    # one feature extraction per input, shared by all its speakers
+    assert engine.calls == [(16000, ["tenor", "alto"]), (8000, ["alto", "tenor"])]
+    assert engine.cleared >= 2
+    # same stem from two folders, the second input gets an index
+    assert [i.name for i in paths] == ["vocal_generated_with_tenor.wav", "vocal_1_generated_with_alto.wav",
+                                       "vocal_generated_with_alto.wav", "vocal_1_generated_with_tenor.wav",
+                                       "vocal_generated_with_tenor.wav"]
+    assert soundfile.info(paths[0]).frames == 16000
+    assert soundfile.info(paths[1]).frames == 8000
+
+
+def test_batch_inputs_are_converted_together(functions, tmp_path, model):
+    vocals = [write_vocal(tmp_path / f"vocal{i}.wav", 1. + i) for i in range(3)]
+    engine = StubEngine()
+    paths = functions.apply_so_vits_batch([(i, "alto") for i in vocals], tmp_path / "out", *model, engine=engine,
+                                          batch_inputs=2)
+    assert engine.batches == [2, 1]
+    assert [soundfile.info(i).frames for i in paths] == [8000, 16000, 24000]
+
+
+def test_batch_keeps_outputs_of_earlier_calls(functions, tmp_path, model):
+    vocal = write_vocal(tmp_path / "vocal.wav", 1.)
+    first = functions.apply_so_vits_batch([(vocal, "alto")], tmp_path / "out", *model, engine=StubEngine())
+    before = first[0].read_bytes()
+    second = functions.apply_so_vits_batch([(vocal, "alto")], tmp_path / "out", *model, engine=StubEngine())
+    assert second[0] != first[0]
+    assert second[0].name == "vocal_1_generated_with_alto.wav"
+    assert first[0].read_bytes() == before
+
+
+def test_batch_rejects_an_engine_loaded_otherwise(functions, tmp_path, model):
+    vocal = write_vocal(tmp_path / "vocal.wav", 1.)
+    with pytest.raises(ValueError):
+        functions.apply_so_vits_batch([(vocal, "alto")], tmp_path / "out", *model, engine=StubEngine(f0_workers=2))
+    with pytest.raises(ValueError):
+        functions.apply_so_vits_batch([(vocal, "alto")], tmp_path / "out", *model, engine=StubEngine(None))
+
+
+def test_concurrent_batches_take_their_own_names(functions, tmp_path, model):
+    import threading
+    # demucs writes every vocal as vocals.wav, two conversions of them into one folder must not share a name
+    vocals = [write_vocal(tmp_path / str(i) / "vocals.wav", 1. + i) for i in range(2)]
+    start = threading.Barrier(2)
+    results = {}
+
+    def convert(i):
+        start.wait()
+        results[i] = functions.apply_so_vits_batch([(vocals[i], "alto")], tmp_path / "out", *model,
+                                                   engine=StubEngine())[0]
+
+    threads = [threading.Thread(target=convert, args=(i,)) for i in range(2)]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    assert results[0] != results[1]
+    assert sorted(soundfile.info(results[i]).frames for i in range(2)) == [8000, 16000]
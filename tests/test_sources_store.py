@@ -0,0 +1,39 @@
+import json
+import threading
+
+from sources_store import SourcesStore
+
+
+def write_sources(path, models=100):
+    path.write_text(json.dumps({"so-vits": {"model": {
+        f"model{i}": {"link": [], "local": []} for i in range(models)}}}))
+    return path
+
+
+def test_updates_are_written_immediately(tmp_path):
+    path = write_sources(tmp_path / "sources.json")
+    store = SourcesStore(path)
+    store.set_local("so-vits", "model", "model1", {"G.pth": tmp_path / "G.pth"})
+    assert json.loads(path.read_text())["so-vits"]["model"]["model1"]["local"] == {"G.pth": str(tmp_path / "G.pth")}
+    assert [i.name for i in tmp_path.iterdir()] == ["sources.json"]
+
+
+def test_transaction_writes_once(tmp_path, monkeypatch):
+    path = write_sources(tmp_path / "sources.json")
+    store = SourcesStore(path)
+    writes = []
+    write = store._write
+    monkeypatch.setattr(store, "_write", lambda: writes.append(1) or write())
+
+    with store.transaction():
+        workers = [threading.Thread(target=lambda m=m: [
+            store.set_local("so-vits", "model", f"model{m}", {f"file{f}.pth": f"/models/{m}/{f}"}) for f in range(10)
+        ]) for m in range(100)]
+        for i in workers:
+            i.start()
+        for i in workers:
+            i.join()
+        assert writes == []
+    assert writes == [1]
+    model = json.loads(path.read_text())["so-vits"]["model"]["model99"]
+    assert len(model["local"]) == 10
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from streaming import StreamingConverter
+from tests.synthetic import make_audio
+
+SR = 16000
+
+
+def blocks(audio, size):
+    return [audio[i: i + size] for i in range(0, audio.shape[0], size)]
+
+
+@pytest.mark.parametrize("block_size", [160, 1000, 12345])
+def test_identity_round_trip(block_size):
+    audio = make_audio(5, 1, SR).astype(np.float32)
+    converter = StreamingConverter(lambda window: window, SR, chunk_seconds=0.1, context_seconds=0.2,
+                                   crossfade_seconds=0.02)
+    out = np.concatenate(list(converter.convert(blocks(audio, block_size))))
+    assert out.shape == audio.shape
+    assert np.allclose(out, audio, atol=1e-6)
+
+
+def test_latency():
+    converter = StreamingConverter(lambda window: window, SR, chunk_seconds=0.1, context_seconds=0.2,
+                                   crossfade_seconds=0.02)
+    assert converter.latency_seconds == pytest.approx(0.12)
+    # no output until a whole chunk arrived, then the chunk minus the held back cross-fade
+    assert converter.process(np.zeros(1599, dtype=np.float32)) == []
+    first, = converter.process(np.zeros(1, dtype=np.float32))
+    assert first.shape[0] == 1600 - 320
+    second, = converter.process(np.zeros(1600, dtype=np.float32))
+    assert second.shape[0] == 1600
+
+
+def test_block_edges_are_continuous():
+    calls = []
+
+    def drifting(window):
+        # every window comes out with its own offset, like a model that is not exactly consistent between windows
+        calls.append(1)
+        time.sleep(0.001)
+        return window + 0.05 * (len(calls) % 2)
+
+    audio = np.zeros(SR * 2, dtype=np.float32)
+    converter = StreamingConverter(drifting, SR, chunk_seconds=0.1, context_seconds=0.2, crossfade_seconds=0.02,
+                                   latency_budget=10.)
+    out = np.concatenate(list(converter.convert(blocks(audio, 512))))
+    assert out.shape == audio.shape
+    # a jump of 0.05 is spread over the 320 samples of the cross-fade
+    assert np.abs(np.diff(out)).max() < 0.05 / 320 * 2
+    assert len(converter.stats) == len(calls)
+    assert all(0 < i.realtime_factor < 1 and not i.over_budget for i in converter.stats)
+    assert converter.stats[0].latency_seconds > converter.latency_seconds
@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("so_vits_svc_fork")
+
+from svc_engine import SvcEngine
+from Slicer import voiced_ranges
+
+
+class StubEngine(SvcEngine):
+    """
+    SvcEngine without a model, every speaker gets its padded chunk back scaled by its position
+    """
+
+    def __init__(self, sr):
+        self.target_sample = sr
+        self.f0_workers = 1
+        self.features = {}
+        self._f0_pending = {}
+        self.chunks = []
+        self.batches = []
+
+    def infer_chunks(self, items, transpose=0, **kwargs):
+        self.chunks.extend(audio.shape[0] for audio, _ in items)
+        self.batches.append(len(items))
+        return [[audio * (i + 1) for i in range(len(speakers))] for audio, speakers in items]
+
+
+def test_voiced_ranges_land_at_their_positions():
+    sr = 16000
+    t = np.arange(12 * sr) / sr
+    audio = np.zeros(t.shape[0], dtype=np.float32)
+    for begin, end in [(1., 3.), (6., 6.5), (9., 11.)]:
+        gate = (t >= begin) & (t < end)
+        audio[gate] = 0.5 * np.sin(2 * np.pi * 220 * t[gate])
+    engine = StubEngine(sr)
+    converted = engine.infer_voiced_speakers(audio, speakers=["alto", "tenor"], pad_seconds=0.2,
+                                             max_chunk_seconds=1.5)
+
+    ranges = voiced_ranges(audio, sr, pad=200)
+    assert len(ranges) == 3
+    voiced = np.zeros(audio.shape[0], dtype=bool)
+    for begin, end in ranges:
+        voiced[begin:end] = True
+    for scale, speaker in enumerate(["alto", "tenor"], 1):
+        assert converted[speaker].shape == audio.shape
+        assert np.array_equal(converted[speaker][voiced], audio[voiced] * scale)
+        assert not converted[speaker][~voiced].any()
+    # the 2 second ranges are split in chunks of max_chunk_seconds
+    assert len(engine.chunks) == 5
+
+
+def test_chunks_of_several_vocals_share_forward_passes():
+    sr = 16000
+    t = np.arange(4 * sr) / sr
+    first = np.where((t >= 1) & (t < 3), 0.5 * np.sin(2 * np.pi * 220 * t), 0).astype(np.float32)
+    second = np.where(t < 1.5, 0.5 * np.sin(2 * np.pi * 330 * t), 0).astype(np.float32)
+    engine = StubEngine(sr)
+    converted = engine.infer_batch([first, second], [["alto"], ["alto", "tenor"]], skip_silence=True,
+                                   pad_seconds=0.2, max_chunk_seconds=10, max_batch=8)
+
+    assert engine.batches == [2]
+    alone = [StubEngine(sr).infer_voiced_speakers(audio, speakers=speakers, pad_seconds=0.2, max_chunk_seconds=10)
+             for audio, speakers in [(first, ["alto"]), (second, ["alto", "tenor"])]]
+    for batched, single in zip(converted, alone):
+        assert batched.keys() == single.keys()
+        for speaker in batched:
+            assert np.array_equal(batched[speaker], single[speaker])
@@ -0,0 +1,99 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from sweep import TaskGraph, expand_grid, format_table, run_sweep, save_table
+
+
+def test_expand_grid():
+    grid = expand_grid({"split_num": [5, 10], "clip_mode": "rescale", "shifts": [1, 2]})
+    assert len(grid) == 4
+    assert grid[0] == {"split_num": 5, "clip_mode": "rescale", "shifts": 1}
+    assert expand_grid({}) == [{}]
+
+
+def test_shared_tasks_run_once():
+    calls = []
+    graph = TaskGraph()
+    graph.add("a", lambda: calls.append("a") or 1)
+    graph.add("a", lambda: calls.append("again") or 2)
+    graph.add("b", lambda a: a + 1, ["a"])
+    graph.add("c", lambda a, b: a + b, ["a", "b"])
+    results = graph.run(workers=2)
+    assert calls == ["a"]
+    assert {key: result for key, (result, _) in results.items()} == {"a": 1, "b": 2, "c": 3}
+
+
+def test_missing_dependency():
+    with pytest.raises(KeyError):
+        TaskGraph().add("b", lambda a: a, ["a"])
+
+
+def test_sweep(tmp_path):
+    lock = threading.Lock()
+    separations = []
+    active = [0, 0]
+
+    def separate_fn(track_path, output_path, **params):
+        with lock:
+            separations.append(params)
+        return {"vocal": Path(output_path) / "vocals.wav"}
+
+    def convert_fn(separated, output_path, **params):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        assert params["speaker"] == "singer"
+        return Path(output_path) / f"{separated['vocal'].stem}_{params['noice_scale']}.wav"
+
+    rows = run_sweep(
+        Path("track.wav"),
+        tmp_path,
+        {"split_num": [5, 10], "shifts": [1]},
+        {"noice_scale": [0.2, 0.4], "f0_method": ["dio", "harvest"]},
+        {"speaker": "singer"},
+        workers=4,
+        separate_fn=separate_fn,
+        convert_fn=convert_fn,
+    )
+    assert len(separations) == 2
+    assert len(rows) == 8
+    assert len({row["output"].parent for row in rows}) == 8
+    assert active[1] > 1
+    assert all(row["convert_seconds"] >= 0.05 for row in rows)
+
+    table = format_table(rows)
+    assert len(table.splitlines()) == 10
+    assert "separate_seconds" in table.splitlines()[0]
+    assert len(save_table(rows, tmp_path / "sweep.csv").read_text().splitlines()) == 9
+
+
+def test_failed_combination_is_reported(tmp_path):
+    def separate_fn(track_path, output_path, **params):
+        if params["split_num"] == 10:
+            raise RuntimeError("demucs failed")
+        return {"vocal": Path(output_path) / "vocals.wav"}
+
+    def convert_fn(separated, output_path, **params):
+        if params["noice_scale"] == 0.4:
+            raise ValueError("bad noise scale")
+        return Path(output_path) / "converted.wav"
+
+    rows = run_sweep(Path("track.wav"), tmp_path, {"split_num": [5, 10]}, {"noice_scale": [0.2, 0.4]}, {},
+                     workers=2, separate_fn=separate_fn, convert_fn=convert_fn)
+    assert [(row["split_num"], row["noice_scale"], row["error"]) for row in rows] == [
+        (5, 0.2, ""), (5, 0.4, "bad noise scale"), (10, 0.2, "demucs failed"), (10, 0.4, "demucs failed")]
+    assert rows[0]["output"] is not None
+    assert all(row["output"] is None for row in rows[1:])
+
+
+def test_task_errors_are_raised_by_default():
+    graph = TaskGraph()
+    graph.add("a", lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        graph.run(workers=1)
@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def utilities(backend_environment):
+    return pytest.importorskip("utilities")
+
+
+def test_configured_roots_are_never_removed(utilities):
+    import environment
+    model = environment.demucs_model_path.joinpath("hdemucs_mmi")
+    model.mkdir(parents=True, exist_ok=True)
+    weights = model.joinpath("weights.th")
+    weights.write_bytes(b"0")
+    assert not utilities.remove_local_file(environment.demucs_model_path)
+    assert not utilities.remove_local_file(environment.demucs_model_path.parent)
+    assert weights.exists()
+    assert utilities.remove_local_file(weights) and not weights.exists()
+
+
+def test_download_path_records_the_file(utilities, monkeypatch, tmp_path):
+    recorded, blobs = [], []
+    monkeypatch.setattr(utilities.sources_store, "set_local", lambda *args: recorded.append(args))
+    monkeypatch.setattr(utilities, "open_catalog",
+                        lambda: type("Catalog", (), {"add_blob": lambda self, *args: blobs.append(args)})())
+    utilities.update_download_path("demucs", "model", "hdemucs_mmi", "weights.th", tmp_path)
+    assert recorded == [("demucs", "model", "hdemucs_mmi", {"weights.th": tmp_path / "hdemucs_mmi" / "weights.th"})]
+    assert blobs[0][0] == tmp_path / "hdemucs_mmi" / "weights.th"
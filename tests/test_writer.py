@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+soundfile = pytest.importorskip("soundfile")
+
+from writer import AsyncWriter, encode
+
+
+@pytest.mark.parametrize("extension", ["wav", "flac", "ogg"])
+def test_encode_round_trip(tmp_path, extension):
+    audio = np.sin(np.linspace(0, 2000, 22050, dtype=np.float32)).reshape(-1, 1) * 0.5
+    path = encode(tmp_path / f"out.{extension}", audio, 22050)
+    read, sr = soundfile.read(path, always_2d=True)
+    assert sr == 22050 and read.shape[1] == 1
+    assert abs(read.shape[0] - audio.shape[0]) < 2048
+    assert [i.name for i in tmp_path.iterdir()] == [f"out.{extension}"]
+
+
+def test_concurrent_encodes_of_one_path_use_their_own_temporary_file(tmp_path, monkeypatch):
+    import writer as writer_module
+    both_writing = threading.Barrier(2, timeout=5)
+    temporary = []
+    write = soundfile.write
+
+    def paired_write(file, *args, **kwargs):
+        temporary.append(file)
+        both_writing.wait()
+        write(file, *args, **kwargs)
+
+    monkeypatch.setattr(writer_module.soundfile, "write", paired_write)
+    audio = np.zeros((1000, 1), dtype=np.float32)
+    with AsyncWriter(workers=2) as writer:
+        writer.submit(tmp_path / "out.wav", audio, 8000)
+        writer.submit(tmp_path / "out.wav", audio + 0.1, 8000)
+        assert writer.wait() == [tmp_path / "out.wav"] * 2
+    assert len(set(temporary)) == 2
+    assert [i.name for i in tmp_path.iterdir()] == ["out.wav"]
+
+
+def test_async_writer_returns_futures_in_order(tmp_path):
+    audio = np.zeros((1000, 2), dtype=np.float32)
+    with AsyncWriter(workers=3, max_pending=2) as writer:
+        futures = [writer.submit(tmp_path / f"{i}.wav", audio + i / 10, 8000) for i in range(6)]
+        paths = writer.wait()
+    assert paths == [tmp_path / f"{i}.wav" for i in range(6)]
+    assert [i.result() for i in futures] == paths
+    assert soundfile.read(paths[3])[0][0, 0] == pytest.approx(0.3, abs=1e-3)
+
+
+def test_async_writer_bounds_pending(tmp_path, monkeypatch):
+    import writer as writer_module
+    release = threading.Event()
+    running = []
+
+    def slow_encode(path, audio, sr, extension=None):
+        running.append(path)
+        release.wait(5)
+        return path
+
+    monkeypatch.setattr(writer_module, "encode", slow_encode)
+    writer = AsyncWriter(workers=1, max_pending=2)
+    writer.submit(tmp_path / "a.wav", np.zeros(10), 8000)
+    writer.submit(tmp_path / "b.wav", np.zeros(10), 8000)
+    blocked = threading.Thread(target=writer.submit, args=(tmp_path / "c.wav", np.zeros(10), 8000))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(5)
+    assert len(writer.wait()) == 3
+    writer.close()
+
+
+def test_async_writer_surfaces_errors(tmp_path):
+    with AsyncWriter() as writer:
+        future = writer.submit(tmp_path / "bad.wav", np.zeros(10, dtype=np.float32), 8000, extension="nope")
+        with pytest.raises(Exception):
+            future.result()
+
+
+@pytest.mark.parametrize("with_writer", [False, True])
+def test_demucs_wav_stem_is_encoded_to_the_extension_asked(functions, tmp_path, with_writer):
+    wav = tmp_path / "vocals.wav"
+    soundfile.write(wav, np.zeros((1000, 2), dtype=np.float32), 44100)
+    if with_writer:
+        with AsyncWriter() as writer:
+            path = functions.encode_stem(wav, "flac", writer).result()
+            writer.wait()
+    else:
+        path = functions.encode_stem(wav, "flac")
+    assert path == tmp_path / "vocals.flac"
+    assert soundfile.read(path, always_2d=True)[0].shape == (1000, 2)
+    assert not wav.exists()